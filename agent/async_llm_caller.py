@@ -0,0 +1,334 @@
+import asyncio
+import dataclasses
+import logging
+import os
+from typing import Optional
+
+from openai.types.responses import ResponseInputParam
+from slack_sdk.web.async_chat_stream import AsyncChatStream
+
+from agent.cache import AsyncRecordingStreamer
+from agent.clients import get_async_huggingface_client, get_async_openai_client
+from agent.deadlines import Deadline
+from agent.failover import (
+    CUT_OFF_NOTICE,
+    UNAVAILABLE_MESSAGE,
+    Failover,
+    PreparedRequest,
+    prepare_request,
+)
+from agent.fast_path import mentions_dice
+from agent.formatter import SlackMarkdownFormatter
+from agent.hedging import async_hedged_stream
+from agent.large_input import async_map_reduce, plan_large_input
+from agent.llm_caller import (
+    _contextual_fallback_response,
+    _dice_reply,
+    _fast_path_reply,
+    _huggingface_request,
+    _next_round_input,
+    _OpenAIRound,
+    _split_conversation,
+    _tool_call_outputs,
+    _with_banner,
+)
+from agent.prompts import SYSTEM_PROMPT, latest_user_message
+from agent.providers import get_providers, register_provider
+from agent.single_flight import async_single_flight
+from agent.streaming import (
+    AsyncCoalescingStreamer,
+    AsyncMarkdownStream,
+    FlushPolicy,
+    StreamCancelled,
+    StreamTimer,
+)
+from agent.tools.runner import RoundTimings, ToolLoopSettings, run_tool_calls
+
+logger = logging.getLogger(__name__)
+
+
+async def call_llm(
+    streamer: AsyncChatStream,
+    prompts: ResponseInputParam,
+    deadline: Optional[Deadline] = None,
+):
+    """
+    Async version of agent.llm_caller.call_llm for the asyncio app
+
+    Provider streams are awaited instead of holding a thread each, so one event
+    loop can serve many conversations at once. Routing, circuit breakers,
+    hedging, deadlines and coalescing work the same as in the sync version.
+    """
+    writer = AsyncCoalescingStreamer(streamer, FlushPolicy.from_env())
+    if deadline is None:
+        deadline = Deadline.start()
+    try:
+        await _call_llm_with_fallback(writer, prompts, deadline)
+    finally:
+        await writer.flush()
+
+
+async def _call_llm_with_fallback(
+    streamer: AsyncMarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """Try providers in the order picked by the router until one succeeds"""
+    user_message = latest_user_message(prompts)
+    # Greetings, help requests and dice rolls are answered without a provider
+    reply = _fast_path_reply(user_message)
+    if reply is not None:
+        await streamer.append(markdown_text=reply)
+        return
+    request = prepare_request(prompts, user_message, mentions_dice(user_message))
+
+    hit = await asyncio.to_thread(request.cache.lookup, request.providers)
+    if hit is not None:
+        # The whole response is appended at once and goes out with the flush
+        await streamer.append(markdown_text=request.replay(hit))
+        return
+
+    plan = plan_large_input(user_message) if request.providers else None
+    if plan is not None:
+        request.decision.details["large_input_parts"] = len(plan.chunks)
+        await async_map_reduce(
+            streamer,
+            request.prompts,
+            plan,
+            request.providers,
+            deadline,
+            lambda target, merged: _stream_from_providers(
+                target, merged, plan.question, request, deadline
+            ),
+        )
+        return
+
+    async def generate(target: AsyncMarkdownStream):
+        await _stream_from_providers(
+            target, request.prompts, user_message, request, deadline
+        )
+
+    key = request.single_flight_key()
+    if key is not None:
+        request.decision.details["coalesced"] = await async_single_flight(
+            key, streamer, generate
+        )
+    else:
+        await generate(streamer)
+
+
+async def _stream_from_providers(
+    streamer: AsyncMarkdownStream,
+    prompts: ResponseInputParam,
+    user_message: str,
+    request: PreparedRequest,
+    deadline: Deadline,
+):
+    """Stream from the ranked providers, then the local fallback if all fail"""
+    cache = request.cache
+    failover = Failover(request.decision, deadline)
+    for provider in failover:
+        # Also tells whether the attempt showed anything before it failed
+        target = AsyncRecordingStreamer(streamer)
+        try:
+            logger.info(f"Trying {provider.name} ({provider.model})")
+            if failover.should_hedge():
+                served = await async_hedged_stream(
+                    target,
+                    prompts,
+                    provider,
+                    failover.next_available,
+                    failover.hedging,
+                    deadline,
+                )
+            else:
+                await provider.arun(target, prompts, deadline)
+                served = provider
+        except StreamCancelled:
+            # Nobody is reading the response any more
+            raise
+        except Exception as provider_error:
+            if failover.failed(provider, provider_error, target.text):
+                continue
+            await streamer.append(markdown_text=CUT_OFF_NOTICE)
+            return
+        failover.succeeded(served)
+        if cache.enabled and target.cacheable:
+            await asyncio.to_thread(cache.store, served, target.text)
+        return
+
+    failover.exhausted()
+    try:
+        await _call_local_fallback(streamer, user_message)
+    except StreamCancelled:
+        raise
+    except Exception as local_error:
+        logger.error(f"Local fallback failed: {local_error}")
+        await streamer.append(markdown_text=UNAVAILABLE_MESSAGE)
+
+
+async def _call_local_fallback(streamer: AsyncMarkdownStream, user_message: str):
+    """Answer without any provider once all of them have failed"""
+    response_text = _dice_reply(user_message)
+    if response_text is None:
+        response_text = _contextual_fallback_response(user_message)
+    await streamer.append(markdown_text=response_text)
+
+
+async def _call_openai_llm(
+    streamer: AsyncMarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """Async version of the OpenAI tool loop in agent.llm_caller"""
+    llm = get_async_openai_client(api_key=os.getenv("OPENAI_API_KEY"))
+    settings = ToolLoopSettings.from_env()
+    timings = RoundTimings()
+    history = list(prompts)
+    round_input = history
+    previous_response_id = None
+    try:
+        for round_number in range(1, settings.max_rounds + 1):
+            timings.start_round()
+            openai_round = _OpenAIRound(timings)
+            await _stream_openai_round(
+                streamer,
+                llm,
+                openai_round,
+                round_input,
+                previous_response_id,
+                round_number < settings.max_rounds,
+                deadline,
+            )
+            tool_calls = openai_round.tool_calls
+            timings.end_model(len(tool_calls))
+            if not tool_calls:
+                return
+            # The tools run on the shared tool workers (LLM_TOOL_WORKERS), as in
+            # the sync app, rather than one thread each
+            results = await asyncio.to_thread(
+                run_tool_calls, tool_calls, settings.workers
+            )
+            outputs, chunks = _tool_call_outputs(tool_calls, results)
+            await streamer.append(chunks=chunks)
+            timings.end_tools()
+            round_input, previous_response_id = _next_round_input(
+                settings, history, tool_calls, outputs, openai_round.response_id
+            )
+    finally:
+        timings.report("openai")
+
+
+async def _stream_openai_round(
+    streamer: AsyncMarkdownStream,
+    llm,
+    openai_round: _OpenAIRound,
+    round_input: ResponseInputParam,
+    previous_response_id: Optional[str],
+    allow_tools: bool,
+    deadline: Deadline,
+):
+    """Stream one response into the streamer"""
+    watch = deadline.watch("openai")
+    try:
+        response = await llm.responses.create(
+            **openai_round.request(
+                round_input, previous_response_id, allow_tools, watch.timeout()
+            )
+        )
+        async with response:
+            async for event in response:
+                watch.tick(event.type.endswith(".delta"))
+                append = openai_round.handle(event)
+                if append:
+                    await streamer.append(**append)
+    finally:
+        openai_round.timer.report()
+
+    text = openai_round.finish()
+    if text:
+        await streamer.append(markdown_text=text)
+
+
+async def _call_huggingface_fallback(
+    streamer: AsyncMarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """Async version of the Hugging Face fallback in agent.llm_caller"""
+    conversation_history, user_message = _split_conversation(prompts)
+    user_message = user_message or "Hello! How can I help you today?"
+
+    response_text = _dice_reply(user_message)
+    if response_text is not None:
+        await streamer.append(markdown_text=response_text)
+        return
+
+    if not await _stream_huggingface_chat_completion(
+        streamer, SYSTEM_PROMPT, user_message, conversation_history, deadline
+    ):
+        raise RuntimeError("huggingface returned an empty response")
+
+
+async def _stream_huggingface_chat_completion(
+    streamer: AsyncMarkdownStream,
+    system_prompt: str,
+    user_message: str,
+    conversation_history: list,
+    deadline: Deadline,
+) -> bool:
+    """Stream a Hugging Face chat completion with the AsyncInferenceClient"""
+    api_key = os.getenv("HUGGINGFACE_API_KEY")
+    if not api_key:
+        logger.warning("HUGGINGFACE_API_KEY not found")
+        return False
+
+    formatter = SlackMarkdownFormatter()
+    timer = StreamTimer("huggingface")
+    watch = deadline.watch("huggingface")
+    try:
+        # The async client's timeout limits the whole stream, not each read; the
+        # first-token and stall budgets are enforced per chunk by the watch
+        client = get_async_huggingface_client(api_key, timeout=watch.total_timeout())
+        stream = await asyncio.wait_for(
+            client.chat_completion(
+                **_huggingface_request(
+                    system_prompt, user_message, conversation_history
+                )
+            ),
+            watch.read_timeout(),
+        )
+        try:
+            while True:
+                try:
+                    chunk = await watch.next_event(stream)
+                except StopAsyncIteration:
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                watch.tick(bool(delta))
+                if not delta:
+                    continue
+                timer.mark(delta)
+                text = _with_banner(formatter, formatter.feed, delta)
+                if text:
+                    await streamer.append(markdown_text=text)
+        finally:
+            # Releases the aiohttp session if the stream is cut short
+            await stream.aclose()
+    except Exception as e:
+        logger.error(f"Error streaming Hugging Face Chat Completion API: {e}")
+        raise
+    finally:
+        timer.report()
+
+    text = _with_banner(formatter, formatter.finish)
+    if text:
+        await streamer.append(markdown_text=text)
+    return formatter.started
+
+
+_ASYNC_STREAMS = {
+    "openai": _call_openai_llm,
+    "huggingface": _call_huggingface_fallback,
+}
+
+# The sync module registers these providers; give them their async streams
+for _provider in get_providers():
+    if _provider.name in _ASYNC_STREAMS and _provider.astream is None:
+        register_provider(
+            dataclasses.replace(_provider, astream=_ASYNC_STREAMS[_provider.name])
+        )
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai.types.responses import ResponseInputParam
+
+from agent.prompts import SYSTEM_PROMPT
+from agent.providers import Provider
+from agent.semantic_cache import get_semantic_cache
+from agent.store import get_response_store
+from agent.streaming import AsyncMarkdownStream, MarkdownStream
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CacheSettings:
+    """
+    Settings for reusing LLM responses to identical prompts
+
+    Args:
+        enabled: Replay cached responses instead of calling a provider
+        max_entries: Responses kept before the least recently used is evicted
+        max_chars: Total response text kept before evicting
+        ttl: Seconds a response stays valid
+    """
+
+    enabled: bool = False
+    max_entries: int = 512
+    max_chars: int = 2_000_000
+    ttl: float = 3600.0
+
+    @classmethod
+    def from_env(cls) -> "CacheSettings":
+        return cls(
+            enabled=os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true",
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", cls.max_entries)),
+            max_chars=int(os.getenv("LLM_CACHE_MAX_CHARS", cls.max_chars)),
+            ttl=float(os.getenv("LLM_CACHE_TTL", cls.ttl)),
+        )
+
+
+def _normalize(text: str) -> str:
+    # Trailing spaces and line endings don't change the question, indentation does
+    lines = text.replace("\r\n", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def cache_key(
+    prompts: ResponseInputParam,
+    provider: Provider,
+    system_prompt: str = SYSTEM_PROMPT,
+) -> str:
+    """Key for a response to prompts from this provider's current model"""
+    messages = [
+        [prompt.get("role"), _normalize(str(prompt.get("content") or ""))]
+        for prompt in prompts
+        if isinstance(prompt, dict)
+    ]
+    material = json.dumps(
+        [_normalize(system_prompt), messages, provider.name, provider.model],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(prompts: ResponseInputParam, needs_tools: bool) -> bool:
+    """Requests that may call tools (e.g. roll_dice) must not be answered from cache"""
+    if needs_tools:
+        return False
+    return all(
+        isinstance(prompt, dict)
+        and prompt.get("role") in ("system", "user", "assistant")
+        for prompt in prompts
+    )
+
+
+class ResponseCache:
+    """
+    In-memory LRU cache of complete LLM responses with a TTL
+
+    Bounded by both entry count and total characters; the least recently used
+    entries are evicted first, expired ones when they are next looked up.
+    """
+
+    def __init__(self, settings: Optional[CacheSettings] = None, clock=time.monotonic):
+        self.settings = settings or CacheSettings()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._chars = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "bypasses": 0,
+            "stores": 0,
+        }
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, text = entry
+            if self._clock() >= expires_at:
+                self._remove(key)
+                self._stats["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return text
+
+    def put(self, key: str, text: str):
+        if len(text) > self.settings.max_chars:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + self.settings.ttl, text)
+            self._chars += len(text)
+            self._stats["stores"] += 1
+            while self._entries and (
+                len(self._entries) > self.settings.max_entries
+                or self._chars > self.settings.max_chars
+            ):
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def lookup(
+        self, prompts: ResponseInputParam, providers: List[Provider]
+    ) -> Optional[Tuple[Provider, str]]:
+        """Find a cached response from any of providers, in their routing order"""
+        for provider in providers:
+            text = self.get(cache_key(prompts, provider))
+            if text is not None:
+                self.count("hits")
+                return provider, text
+        self.count("misses")
+        return None
+
+    def count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["chars"] = self._chars
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _remove(self, key: str):
+        _, text = self._entries.pop(key)
+        self._chars -= len(text)
+
+
+class RecordingStreamer:
+    """
+    Passes appends through while keeping the text for the cache
+
+    A response that shows task chunks (a tool call) is not recorded.
+    """
+
+    def __init__(self, streamer: MarkdownStream):
+        self._streamer = streamer
+        self._parts: List[str] = []
+        self.cacheable = True
+
+    def append(self, *, markdown_text: Optional[str] = None, chunks=None, **kwargs):
+        self._record(markdown_text, chunks)
+        return self._streamer.append(
+            markdown_text=markdown_text, chunks=chunks, **kwargs
+        )
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def _record(self, markdown_text: Optional[str], chunks):
+        if markdown_text:
+            self._parts.append(markdown_text)
+        if chunks:
+            self.cacheable = False
+
+
+class AsyncRecordingStreamer(RecordingStreamer):
+    """RecordingStreamer for an async stream"""
+
+    def __init__(self, streamer: AsyncMarkdownStream):
+        super().__init__(streamer)  # type: ignore[arg-type]
+
+    async def append(  # type: ignore[override]
+        self, *, markdown_text: Optional[str] = None, chunks=None, **kwargs
+    ):
+        self._record(markdown_text, chunks)
+        return await self._streamer.append(
+            markdown_text=markdown_text, chunks=chunks, **kwargs
+        )
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+_cache_loaded = False
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if caching is disabled"""
+    global _cache, _cache_loaded
+    if not _cache_loaded:
+        with _cache_lock:
+            if not _cache_loaded:
+                settings = CacheSettings.from_env()
+                _cache = ResponseCache(settings) if settings.enabled else None
+                _cache_loaded = True
+    return _cache
+
+
+class RequestCache:
+    """
+    The exact, on-disk and semantic response caches as used by one call_llm request
+
+    enabled is False when all caches are off or the request may call tools.
+    """
+
+    def __init__(self, prompts: ResponseInputParam, needs_tools: bool):
+        self._prompts = prompts
+        self._exact = get_response_cache()
+        self._store = get_response_store()
+        self._semantic = get_semantic_cache()
+        self.enabled = False
+        if any(
+            cache is not None for cache in (self._exact, self._store, self._semantic)
+        ):
+            self.enabled = is_cacheable(prompts, needs_tools)
+            if not self.enabled and self._exact is not None:
+                self._exact.count("bypasses")
+
+    def lookup(self, providers: List[Provider]) -> Optional[Tuple[Provider, str]]:
+        """A cached (provider, response) for the request, exact matches first"""
+        if not self.enabled:
+            return None
+        hit = None
+        if self._exact is not None:
+            hit = self._exact.lookup(self._prompts, providers)
+        if hit is None and self._store is not None:
+            hit = self._lookup_store(providers)
+        if hit is None and self._semantic is not None:
+            hit = self._semantic.lookup(self._prompts, providers)
+        return hit
+
+    def store(self, provider: Provider, text: str):
+        if not self.enabled or not text:
+            return
+        key = cache_key(self._prompts, provider)
+        if self._exact is not None:
+            self._exact.put(key, text)
+        if self._store is not None:
+            try:
+                self._store.put(key, text)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write to the response store: {e}")
+        if self._semantic is not None:
+            self._semantic.put(self._prompts, provider, text)
+
+    def _lookup_store(
+        self, providers: List[Provider]
+    ) -> Optional[Tuple[Provider, str]]:
+        for provider in providers:
+            key = cache_key(self._prompts, provider)
+            try:
+                text = self._store.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read the response store: {e}")
+                return None
+            if text is not None:
+                # Later lookups in this process can skip the database
+                if self._exact is not None:
+                    self._exact.put(key, text)
+                return provider, text
+        return None
+
+
+def cache_stats() -> Optional[Dict[str, Any]]:
+    """Hit, miss and eviction counts of the response cache, None if disabled"""
+    cache = get_response_cache()
+    return cache.stats() if cache is not None else None
@@ -0,0 +1,303 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+HUGGINGFACE_ROUTER_URL = "https://router.huggingface.co/v1"
+
+
+@dataclass(frozen=True)
+class HttpPoolSettings:
+    """
+    Connection pool and timeout settings shared by all LLM provider clients
+
+    Args:
+        max_connections: Upper bound on open connections per client
+        max_keepalive_connections: Idle connections kept open for reuse
+        keepalive_expiry: Seconds an idle connection is kept before closing
+        connect_timeout: Seconds allowed to establish a connection
+        timeout: Seconds allowed for reads and writes on a connection
+    """
+
+    max_connections: int = 32
+    max_keepalive_connections: int = 16
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    timeout: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "HttpPoolSettings":
+        return cls(
+            max_connections=int(
+                os.getenv("LLM_HTTP_MAX_CONNECTIONS", cls.max_connections)
+            ),
+            max_keepalive_connections=int(
+                os.getenv("LLM_HTTP_MAX_KEEPALIVE", cls.max_keepalive_connections)
+            ),
+            keepalive_expiry=float(
+                os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", cls.keepalive_expiry)
+            ),
+            connect_timeout=float(
+                os.getenv("LLM_HTTP_CONNECT_TIMEOUT", cls.connect_timeout)
+            ),
+            timeout=float(os.getenv("LLM_HTTP_TIMEOUT", cls.timeout)),
+        )
+
+    def httpx_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+
+_lock = threading.RLock()
+_settings: Optional[HttpPoolSettings] = None
+_openai_clients: Dict[Tuple[str, Optional[str], Optional[str]], openai.OpenAI] = {}
+_huggingface_clients: Dict[Tuple[Optional[str], Optional[str]], object] = {}
+_http_clients: Dict[str, httpx.Client] = {}
+_async_openai_clients: Dict[
+    Tuple[str, Optional[str], Optional[str]], openai.AsyncOpenAI
+] = {}
+_async_http_clients: Dict[str, httpx.AsyncClient] = {}
+_huggingface_backend_configured = False
+
+
+def pool_settings() -> HttpPoolSettings:
+    """Return the pool settings, read from the environment on first use"""
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                _settings = HttpPoolSettings.from_env()
+    return _settings
+
+
+def configure(settings: HttpPoolSettings):
+    """Replace the pool settings and drop clients built with the old ones"""
+    global _settings
+    close_clients()
+    with _lock:
+        _settings = settings
+
+
+def get_openai_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    name: str = "openai",
+) -> openai.OpenAI:
+    """
+    Return the process-wide OpenAI client for this key and endpoint
+
+    The client and its httpx connection pool are created once and shared by all of
+    Bolt's worker threads, so keep-alive connections (and their TLS sessions) are
+    reused across requests and tool rounds. OpenAI-compatible providers pass their
+    own base_url and name.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    key = (name, api_key, base_url)
+    client = _openai_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            settings = pool_settings()
+            client = openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=settings.httpx_timeout(),
+                http_client=httpx.Client(
+                    limits=settings.httpx_limits(),
+                    timeout=settings.httpx_timeout(),
+                ),
+            )
+            _openai_clients[key] = client
+            logger.info(f"Created pooled {name} client (base_url={base_url})")
+    return client
+
+
+def get_huggingface_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = HUGGINGFACE_ROUTER_URL,
+    timeout: Optional[float] = None,
+):
+    """
+    Return the process-wide Hugging Face InferenceClient for this key and endpoint
+
+    huggingface_hub keeps one requests session per thread; the first call also
+    configures those sessions with a pooled, keep-alive HTTP adapter sized from
+    the pool settings. A client with its own timeout is not cached, but it still
+    sends requests over the shared sessions.
+    """
+    api_key = api_key or os.getenv("HUGGINGFACE_API_KEY")
+    key = (api_key, base_url)
+    client = _huggingface_clients.get(key)
+    if client is not None and timeout is None:
+        return client
+    from huggingface_hub import InferenceClient
+
+    with _lock:
+        _configure_huggingface_backend()
+        if timeout is not None:
+            return InferenceClient(token=api_key, base_url=base_url, timeout=timeout)
+        client = _huggingface_clients.get(key)
+        if client is None:
+            client = InferenceClient(
+                token=api_key,
+                base_url=base_url,
+                timeout=pool_settings().timeout,
+            )
+            _huggingface_clients[key] = client
+            logger.info(f"Created pooled Hugging Face client (base_url={base_url})")
+    return client
+
+
+def get_http_client(name: str) -> httpx.Client:
+    """Return a pooled httpx client for a provider without an SDK client"""
+    client = _http_clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _http_clients.get(name)
+        if client is None:
+            settings = pool_settings()
+            client = httpx.Client(
+                limits=settings.httpx_limits(),
+                timeout=settings.httpx_timeout(),
+            )
+            _http_clients[name] = client
+    return client
+
+
+def get_async_openai_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    name: str = "openai",
+) -> openai.AsyncOpenAI:
+    """
+    Return the process-wide AsyncOpenAI client for this key and endpoint
+
+    Like get_openai_client, but for the asyncio app: all streams in the event loop
+    share one httpx.AsyncClient pool, so a single thread can hold many of them.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    key = (name, api_key, base_url)
+    client = _async_openai_clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _async_openai_clients.get(key)
+        if client is None:
+            settings = pool_settings()
+            client = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=settings.httpx_timeout(),
+                http_client=httpx.AsyncClient(
+                    limits=settings.httpx_limits(),
+                    timeout=settings.httpx_timeout(),
+                ),
+            )
+            _async_openai_clients[key] = client
+            logger.info(f"Created pooled async {name} client (base_url={base_url})")
+    return client
+
+
+def get_async_huggingface_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = HUGGINGFACE_ROUTER_URL,
+    timeout: Optional[float] = None,
+):
+    """Return a Hugging Face AsyncInferenceClient for this key and endpoint"""
+    from huggingface_hub import AsyncInferenceClient
+
+    # The async client opens its own aiohttp session per call, so there is no pool
+    # to share and creating one is cheap
+    return AsyncInferenceClient(
+        token=api_key or os.getenv("HUGGINGFACE_API_KEY"),
+        base_url=base_url,
+        timeout=pool_settings().timeout if timeout is None else timeout,
+    )
+
+
+def get_async_http_client(name: str) -> httpx.AsyncClient:
+    """Return a pooled httpx.AsyncClient for a provider without an SDK client"""
+    client = _async_http_clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _async_http_clients.get(name)
+        if client is None:
+            settings = pool_settings()
+            client = httpx.AsyncClient(
+                limits=settings.httpx_limits(),
+                timeout=settings.httpx_timeout(),
+            )
+            _async_http_clients[name] = client
+    return client
+
+
+async def aclose_clients():
+    """Close the pooled async clients, from the event loop that used them"""
+    with _lock:
+        clients = list(_async_openai_clients.values())
+        http_clients = list(_async_http_clients.values())
+        _async_openai_clients.clear()
+        _async_http_clients.clear()
+    for client in clients:
+        await client.close()
+    for http_client in http_clients:
+        await http_client.aclose()
+
+
+def close_clients():
+    """Close all pooled clients, e.g. on shutdown or after changing settings"""
+    global _huggingface_backend_configured
+    with _lock:
+        for client in _openai_clients.values():
+            client.close()
+        _openai_clients.clear()
+        for client in _http_clients.values():
+            client.close()
+        _http_clients.clear()
+        _huggingface_clients.clear()
+        if _huggingface_backend_configured:
+            from huggingface_hub.utils import reset_sessions
+
+            reset_sessions()
+            _huggingface_backend_configured = False
+
+
+def _configure_huggingface_backend():
+    """Make huggingface_hub's per-thread sessions use a sized keep-alive pool"""
+    global _huggingface_backend_configured
+    if _huggingface_backend_configured:
+        return
+    import requests
+    from huggingface_hub import configure_http_backend
+    from requests.adapters import HTTPAdapter
+
+    settings = pool_settings()
+
+    def backend_factory() -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.max_keepalive_connections,
+            pool_maxsize=settings.max_connections,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    configure_http_backend(backend_factory=backend_factory)
+    _huggingface_backend_configured = True
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import AsyncIterator, Callable, List, Optional, TypeVar
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request runs out of one of its time budgets"""
+
+
+@dataclass(frozen=True)
+class DeadlineSettings:
+    """
+    Time budgets for answering one Slack event, in seconds
+
+    Args:
+        connect: Time allowed to connect to a provider
+        first_token: Time a provider gets to produce its first delta
+        stall: Longest gap allowed between two deltas
+        total: Time from the event arriving to the end of the answer
+    """
+
+    connect: float = 5.0
+    first_token: float = 15.0
+    stall: float = 10.0
+    total: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "DeadlineSettings":
+        return cls(
+            connect=float(os.getenv("LLM_DEADLINE_CONNECT", cls.connect)),
+            first_token=float(os.getenv("LLM_DEADLINE_FIRST_TOKEN", cls.first_token)),
+            stall=float(os.getenv("LLM_DEADLINE_STALL", cls.stall)),
+            total=float(os.getenv("LLM_DEADLINE_TOTAL", cls.total)),
+        )
+
+
+class _Cancellation:
+    """Lets another thread stop the streams timed against one deadline branch"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.error: Optional[BaseException] = None
+        self.closers: List[Callable[[], None]] = []
+
+
+@dataclass
+class Deadline:
+    """
+    The time left to answer one Slack event
+
+    Created when the event arrives and passed down through call_llm, the tool
+    loop and the fallbacks, so every provider call shares the same total budget.
+    """
+
+    settings: DeadlineSettings = field(default_factory=DeadlineSettings)
+    clock: Callable[[], float] = time.monotonic
+    started: float = -1.0
+    cancellation: Optional[_Cancellation] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.started < 0:
+            self.started = self.clock()
+
+    @classmethod
+    def start(cls, settings: Optional[DeadlineSettings] = None) -> "Deadline":
+        return cls(settings or DeadlineSettings.from_env())
+
+    def remaining(self) -> float:
+        return max(self.settings.total - (self.clock() - self.started), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self):
+        error = self.cancelled()
+        if error is not None:
+            raise error
+        if self.expired():
+            raise DeadlineExceeded(f"Total deadline of {self.settings.total}s exceeded")
+
+    def reserve(self, seconds: float) -> "Deadline":
+        """A deadline that ends seconds before this one, leaving them for later work"""
+        total = max(self.settings.total - seconds, 0.0)
+        return Deadline(
+            replace(self.settings, total=total),
+            self.clock,
+            self.started,
+            self.cancellation,
+        )
+
+    def branch(self) -> "Deadline":
+        """The same budget, for work that can be cancelled on its own with cancel()"""
+        return Deadline(self.settings, self.clock, self.started, _Cancellation())
+
+    def cancel(self, error: BaseException):
+        """
+        Stop the streams of this branch from another thread
+
+        Their next check() or tick() raises error, and responses registered with
+        StreamWatch.closes() are closed so a stream waiting for its first token
+        gives up its connection now rather than at its read timeout.
+        """
+        cancellation = self.cancellation
+        if cancellation is None:
+            raise ValueError("Only a branch() of a deadline can be cancelled")
+        with cancellation.lock:
+            if cancellation.error is not None:
+                return
+            cancellation.error = error
+            closers, cancellation.closers = cancellation.closers, []
+        for close in closers:
+            try:
+                close()
+            except Exception as e:
+                logger.debug(f"Closing a cancelled stream failed: {e!r}")
+
+    def cancelled(self) -> Optional[BaseException]:
+        """The error passed to cancel(), or None while the branch may go on"""
+        if self.cancellation is None:
+            return None
+        return self.cancellation.error
+
+    def on_cancel(self, close: Callable[[], None]):
+        """Call close when the branch is cancelled, at once if it already was"""
+        cancellation = self.cancellation
+        if cancellation is None:
+            return
+        with cancellation.lock:
+            if cancellation.error is None:
+                cancellation.closers.append(close)
+                return
+        close()
+
+    def watch(self, name: str) -> "StreamWatch":
+        """Start timing one provider stream against this deadline"""
+        self.check()
+        return StreamWatch(self, name)
+
+
+class StreamWatch:
+    """
+    Enforces the connect, first-token, stall and total budgets on one stream
+
+    timeout() bounds each blocking socket operation, so a provider that stops
+    sending can't hold a listener thread for longer than the budget; tick() is
+    called for every event read from the stream and raises once a budget has run
+    out even though events are still trickling in.
+    """
+
+    def __init__(self, deadline: Deadline, name: str):
+        self.deadline = deadline
+        self.name = name
+        self._clock = deadline.clock
+        self._started = self._clock()
+        self._last_delta: Optional[float] = None
+
+    def read_timeout(self) -> float:
+        """Longest a single read may block, capped by the time left in total"""
+        settings = self.deadline.settings
+        budget = max(settings.first_token, settings.stall)
+        return max(min(budget, self.deadline.remaining()), 0.001)
+
+    def timeout(self) -> httpx.Timeout:
+        read = self.read_timeout()
+        return httpx.Timeout(read, connect=min(self.deadline.settings.connect, read))
+
+    def closes(self, response: T) -> T:
+        """Register a response to be closed if the deadline is cancelled"""
+        self.deadline.on_cancel(lambda: response.close())
+        return response
+
+    def total_timeout(self) -> float:
+        """The time left in total, for clients whose timeout covers a whole stream"""
+        return max(self.deadline.remaining(), 0.001)
+
+    async def next_event(self, events: AsyncIterator[T]) -> T:
+        """
+        The next event of an async stream, waiting at most read_timeout()
+
+        For clients such as AsyncInferenceClient whose own timeout covers the
+        whole stream rather than each read. Raises StopAsyncIteration at the end.
+        """
+        try:
+            return await asyncio.wait_for(events.__anext__(), self.read_timeout())
+        except asyncio.TimeoutError:
+            self.tick(False)
+            # The total deadline is not up yet, so the wait was for output
+            raise DeadlineExceeded(
+                f"{self.name} sent nothing for {self.read_timeout():.0f}s"
+            ) from None
+
+    def tick(self, delta: bool = True):
+        """Record a stream event, delta=False for events without output text"""
+        error = self.deadline.cancelled()
+        if error is not None:
+            raise error
+        now = self._clock()
+        settings = self.deadline.settings
+        if self._last_delta is None:
+            if now - self._started > settings.first_token:
+                raise DeadlineExceeded(
+                    f"{self.name} sent no output within {settings.first_token}s"
+                )
+        elif now - self._last_delta > settings.stall:
+            raise DeadlineExceeded(
+                f"{self.name} stalled for more than {settings.stall}s"
+            )
+        self.deadline.check()
+        if delta:
+            self._last_delta = now
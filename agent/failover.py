@@ -0,0 +1,153 @@
+import logging
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from openai.types.responses import ResponseInputParam
+
+from agent.cache import RequestCache, cache_key, is_cacheable
+from agent.deadlines import Deadline
+from agent.health import get_breaker
+from agent.hedging import HedgeSettings
+from agent.prompt_budget import fit_prompts
+from agent.providers import Provider
+from agent.router import RouteDecision, get_router
+from agent.single_flight import SingleFlightSettings
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE_MESSAGE = (
+    "❌ Sorry, all AI services are currently unavailable. Please try again later."
+)
+# Appended when a provider fails after part of its answer was already shown
+CUT_OFF_NOTICE = "\n\n⚠️ The response was cut off. Please try again."
+
+
+@dataclass
+class PreparedRequest:
+    """
+    A request to call_llm once it is routed, budgeted and has its caches
+
+    The sync and async callers share everything up to the provider calls
+    themselves through this.
+    """
+
+    prompts: ResponseInputParam
+    user_message: str
+    needs_tools: bool
+    decision: RouteDecision
+    cache: RequestCache
+
+    @property
+    def providers(self) -> List[Provider]:
+        return self.decision.providers
+
+    def replay(self, hit: Tuple[Provider, str]) -> str:
+        """Record a cache hit as the answer and return its text"""
+        provider, text = hit
+        logger.info(f"Replaying a cached {provider.name} response")
+        self.decision.record_served(provider)
+        self.decision.details["cached"] = True
+        return text
+
+    def single_flight_key(self) -> Optional[str]:
+        """
+        Key under which identical requests in flight share one generation, None
+        if this one may not be shared
+
+        Keyed like the cache by the prompts and the model that would answer first.
+        """
+        if (
+            not self.providers
+            or not is_cacheable(self.prompts, self.needs_tools)
+            or not SingleFlightSettings.from_env().enabled
+        ):
+            return None
+        return cache_key(self.prompts, self.providers[0])
+
+
+def prepare_request(
+    prompts: ResponseInputParam, user_message: str, needs_tools: bool
+) -> PreparedRequest:
+    """Rank the providers for a request and fit its prompts to their budgets"""
+    decision = get_router().rank(needs_tools=needs_tools)
+    if not decision.providers:
+        logger.info("No LLM provider API key found, using a local response")
+    # Long threads are trimmed to the token budget of the models that may answer
+    budgeted = fit_prompts(prompts, decision.providers)
+    decision.details["prompt_tokens"] = budgeted.tokens
+    decision.details["tokens_trimmed"] = budgeted.tokens_trimmed
+    return PreparedRequest(
+        prompts=budgeted.prompts,
+        user_message=user_message,
+        needs_tools=needs_tools,
+        decision=decision,
+        cache=RequestCache(budgeted.prompts, needs_tools),
+    )
+
+
+class Failover:
+    """
+    The order in which one request tries its providers
+
+    Iterating gives the ranked providers whose circuit lets the request through,
+    until the deadline runs out. next_available() hands out the following one,
+    for hedging, without the deadline check.
+
+    A provider that fails before it shows anything hands over to the next one.
+    Once part of an answer has been appended there is no failing over: another
+    provider's answer would be spliced onto it, so the request stops there with
+    a cut-off notice.
+    """
+
+    def __init__(self, decision: RouteDecision, deadline: Deadline):
+        self.decision = decision
+        self.hedging = HedgeSettings.from_env()
+        self._deadline = deadline
+        self._remaining = list(decision.providers)
+
+    def __iter__(self) -> Iterator[Provider]:
+        while self._remaining:
+            # Checked first: asking a half-open circuit takes its probe slot
+            if self._deadline.expired():
+                logger.warning("Deadline exceeded, skipping the remaining providers")
+                return
+            provider = self.next_available()
+            if provider is None:
+                return
+            yield provider
+
+    def next_available(self) -> Optional[Provider]:
+        while self._remaining:
+            provider = self._remaining.pop(0)
+            if get_breaker(provider.name).allow_request():
+                return provider
+            # Skip the failure latency of a provider that is known to be down
+            logger.info(f"{provider.name} circuit is open, skipping it")
+        return None
+
+    def should_hedge(self) -> bool:
+        """Whether to race the next provider if this one is slow to start"""
+        return self.hedging.enabled and bool(self._remaining)
+
+    def succeeded(self, provider: Provider):
+        self.decision.record_served(provider)
+
+    def failed(self, provider: Provider, error: Exception, shown: str) -> bool:
+        """
+        Record a failed attempt that had appended shown, returning whether the
+        next provider may be tried
+        """
+        if not shown:
+            logger.warning(f"{provider.name} failed: {error}, trying the next provider")
+            return True
+        logger.warning(
+            f"{provider.name} failed after {len(shown)} characters of its answer "
+            f"were shown: {error}, not failing over"
+        )
+        self.decision.details["cut_off"] = provider.name
+        self.decision.record_served(None)
+        return False
+
+    def exhausted(self):
+        """Note that every provider failed and the local fallback answers"""
+        self.decision.record_served(None)
@@ -0,0 +1,264 @@
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GREETING = "greeting"
+HELP = "help"
+DICE = "dice"
+
+# A dice request is an NdM expression next to one of these words; the local
+# dice roller in agent.llm_caller answers exactly these
+DICE_EXPRESSION = re.compile(r"(\d+)d(\d+)")
+DICE_WORDS = ("roll", "dice", "random")
+
+# Phrases that on their own make up a request of each intent
+_INTENT_PHRASES: Dict[str, List[str]] = {
+    GREETING: [
+        "hello",
+        "hi",
+        "hey",
+        "yo",
+        "howdy",
+        "good morning",
+        "good afternoon",
+        "good evening",
+        "nice to meet you",
+        "こんにちは",
+        "こんばんは",
+        "おはよう",
+        "おはようございます",
+        "はじめまして",
+        "よろしく",
+        "よろしくお願いします",
+        "やあ",
+    ],
+    HELP: [
+        "help",
+        "help me",
+        "what can you do",
+        "what do you do",
+        "how do i use you",
+        "how does this work",
+        "ヘルプ",
+        "助けて",
+        "使い方",
+        "何ができる",
+        "何ができますか",
+        "何ができるの",
+    ],
+    DICE: [
+        r"\d+d\d+",
+        "roll",
+        "rolls",
+        "dice",
+        "die",
+        "random",
+        "サイコロ",
+        "ダイス",
+        "振って",
+        "振る",
+    ],
+}
+
+# Words that don't change what a short request is about
+_FILLER_PHRASES = [
+    "there",
+    "bot",
+    "assistant",
+    "please",
+    "again",
+    "me",
+    "you",
+    "a",
+    "the",
+    "some",
+    "and",
+    "can",
+    "を",
+    "ください",
+    "さん",
+    "です",
+    "ます",
+    "か",
+    "ね",
+    "よ",
+]
+
+_MENTION = re.compile(r"<[@#!][^>]*>|:[a-z0-9_+-]+:")
+_SEPARATORS = re.compile(r"[\s!?.,、。！？…~〜-]+")
+
+
+def _compile(phrases: List[str]) -> "re.Pattern[str]":
+    # Longest first so that "good morning" wins over a shorter overlapping phrase;
+    # ASCII words must match whole words, Japanese has no word boundaries
+    alternatives = []
+    for phrase in sorted(phrases, key=len, reverse=True):
+        pattern = phrase if "\\" in phrase else re.escape(phrase)
+        if phrase.isascii():
+            pattern = rf"(?<![a-z0-9]){pattern}(?![a-z0-9])"
+        alternatives.append(pattern)
+    return re.compile("|".join(alternatives))
+
+
+_INTENT_PATTERNS = {
+    intent: _compile(phrases) for intent, phrases in _INTENT_PHRASES.items()
+}
+_FILLER_PATTERN = _compile(_FILLER_PHRASES)
+
+
+@dataclass(frozen=True)
+class FastPathSettings:
+    """
+    Settings for answering trivial requests without calling an LLM
+
+    Args:
+        enabled: Answer greetings, help requests and NdM dice rolls locally
+        threshold: Share of the message an intent's phrases have to cover before
+          it is answered locally
+        max_chars: Longer messages always go to the LLM without being classified
+        max_dice: Most dice of one NdM expression rolled locally
+        max_sides: Most sides of a die rolled locally; larger rolls go to the LLM
+    """
+
+    enabled: bool = True
+    threshold: float = 0.8
+    max_chars: int = 120
+    max_dice: int = 100
+    max_sides: int = 1000
+
+    @classmethod
+    def from_env(cls) -> "FastPathSettings":
+        return cls(
+            enabled=os.getenv("LLM_FAST_PATH_ENABLED", "true").lower() == "true",
+            threshold=float(os.getenv("LLM_FAST_PATH_THRESHOLD", cls.threshold)),
+            max_chars=int(os.getenv("LLM_FAST_PATH_MAX_CHARS", cls.max_chars)),
+            max_dice=int(os.getenv("LLM_FAST_PATH_MAX_DICE", cls.max_dice)),
+            max_sides=int(os.getenv("LLM_FAST_PATH_MAX_SIDES", cls.max_sides)),
+        )
+
+
+def mentions_dice(text: str) -> bool:
+    """Whether text says roll, dice or random, as dice requests do"""
+    lowered = text.lower()
+    return any(word in lowered for word in DICE_WORDS)
+
+
+def _rollable(text: str, settings: FastPathSettings) -> bool:
+    """Whether text is a dice request small enough to roll on the request thread"""
+    rolls = DICE_EXPRESSION.findall(text.lower())
+    return (
+        bool(rolls)
+        and mentions_dice(text)
+        and all(
+            1 <= int(count) <= settings.max_dice
+            and 2 <= int(sides) <= settings.max_sides
+            for count, sides in rolls
+        )
+    )
+
+
+@dataclass(frozen=True)
+class Intent:
+    """What a message asks for, and how much of the message says so"""
+
+    name: str
+    confidence: float
+
+
+def _spans(pattern: "re.Pattern[str]", text: str) -> List[Tuple[int, int]]:
+    return [match.span() for match in pattern.finditer(text)]
+
+
+def _covered(text: str, spans: List[Tuple[int, int]]) -> int:
+    """Characters of text inside any of spans, not counting spaces"""
+    return len(
+        {i for start, stop in spans for i in range(start, stop) if text[i] != " "}
+    )
+
+
+def classify(text: str) -> Optional[Intent]:
+    """
+    The intent of a short message, None if it isn't one of the trivial ones
+
+    Confidence is the share of the message's characters (separators aside)
+    covered by the intent's phrases and filler words, so "hi!" is a greeting
+    with confidence 1.0 but "hi, why does my loop never end?" is not.
+    """
+    normalized = _SEPARATORS.sub(" ", _MENTION.sub(" ", text.lower())).strip()
+    length = len(normalized.replace(" ", ""))
+    if not length:
+        return None
+    fillers = _spans(_FILLER_PATTERN, normalized)
+    best: Optional[Intent] = None
+    for name, pattern in _INTENT_PATTERNS.items():
+        spans = _spans(pattern, normalized)
+        if not spans:
+            continue
+        confidence = _covered(normalized, spans + fillers) / length
+        if best is None or confidence > best.confidence:
+            best = Intent(name, confidence)
+    return best
+
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {"requests": 0, "upstream_calls_saved": 0, "intents": {}}
+
+
+def _count(intent: Optional[str], answered: bool):
+    with _stats_lock:
+        _stats["requests"] += 1
+        if intent is None:
+            return
+        counts = _stats["intents"].setdefault(intent, {"matched": 0, "answered": 0})
+        counts["matched"] += 1
+        if answered:
+            counts["answered"] += 1
+            _stats["upstream_calls_saved"] += 1
+
+
+def match_fast_path(
+    text: str, settings: Optional[FastPathSettings] = None
+) -> Optional[Intent]:
+    """The intent of a message if it is confident enough to answer locally"""
+    settings = settings or FastPathSettings.from_env()
+    if not settings.enabled or len(text) > settings.max_chars:
+        return None
+    intent = classify(text)
+    if intent is None or intent.confidence < settings.threshold:
+        return None
+    if intent.name == DICE and not _rollable(text, settings):
+        # "dice" or "roll 1000000d1000000" alone is left to the LLM
+        return None
+    return intent
+
+
+def record_fast_path(intent: Optional[Intent], answered: bool):
+    """Count a request that went through the fast path, answered locally or not"""
+    _count(intent.name if intent else None, answered)
+    if answered:
+        logger.info(
+            f"Answered a {intent.name} request locally "
+            f"(confidence {intent.confidence:.2f})"
+        )
+
+
+def fast_path_stats() -> Dict[str, Any]:
+    """Requests seen, per-intent matches, answers and hit rates, and calls saved"""
+    with _stats_lock:
+        stats: Dict[str, Any] = {
+            "requests": _stats["requests"],
+            "upstream_calls_saved": _stats["upstream_calls_saved"],
+            "intents": {
+                name: dict(counts) for name, counts in _stats["intents"].items()
+            },
+        }
+    for counts in stats["intents"].values():
+        counts["hit_rate"] = (
+            counts["answered"] / stats["requests"] if stats["requests"] else 0.0
+        )
+    return stats
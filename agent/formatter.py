@@ -0,0 +1,160 @@
+import re
+from typing import List
+
+from agent.keywords import KeywordMatcher
+
+# Common AI response prefixes that are dropped from the start of an answer
+_PREFIX_PATTERN = re.compile(r"(?:Response:|Assistant:|AI:|Bot:|Here's|Here is)\s*")
+
+# Emoji picked from the start of the answer, in priority order
+_EMOJI_KEYWORDS = {
+    "💻": ["code", "function", "class", "method", "variable", "コード", "関数", "変数"],
+    "🐛": ["error", "bug", "issue", "problem", "エラー", "バグ", "問題"],
+    "⚡": ["optimize", "improve", "better", "performance", "最適化", "改善", "高速"],
+}
+_EMOJI_MATCHER = KeywordMatcher(_EMOJI_KEYWORDS)
+_DEFAULT_EMOJI = "🤖"
+# Put in front of answers from the Hugging Face fallback
+HUGGINGFACE_BANNER = "🤖 Using Hugging Face AI...\n\n"
+
+
+def pick_emoji(text: str) -> str:
+    """Return the emoji for a response from the keywords it mentions"""
+    found = _EMOJI_MATCHER.match(text)
+    for emoji in _EMOJI_KEYWORDS:
+        if emoji in found:
+            return emoji
+    return _DEFAULT_EMOJI
+
+
+class SlackMarkdownFormatter:
+    """
+    Formats a streamed LLM answer for Slack one delta at a time
+
+    feed() returns the text that is ready to be appended and finish() returns what
+    is left at the end of the stream. Each character is looked at once, so the work
+    is linear in the size of the answer and nothing but a short head is buffered.
+
+    - Leading and trailing whitespace is stripped; trailing whitespace is held back
+      until more text arrives.
+    - With decorate=True the first head_chars characters are held back to strip a
+      common AI prefix such as "Here is" and to pick a leading emoji.
+    - Code fences and inline code are tracked across delta boundaries. An opening
+      fence gets the empty line before it that Slack needs, and an unterminated
+      fence or inline code span is closed when the stream finishes.
+    """
+
+    def __init__(self, decorate: bool = True, head_chars: int = 200):
+        self._decorate = decorate
+        self._head_chars = head_chars
+        self._head = ""
+        self._started = not decorate
+        self._emitted = False
+        self._has_text = False
+        self._whitespace = ""
+        self._ticks = 0
+        self._in_fence = False
+        self._inline_ticks = 0
+        self._line_has_text = False
+        self._previous_line_blank = True
+
+    @property
+    def started(self) -> bool:
+        """True once any text has been returned for appending"""
+        return self._emitted
+
+    def feed(self, delta: str) -> str:
+        if not self._started:
+            self._head += delta
+            if len(self._head) < self._head_chars:
+                return ""
+            return self._release_head()
+        return self._process(delta)
+
+    def finish(self) -> str:
+        out: List[str] = []
+        if not self._started:
+            if not self._head.strip():
+                return ""
+            out.append(self._release_head())
+        if self._ticks:
+            out.append(self._emit_ticks())
+        if self._in_fence:
+            newline = self._whitespace.rfind("\n")
+            out.append(self._whitespace[: newline + 1] if newline >= 0 else "\n")
+            out.append("```")
+            self._in_fence = False
+        elif self._inline_ticks:
+            out.append("`" * self._inline_ticks)
+            self._inline_ticks = 0
+        self._whitespace = ""
+        return self._mark_emitted("".join(out))
+
+    def _release_head(self) -> str:
+        self._started = True
+        head = self._head.lstrip()
+        self._head = ""
+        match = _PREFIX_PATTERN.match(head)
+        if match:
+            head = head[match.end() :]
+        if not head:
+            return ""
+        return self._mark_emitted(f"{pick_emoji(head)} " + self._process(head))
+
+    def _process(self, text: str) -> str:
+        out: List[str] = []
+        for ch in text:
+            if ch == "`":
+                self._ticks += 1
+                continue
+            if self._ticks:
+                out.append(self._emit_ticks())
+            if ch.isspace():
+                if not self._has_text:
+                    continue
+                self._whitespace += ch
+                if ch == "\n":
+                    self._previous_line_blank = not self._line_has_text
+                    self._line_has_text = False
+                    # Inline code does not continue past the end of a line
+                    self._inline_ticks = 0
+                continue
+            out.append(self._whitespace)
+            self._whitespace = ""
+            out.append(ch)
+            self._line_has_text = True
+            self._has_text = True
+        return self._mark_emitted("".join(out))
+
+    def _emit_ticks(self) -> str:
+        run, self._ticks = self._ticks, 0
+        whitespace, self._whitespace = self._whitespace, ""
+        if self._in_fence:
+            if run >= 3:
+                self._in_fence = False
+        elif self._inline_ticks:
+            if run == self._inline_ticks:
+                self._inline_ticks = 0
+        elif run >= 3:
+            self._in_fence = True
+            at_line_start = not self._line_has_text
+            if at_line_start and not self._previous_line_blank:
+                # Slack only renders a code block that follows an empty line
+                indent = whitespace.rfind("\n") + 1
+                whitespace = whitespace[:indent] + "\n" + whitespace[indent:]
+        else:
+            self._inline_ticks = run
+        self._line_has_text = True
+        self._has_text = True
+        return whitespace + "`" * run
+
+    def _mark_emitted(self, text: str) -> str:
+        if text:
+            self._emitted = True
+        return text
+
+
+def format_slack_response(response: str, decorate: bool = True) -> str:
+    """Format a complete AI response for Slack"""
+    formatter = SlackMarkdownFormatter(decorate=decorate, head_chars=len(response))
+    return formatter.feed(response) + formatter.finish()
@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass(frozen=True)
+class BreakerSettings:
+    """
+    When a provider's circuit opens and how it recovers
+
+    Args:
+        window: Seconds of request outcomes used for the rolling error rate
+        min_requests: Outcomes needed in the window before the circuit can open
+        error_rate_threshold: Error rate at or above which the circuit opens
+        open_seconds: Seconds the circuit stays open before a probe is allowed
+        half_open_probes: Requests let through at once while half open
+    """
+
+    window: float = 60.0
+    min_requests: int = 5
+    error_rate_threshold: float = 0.5
+    open_seconds: float = 30.0
+    half_open_probes: int = 1
+
+    @classmethod
+    def from_env(cls) -> "BreakerSettings":
+        return cls(
+            window=float(os.getenv("LLM_BREAKER_WINDOW", cls.window)),
+            min_requests=int(os.getenv("LLM_BREAKER_MIN_REQUESTS", cls.min_requests)),
+            error_rate_threshold=float(
+                os.getenv("LLM_BREAKER_ERROR_RATE", cls.error_rate_threshold)
+            ),
+            open_seconds=float(os.getenv("LLM_BREAKER_OPEN_SECONDS", cls.open_seconds)),
+            half_open_probes=int(
+                os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", cls.half_open_probes)
+            ),
+        )
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one LLM provider
+
+    A closed circuit lets every request through. When the error rate over the
+    rolling window reaches the threshold the circuit opens and requests are refused,
+    so callers can go straight to another provider. After open_seconds the circuit
+    is half open: a limited number of probe requests go through, and the first probe
+    result decides whether it closes again or reopens.
+
+    Every request that allow_request() lets through must be followed by
+    record_success(), record_failure() or record_cancelled().
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        settings: Optional[BreakerSettings] = None,
+        clock=time.monotonic,
+    ):
+        self.provider = provider
+        self._settings = settings or BreakerSettings()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._transitions: Deque[Dict[str, Any]] = deque(maxlen=50)
+        self._last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN:
+                if self._probes_in_flight < self._settings.half_open_probes:
+                    self._probes_in_flight += 1
+                    logger.info(f"Sending probe request to {self.provider}")
+                    return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._record(True)
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                self._outcomes.clear()
+                self._transition(CLOSED, "probe succeeded")
+
+    def record_failure(self, error: Optional[BaseException] = None):
+        with self._lock:
+            self._record(False)
+            self._last_error = repr(error) if error is not None else None
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                self._open("probe failed")
+            elif self._state == CLOSED:
+                total, errors = self._counts()
+                rate = errors / total if total else 0.0
+                if (
+                    total >= self._settings.min_requests
+                    and rate >= self._settings.error_rate_threshold
+                ):
+                    self._open(f"error rate {rate:.0%} over {total} requests")
+
+    def record_cancelled(self):
+        """Release a request that was stopped before its outcome was known"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            total, errors = self._counts()
+            return errors / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_half_open()
+            total, errors = self._counts()
+            return {
+                "provider": self.provider,
+                "state": self._state,
+                "requests": total,
+                "errors": errors,
+                "error_rate": errors / total if total else 0.0,
+                "probes_in_flight": self._probes_in_flight,
+                "last_error": self._last_error,
+                "transitions": list(self._transitions),
+            }
+
+    def _record(self, ok: bool):
+        self._outcomes.append((self._clock(), ok))
+
+    def _counts(self) -> Tuple[int, int]:
+        horizon = self._clock() - self._settings.window
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+        errors = sum(1 for _, ok in self._outcomes if not ok)
+        return len(self._outcomes), errors
+
+    def _open(self, reason: str):
+        self._opened_at = self._clock()
+        self._transition(OPEN, reason)
+
+    def _maybe_half_open(self):
+        if (
+            self._state == OPEN
+            and self._clock() - self._opened_at >= self._settings.open_seconds
+        ):
+            self._probes_in_flight = 0
+            self._transition(HALF_OPEN, "cooldown elapsed")
+
+    def _transition(self, state: str, reason: str):
+        if state == self._state:
+            return
+        self._transitions.append(
+            {
+                "at": time.time(),
+                "from": self._state,
+                "to": state,
+                "reason": reason,
+            }
+        )
+        logger.warning(f"{self.provider} circuit {self._state} -> {state} ({reason})")
+        self._state = state
+
+
+_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for a provider"""
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                breaker = CircuitBreaker(provider, BreakerSettings.from_env())
+                _breakers[provider] = breaker
+    return breaker
+
+
+def breaker_snapshot() -> List[Dict[str, Any]]:
+    """State, error rate and recent transitions of every provider, for monitoring"""
+    with _lock:
+        breakers = list(_breakers.values())
+    return [breaker.snapshot() for breaker in breakers]
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from openai.types.responses import ResponseInputParam
+
+from agent.deadlines import Deadline
+from agent.providers import Provider
+from agent.streaming import AsyncMarkdownStream, MarkdownStream, StreamCancelled
+
+logger = logging.getLogger(__name__)
+
+# Wasted output is only seen as text, so tokens are estimated from characters
+CHARS_PER_TOKEN = 4
+
+
+@dataclass(frozen=True)
+class HedgeSettings:
+    """
+    Settings for racing a second provider when the first one is slow to start
+
+    Args:
+        enabled: Fire a hedge request after the first-token deadline
+        first_token_deadline: Seconds the primary gets to produce output
+    """
+
+    enabled: bool = False
+    first_token_deadline: float = 2.0
+
+    @classmethod
+    def from_env(cls) -> "HedgeSettings":
+        return cls(
+            enabled=os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true",
+            first_token_deadline=float(
+                os.getenv("LLM_HEDGE_DEADLINE", cls.first_token_deadline)
+            ),
+        )
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "wasted_chars": 0,
+}
+
+
+def hedging_stats() -> Dict[str, Any]:
+    """How often hedges fire, how often they win and what the losers cost"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["hedge_rate"] = (
+        stats["hedges"] / stats["requests"] if stats["requests"] else 0.0
+    )
+    stats["hedge_win_rate"] = (
+        stats["hedge_wins"] / stats["hedges"] if stats["hedges"] else 0.0
+    )
+    stats["tokens_wasted"] = -(-stats["wasted_chars"] // CHARS_PER_TOKEN)
+    return stats
+
+
+def _count(key: str, amount: int = 1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+class _RaceLost(StreamCancelled):
+    """Stops an attempt once another one has won the race"""
+
+
+def _lose(lane: Union["_Lane", "_AsyncLane"]):
+    lane.deadline.cancel(_RaceLost(f"{lane.provider.name} lost the hedged race"))
+
+
+class _Race:
+    """Shared state of the attempts racing for one ChatStream"""
+
+    def __init__(self, streamer: MarkdownStream):
+        self.streamer = streamer
+        self.winner: Optional["_Lane"] = None
+        self.lanes: List["_Lane"] = []
+        self.changed = threading.Condition()
+
+    def join(self, lane: "_Lane"):
+        with self.changed:
+            self.lanes.append(lane)
+            lost = self.winner is not None
+        if lost:
+            _lose(lane)
+
+    def claim(self, lane: "_Lane") -> bool:
+        with self.changed:
+            if self.winner is not None:
+                return self.winner is lane
+            self.winner = lane
+            self.changed.notify_all()
+            losers = [other for other in self.lanes if other is not lane]
+        # Stops the losers even while they wait for their first token
+        for loser in losers:
+            _lose(loser)
+        return True
+
+    def wait(self, done: Callable[[], bool], timeout: Optional[float] = None) -> bool:
+        with self.changed:
+            return self.changed.wait_for(done, timeout=timeout)
+
+
+class _Lane:
+    """
+    The streamer one attempt writes to
+
+    The first lane to append anything wins the race and is connected to the real
+    streamer. The other lanes are cancelled through their own branch of the
+    deadline, which closes their responses and fails their next append.
+    """
+
+    def __init__(self, race: _Race, provider: Provider):
+        self.race = race
+        self.provider = provider
+        self.deadline: Optional[Deadline] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.wasted_chars = 0
+
+    def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[List[Any]] = None,
+        **kwargs,
+    ) -> Any:
+        if not self.race.claim(self):
+            self.wasted_chars += len(markdown_text or "")
+            raise _RaceLost(f"{self.provider.name} lost the hedged race")
+        return self.race.streamer.append(
+            markdown_text=markdown_text, chunks=chunks, **kwargs
+        )
+
+    def start(self, prompts: ResponseInputParam, deadline: Deadline):
+        self.deadline = deadline.branch()
+        self.race.join(self)
+        threading.Thread(
+            target=self._run,
+            # Attempts may add tool calls to their prompts, so each gets a copy
+            args=(list(prompts), self.deadline),
+            name=f"hedge-{self.provider.name}",
+            daemon=True,
+        ).start()
+
+    def _run(self, prompts: ResponseInputParam, deadline: Deadline):
+        try:
+            self.provider.run(self, prompts, deadline)
+        except _RaceLost:
+            logger.info(f"Cancelled the {self.provider.name} stream after losing")
+        except BaseException as e:
+            # Includes a StreamCancelled from the real streamer, raised in the
+            # winner when nobody is reading the answer any more
+            self.error = e
+        finally:
+            if self.wasted_chars:
+                _count("wasted_chars", self.wasted_chars)
+            with self.race.changed:
+                self.done = True
+                self.race.changed.notify_all()
+
+
+def hedged_stream(
+    streamer: MarkdownStream,
+    prompts: ResponseInputParam,
+    primary: Provider,
+    next_secondary: Callable[[], Optional[Provider]],
+    settings: HedgeSettings,
+    deadline: Deadline,
+) -> Provider:
+    """
+    Stream from primary, racing a secondary if primary is slow to start
+
+    If primary has not appended anything within the first-token deadline,
+    next_secondary() is asked for another provider and the same prompts are sent
+    to it. Whichever attempt appends first owns the streamer until it finishes.
+    Both attempts share the request's deadline, and the loser is cancelled as
+    soon as the winner appends.
+    Returns the provider that answered, or raises the error of the failed attempts.
+    An error of the winner may come after part of its answer was appended, so the
+    caller must check what reached the streamer before trying another provider.
+    """
+    _count("requests")
+    race = _Race(streamer)
+    lanes = [_Lane(race, primary)]
+    lanes[0].start(prompts, deadline)
+
+    race.wait(
+        lambda: race.winner is not None or lanes[0].done,
+        timeout=settings.first_token_deadline,
+    )
+    if race.winner is None and not lanes[0].done:
+        secondary = next_secondary()
+        if secondary is not None:
+            logger.info(
+                f"{primary.name} produced nothing in "
+                f"{settings.first_token_deadline}s, hedging with {secondary.name}"
+            )
+            _count("hedges")
+            lanes.append(_Lane(race, secondary))
+            lanes[1].start(prompts, deadline)
+
+    race.wait(lambda: race.winner is not None or all(lane.done for lane in lanes))
+    winner = race.winner
+    if winner is None:
+        # Nobody produced output: surface the primary's error, if any
+        for lane in lanes:
+            if lane.error is not None:
+                raise lane.error
+        return primary
+
+    race.wait(lambda: winner.done)
+    if len(lanes) > 1 and winner is lanes[1]:
+        _count("hedge_wins")
+    if winner.error is not None:
+        raise winner.error
+    return winner.provider
+
+
+class _AsyncLane:
+    """_Lane for the asyncio app, where losers are cancelled as soon as one wins"""
+
+    def __init__(self, race: "_AsyncRace", provider: Provider):
+        self.race = race
+        self.provider = provider
+        self.deadline: Optional[Deadline] = None
+        self.wasted_chars = 0
+        self.task: Optional[asyncio.Task] = None
+
+    async def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[List[Any]] = None,
+        **kwargs,
+    ) -> Any:
+        if not self.race.claim(self):
+            self.wasted_chars += len(markdown_text or "")
+            raise _RaceLost(f"{self.provider.name} lost the hedged race")
+        return await self.race.streamer.append(
+            markdown_text=markdown_text, chunks=chunks, **kwargs
+        )
+
+    def start(self, prompts: ResponseInputParam, deadline: Deadline):
+        # Cancelling the task leaves a sync provider running on its worker
+        # thread, so losers are also cancelled through their deadline
+        self.deadline = deadline.branch()
+        self.task = asyncio.ensure_future(self._run(list(prompts), self.deadline))
+
+    async def _run(self, prompts: ResponseInputParam, deadline: Deadline):
+        try:
+            await self.provider.arun(self, prompts, deadline)
+        finally:
+            if self.wasted_chars:
+                _count("wasted_chars", self.wasted_chars)
+
+
+class _AsyncRace:
+    def __init__(self, streamer: AsyncMarkdownStream):
+        self.streamer = streamer
+        self.winner: Optional[_AsyncLane] = None
+        self.claimed = asyncio.Event()
+
+    def claim(self, lane: _AsyncLane) -> bool:
+        if self.winner is None:
+            self.winner = lane
+            self.claimed.set()
+        return self.winner is lane
+
+
+async def async_hedged_stream(
+    streamer: AsyncMarkdownStream,
+    prompts: ResponseInputParam,
+    primary: Provider,
+    next_secondary: Callable[[], Optional[Provider]],
+    settings: HedgeSettings,
+    deadline: Deadline,
+) -> Provider:
+    """Async version of hedged_stream"""
+    _count("requests")
+    race = _AsyncRace(streamer)
+    lanes = [_AsyncLane(race, primary)]
+    lanes[0].start(prompts, deadline)
+    claimed = asyncio.ensure_future(race.claimed.wait())
+    try:
+        await asyncio.wait(
+            [claimed, lanes[0].task],
+            timeout=settings.first_token_deadline,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if race.winner is None and not lanes[0].task.done():
+            secondary = next_secondary()
+            if secondary is not None:
+                logger.info(
+                    f"{primary.name} produced nothing in "
+                    f"{settings.first_token_deadline}s, hedging with {secondary.name}"
+                )
+                _count("hedges")
+                lanes.append(_AsyncLane(race, secondary))
+                lanes[1].start(prompts, deadline)
+
+        pending = {lane.task for lane in lanes}
+        while race.winner is None and pending:
+            _, pending = await asyncio.wait(
+                [claimed, *pending], return_when=asyncio.FIRST_COMPLETED
+            )
+            pending.discard(claimed)
+    finally:
+        claimed.cancel()
+
+    winner = race.winner
+    for lane in lanes:
+        if lane is winner:
+            continue
+        if not lane.task.done():
+            _lose(lane)
+            lane.task.cancel()
+        elif winner is not None and not lane.task.cancelled():
+            # A loser that failed on its own; retrieve the error so it isn't
+            # reported as never retrieved
+            lane.task.exception()
+    if winner is None:
+        # Nobody produced output: surface the primary's error, if any
+        for lane in lanes:
+            if not lane.task.cancelled() and lane.task.exception() is not None:
+                raise lane.task.exception()
+        return primary
+
+    await winner.task
+    if len(lanes) > 1 and winner is lanes[1]:
+        _count("hedge_wins")
+    return winner.provider
@@ -0,0 +1,353 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from openai.types.responses import ResponseInputParam
+from slack_sdk import WebClient
+
+if TYPE_CHECKING:
+    # Needs aiohttp, which only the async app requires
+    from slack_sdk.web.async_client import AsyncWebClient
+
+logger = logging.getLogger(__name__)
+
+# Message subtypes that are part of the conversation; joins, edits etc. are not
+_CONVERSATION_SUBTYPES = (None, "bot_message", "thread_broadcast")
+SUMMARY_PREFIX = "Summary of the earlier conversation in this thread:\n"
+_REPLIES_PAGE_SIZE = 200
+_REPLIES_MAX_PAGES = 5
+
+
+@dataclass(frozen=True)
+class HistorySettings:
+    """
+    Settings for sending earlier messages of a thread along with a new one
+
+    Args:
+        enabled: Keep per-thread history; otherwise only the new message is sent
+        max_threads: Threads kept in memory before the least recently used is dropped
+        max_messages: Most recent messages kept per thread
+        idle_ttl: Seconds after its last message that a thread is dropped
+        summaries: Hold messages trimmed past max_messages for the summarizer
+          until a summary has folded them in; on with LLM_SUMMARY_ENABLED
+        max_unsummarized: Trimmed messages held per thread; beyond this the
+          oldest are dropped without being summarized
+    """
+
+    enabled: bool = True
+    max_threads: int = 1000
+    max_messages: int = 20
+    idle_ttl: float = 86400.0
+    summaries: bool = False
+    max_unsummarized: int = 100
+
+    @classmethod
+    def from_env(cls) -> "HistorySettings":
+        return cls(
+            enabled=os.getenv("LLM_HISTORY_ENABLED", "true").lower() == "true",
+            max_threads=int(os.getenv("LLM_HISTORY_MAX_THREADS", cls.max_threads)),
+            max_messages=int(os.getenv("LLM_HISTORY_MAX_MESSAGES", cls.max_messages)),
+            idle_ttl=float(os.getenv("LLM_HISTORY_IDLE_TTL", cls.idle_ttl)),
+            summaries=os.getenv("LLM_SUMMARY_ENABLED", "false").lower() == "true",
+            max_unsummarized=int(
+                os.getenv("LLM_HISTORY_MAX_UNSUMMARIZED", cls.max_unsummarized)
+            ),
+        )
+
+
+@dataclass
+class _Thread:
+    # (ts, role, text), oldest first; ts is None when Slack didn't return one
+    messages: List[Tuple[Optional[str], str, str]] = field(default_factory=list)
+    last_used: float = 0.0
+    # Rolling summary of the turns folded out of messages
+    summary: Optional[str] = None
+    # Turns trimmed from messages that the summary doesn't cover yet
+    unsummarized: List[Tuple[Optional[str], str, str]] = field(default_factory=list)
+
+
+def _to_turns(replies: List[Dict[str, Any]]) -> List[Tuple[Optional[str], str, str]]:
+    """Turn conversations.replies messages into (ts, role, text) turns"""
+    turns = []
+    for reply in replies:
+        text = reply.get("text")
+        if not text or reply.get("subtype") not in _CONVERSATION_SUBTYPES:
+            continue
+        role = "assistant" if reply.get("bot_id") else "user"
+        turns.append((reply.get("ts"), role, text))
+    return turns
+
+
+class ThreadHistory:
+    """
+    Recent messages per (channel, thread_ts), kept up to date from events
+
+    A thread's history is read with conversations.replies the first time the app
+    sees it; after that, incoming messages and the app's own replies are appended
+    as they happen, so each turn costs no Slack API call. Threads are dropped
+    least recently used first, or once they have been idle for idle_ttl.
+    With summaries on, messages trimmed past max_messages are no longer sent
+    but are held for summary_input until apply_summary folds them in.
+    """
+
+    def __init__(self, settings: HistorySettings, clock=time.monotonic):
+        self.settings = settings
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._threads: "OrderedDict[Tuple[str, str], _Thread]" = OrderedDict()
+        self._stats = {"fetches": 0, "fetch_errors": 0, "hits": 0, "evictions": 0}
+
+    def known(self, channel: str, thread_ts: str) -> bool:
+        with self._lock:
+            return self._touch((channel, thread_ts)) is not None
+
+    def start(
+        self,
+        channel: str,
+        thread_ts: str,
+        replies: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """Begin tracking a thread, seeded with its conversations.replies messages"""
+        with self._lock:
+            key = (channel, thread_ts)
+            if self._touch(key) is not None:
+                return
+            thread = _Thread(last_used=self._clock())
+            self._threads[key] = thread
+            for ts, role, text in _to_turns(replies or []):
+                self._add(thread, ts, role, text)
+            self._evict()
+
+    def add(
+        self, channel: str, thread_ts: str, ts: Optional[str], role: str, text: str
+    ):
+        """Append a message to a tracked thread; messages already seen are ignored"""
+        if not text:
+            return
+        with self._lock:
+            thread = self._touch((channel, thread_ts))
+            if thread is not None:
+                self._add(thread, ts, role, text)
+
+    def prompts(self, channel: str, thread_ts: str) -> ResponseInputParam:
+        with self._lock:
+            thread = self._touch((channel, thread_ts))
+            if thread is None:
+                return []
+            prompts: ResponseInputParam = []
+            if thread.summary:
+                prompts.append(
+                    {"role": "system", "content": SUMMARY_PREFIX + thread.summary}
+                )
+            prompts.extend(
+                {"role": role, "content": text} for _, role, text in thread.messages
+            )
+            return prompts
+
+    def summary_input(
+        self, channel: str, thread_ts: str, keep_recent: int
+    ) -> Optional[Tuple[Optional[str], List[Tuple[Optional[str], str, str]]]]:
+        """The current summary and the turns to fold into it, None if nothing to do"""
+        with self._lock:
+            thread = self._threads.get((channel, thread_ts))
+            if thread is None:
+                return None
+            older = thread.messages[: max(len(thread.messages) - keep_recent, 0)]
+            turns = thread.unsummarized + older
+            if not turns:
+                return None
+            return thread.summary, turns
+
+    def apply_summary(
+        self,
+        channel: str,
+        thread_ts: str,
+        summary: str,
+        folded: List[Tuple[Optional[str], str, str]],
+    ):
+        """Replace the folded turns with the summary that now covers them"""
+        with self._lock:
+            thread = self._threads.get((channel, thread_ts))
+            if thread is None:
+                return
+            thread.summary = summary
+            thread.messages = [m for m in thread.messages if m not in folded]
+            thread.unsummarized = [m for m in thread.unsummarized if m not in folded]
+
+    def count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["threads"] = len(self._threads)
+            stats["messages"] = sum(len(t.messages) for t in self._threads.values())
+        return stats
+
+    def _touch(self, key: Tuple[str, str]) -> Optional[_Thread]:
+        thread = self._threads.get(key)
+        if thread is None:
+            return None
+        now = self._clock()
+        if now - thread.last_used >= self.settings.idle_ttl:
+            del self._threads[key]
+            self._stats["evictions"] += 1
+            return None
+        thread.last_used = now
+        self._threads.move_to_end(key)
+        return thread
+
+    def _add(self, thread: _Thread, ts: Optional[str], role: str, text: str):
+        messages = thread.messages
+        if ts is not None and any(
+            seen == ts for seen, _, _ in messages + thread.unsummarized
+        ):
+            return
+        messages.append((ts, role, text))
+        # Events can arrive out of order
+        if ts is not None and len(messages) > 1 and messages[-2][0] is not None:
+            if float(messages[-2][0]) > float(ts):
+                messages.sort(key=lambda message: float(message[0] or 0))
+        trimmed = messages[: -self.settings.max_messages]
+        if trimmed:
+            if self.settings.summaries:
+                held = thread.unsummarized
+                held.extend(trimmed)
+                del held[: max(len(held) - self.settings.max_unsummarized, 0)]
+            del messages[: len(trimmed)]
+
+    def _evict(self):
+        now = self._clock()
+        while self._threads:
+            key, thread = next(iter(self._threads.items()))
+            idle = now - thread.last_used >= self.settings.idle_ttl
+            if not idle and len(self._threads) <= self.settings.max_threads:
+                break
+            del self._threads[key]
+            self._stats["evictions"] += 1
+
+
+_history: Optional[ThreadHistory] = None
+_history_lock = threading.Lock()
+_history_loaded = False
+
+
+def get_thread_history() -> Optional[ThreadHistory]:
+    """Return the process-wide thread history, or None if it is disabled"""
+    global _history, _history_loaded
+    if not _history_loaded:
+        with _history_lock:
+            if not _history_loaded:
+                settings = HistorySettings.from_env()
+                _history = ThreadHistory(settings) if settings.enabled else None
+                _history_loaded = True
+    return _history
+
+
+def _fetch_replies(
+    client: WebClient, channel: str, thread_ts: str
+) -> List[Dict[str, Any]]:
+    replies: List[Dict[str, Any]] = []
+    cursor = None
+    for _ in range(_REPLIES_MAX_PAGES):
+        response = client.conversations_replies(
+            channel=channel, ts=thread_ts, limit=_REPLIES_PAGE_SIZE, cursor=cursor
+        )
+        replies.extend(response.get("messages", []))
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            break
+    return replies
+
+
+async def _afetch_replies(
+    client: "AsyncWebClient", channel: str, thread_ts: str
+) -> List[Dict[str, Any]]:
+    replies: List[Dict[str, Any]] = []
+    cursor = None
+    for _ in range(_REPLIES_MAX_PAGES):
+        response = await client.conversations_replies(
+            channel=channel, ts=thread_ts, limit=_REPLIES_PAGE_SIZE, cursor=cursor
+        )
+        replies.extend(response.get("messages", []))
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            break
+    return replies
+
+
+def _single_prompt(text: str) -> ResponseInputParam:
+    return [{"role": "user", "content": text}]
+
+
+def thread_prompts(
+    client: WebClient,
+    channel: str,
+    thread_ts: str,
+    ts: Optional[str],
+    text: str,
+    new_thread: bool = False,
+) -> ResponseInputParam:
+    """
+    Prompts for a new message in a thread, with the thread's earlier messages
+
+    conversations.replies is only called for a thread the app hasn't seen yet,
+    and not at all for a new_thread (a top-level message starting one).
+    """
+    history = get_thread_history()
+    if history is None:
+        return _single_prompt(text)
+    if not history.known(channel, thread_ts):
+        replies = None
+        if not new_thread:
+            history.count("fetches")
+            try:
+                replies = _fetch_replies(client, channel, thread_ts)
+            except Exception as e:
+                history.count("fetch_errors")
+                logger.warning(f"Could not read the history of thread {thread_ts}: {e}")
+        history.start(channel, thread_ts, replies)
+    else:
+        history.count("hits")
+    history.add(channel, thread_ts, ts, "user", text)
+    return history.prompts(channel, thread_ts) or _single_prompt(text)
+
+
+async def athread_prompts(
+    client: "AsyncWebClient",
+    channel: str,
+    thread_ts: str,
+    ts: Optional[str],
+    text: str,
+    new_thread: bool = False,
+) -> ResponseInputParam:
+    """Async version of thread_prompts"""
+    history = get_thread_history()
+    if history is None:
+        return _single_prompt(text)
+    if not history.known(channel, thread_ts):
+        replies = None
+        if not new_thread:
+            history.count("fetches")
+            try:
+                replies = await _afetch_replies(client, channel, thread_ts)
+            except Exception as e:
+                history.count("fetch_errors")
+                logger.warning(f"Could not read the history of thread {thread_ts}: {e}")
+        history.start(channel, thread_ts, replies)
+    else:
+        history.count("hits")
+    history.add(channel, thread_ts, ts, "user", text)
+    return history.prompts(channel, thread_ts) or _single_prompt(text)
+
+
+def record_reply(channel: str, thread_ts: str, ts: Optional[str], text: str):
+    """Add the app's reply to the thread's history"""
+    history = get_thread_history()
+    if history is not None:
+        history.add(channel, thread_ts, ts, "assistant", text)
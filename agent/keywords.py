@@ -0,0 +1,159 @@
+import re
+from typing import Any, Dict, FrozenSet, List, Sequence, Set, Tuple
+
+# Topics of a message, as told apart by the contextual fallback
+CODE = "code"
+PYTHON = "python"
+JAVASCRIPT = "javascript"
+EXPLAIN = "explain"
+OPTIMIZE = "optimize"
+GREETING = "greeting"
+ERROR = "error"
+
+TOPIC_KEYWORDS: Dict[str, List[str]] = {
+    CODE: [
+        "python",
+        "javascript",
+        "java",
+        "c++",
+        "react",
+        "node",
+        "html",
+        "css",
+        "function",
+        "method",
+        "class",
+        "variable",
+        "array",
+        "object",
+        "string",
+        "code",
+        "programming",
+        "syntax",
+        "algorithm",
+        "debug",
+        "error",
+        "bug",
+        "コード",
+        "関数",
+        "変数",
+        "配列",
+        "プログラミング",
+        "アルゴリズム",
+        "エラー",
+        "バグ",
+    ],
+    PYTHON: ["python", "パイソン"],
+    JAVASCRIPT: ["javascript", "js"],
+    EXPLAIN: ["what is", "explain", "について", "とは", "教えて"],
+    OPTIMIZE: ["optimize", "最適化", "performance", "パフォーマンス", "speed", "高速"],
+    GREETING: ["hello", "hi", "こんにちは", "はじめまして", "help", "ヘルプ"],
+    ERROR: ["error", "エラー", "bug", "バグ", "debug", "fix", "修正", "解決"],
+}
+
+
+def _needs_word_boundary(keyword: str) -> bool:
+    # English keywords of up to two letters would be found inside too many words,
+    # so they only match as a whole word ("js" but not "json", "hi" but not
+    # "this"); every other keyword matches anywhere, as a plain substring
+    return keyword.isascii() and len(keyword) <= 2
+
+
+def _keyword_pattern(keyword: str) -> str:
+    """The regex that finds one keyword on its own"""
+    escaped = re.escape(keyword)
+    if _needs_word_boundary(keyword):
+        return rf"(?<![a-z0-9]){escaped}(?![a-z0-9])"
+    return escaped
+
+
+def _trie_pattern(keywords: Sequence[str]) -> str:
+    """
+    One regex matching the longest of keywords that starts at a position
+
+    Keywords sharing a prefix share its branch, so at each position re checks a
+    single character class instead of trying every keyword, and a text position
+    no keyword starts with is skipped by re's prefix scan.
+    """
+    root: Dict[str, Any] = {}
+    for keyword in keywords:
+        node = root
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = keyword
+
+    def emit(node: Dict[str, Any]) -> str:
+        branches = [
+            re.escape(char) + emit(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        keyword = node.get("")
+        # A whole word: nothing alphanumeric before the keyword's first character
+        # or after its last
+        end = (
+            rf"(?<![a-z0-9]{'.' * len(keyword)})(?![a-z0-9])"
+            if keyword is not None and _needs_word_boundary(keyword)
+            else ""
+        )
+        if not branches:
+            return end
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if keyword is None:
+            return body
+        # Longer keywords first, then the one ending here
+        return f"(?:{body}|{end})" if end else f"(?:{body})?"
+
+    return emit(root)
+
+
+class KeywordMatcher:
+    """
+    Finds which intents of a keyword table a text mentions
+
+    The table is compiled once into a single regex, a trie of every distinct
+    keyword (see _trie_pattern). match() lowercases the text and scans it once,
+    returning every intent mentioned: each match is the longest keyword starting
+    at its position and also counts for the keywords it contains ("javascript"
+    for "java"), and the scan resumes one character after a match's start so
+    that overlapping keywords are seen too. It stops as soon as every intent of
+    the table has been found.
+    """
+
+    def __init__(self, table: Dict[str, Sequence[str]]):
+        self._intents = tuple(table)
+        intents_of: Dict[str, Set[str]] = {}
+        for intent, keywords in table.items():
+            for keyword in keywords:
+                intents_of.setdefault(keyword.lower(), set()).add(intent)
+        self._intents_of: Dict[str, FrozenSet[str]] = {}
+        for keyword, intents in intents_of.items():
+            contained = set(intents)
+            for other, other_intents in intents_of.items():
+                if other in keyword and not _needs_word_boundary(other):
+                    contained |= other_intents
+            self._intents_of[keyword] = frozenset(contained)
+        self._pattern = re.compile(_trie_pattern(list(intents_of)))
+
+    @property
+    def intents(self) -> Tuple[str, ...]:
+        return self._intents
+
+    def match(self, text: str) -> FrozenSet[str]:
+        text = text.lower()
+        found: Set[str] = set()
+        hit = self._pattern.search(text)
+        while hit is not None:
+            found |= self._intents_of[hit.group()]
+            if len(found) == len(self._intents):
+                break
+            hit = self._pattern.search(text, hit.start() + 1)
+        return frozenset(found)
+
+
+TOPIC_MATCHER = KeywordMatcher(TOPIC_KEYWORDS)
+
+
+def match_topics(text: str) -> FrozenSet[str]:
+    """Topics of TOPIC_KEYWORDS that text mentions"""
+    return TOPIC_MATCHER.match(text)
@@ -0,0 +1,432 @@
+import ast
+import asyncio
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Sequence, Union
+
+from openai.types.responses import ResponseInputParam
+from slack_sdk.models.messages.chunk import TaskUpdateChunk
+
+from agent.deadlines import Deadline
+from agent.formatter import HUGGINGFACE_BANNER
+from agent.health import get_breaker
+from agent.prompt_budget import get_prompt_builder
+from agent.providers import Provider
+from agent.streaming import (
+    AsyncMarkdownStream,
+    AsyncTextBuffer,
+    MarkdownStream,
+    TextBuffer,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUESTION = "Can you explain what this code does?"
+
+_FENCE = re.compile(r"```([^\n`]*)\n(.*?)```", re.DOTALL)
+# Lines that start a top-level definition in common languages other than Python
+_TOP_LEVEL = re.compile(
+    r"^(?:@|async |class |def |enum |export |func |function |impl |interface "
+    r"|module |namespace |package |pub |public |private |protected |static |struct "
+    r"|template|trait |type |#include|#define|const |let |var )"
+)
+
+
+@dataclass(frozen=True)
+class LargeInputSettings:
+    """
+    Settings for answering questions about code too long to send at once
+
+    Args:
+        enabled: Split large pasted code into parts that are analyzed separately
+        min_tokens: A message with at least this many tokens is split
+        chunk_tokens: Tokens per part
+        max_chunks: Parts per message; larger code gets larger parts
+        workers: Parts analyzed at the same time
+        reduce_reserve: Share of the request's total deadline kept for the final
+          answer; parts not reviewed by then are left out of it
+    """
+
+    enabled: bool = True
+    min_tokens: int = 6000
+    chunk_tokens: int = 3000
+    max_chunks: int = 12
+    workers: int = 4
+    reduce_reserve: float = 0.4
+
+    @classmethod
+    def from_env(cls) -> "LargeInputSettings":
+        return cls(
+            enabled=os.getenv("LLM_LARGE_INPUT_ENABLED", "true").lower() == "true",
+            min_tokens=int(os.getenv("LLM_LARGE_INPUT_MIN_TOKENS", cls.min_tokens)),
+            chunk_tokens=int(
+                os.getenv("LLM_LARGE_INPUT_CHUNK_TOKENS", cls.chunk_tokens)
+            ),
+            max_chunks=int(os.getenv("LLM_LARGE_INPUT_MAX_CHUNKS", cls.max_chunks)),
+            workers=int(os.getenv("LLM_LARGE_INPUT_WORKERS", cls.workers)),
+            reduce_reserve=float(
+                os.getenv("LLM_LARGE_INPUT_REDUCE_RESERVE", cls.reduce_reserve)
+            ),
+        )
+
+    def map_deadline(self, deadline: Deadline) -> Deadline:
+        """The part of deadline the parts are reviewed in"""
+        return deadline.reserve(self.reduce_reserve * deadline.settings.total)
+
+
+@dataclass(frozen=True)
+class CodeChunk:
+    """Lines first_line to last_line (1-based, inclusive) of the pasted code"""
+
+    first_line: int
+    last_line: int
+    text: str
+
+
+@dataclass(frozen=True)
+class LargeInput:
+    question: str
+    language: str
+    line_count: int
+    chunks: List[CodeChunk]
+
+
+def _split_message(text: str):
+    """Separate the question from the code: (question, code, language)"""
+    blocks = list(_FENCE.finditer(text))
+    if blocks:
+        block = max(blocks, key=lambda match: len(match.group(2)))
+        question = (text[: block.start()] + text[block.end() :]).strip()
+        return question, block.group(2), block.group(1).strip()
+    # Without a fence, a short first line is taken to be the question
+    first, _, rest = text.partition("\n")
+    if len(first) <= 300 and rest.strip():
+        return first.strip(), rest, ""
+    return "", text, ""
+
+
+def _python_starts(code: str, lines: List[str]) -> Optional[List[int]]:
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    starts = []
+    for node in tree.body:
+        decorators = getattr(node, "decorator_list", [])
+        start = min([node.lineno] + [d.lineno for d in decorators]) - 1
+        # Comments right above a definition belong to it
+        while start > 0 and lines[start - 1].lstrip().startswith("#"):
+            start -= 1
+        starts.append(start)
+    return starts
+
+
+def _heuristic_starts(lines: List[str]) -> List[int]:
+    starts = []
+    for i, line in enumerate(lines):
+        if not line or line[0].isspace() or line[0] in "})]":
+            continue
+        previous = lines[i - 1].rstrip() if i else ""
+        if not previous or previous.endswith("}") or _TOP_LEVEL.match(line):
+            starts.append(i)
+    return starts
+
+
+def split_code(code: str, chunk_tokens: int) -> List[CodeChunk]:
+    """
+    Split code into parts of about chunk_tokens at top-level boundaries
+
+    Python is split between the top-level statements ast finds; other languages
+    at unindented lines that start a definition or follow a blank line or a
+    closing brace. A single definition larger than a part is split between lines.
+    """
+    lines = code.split("\n")
+    starts = _python_starts(code, lines)
+    if starts is None:
+        starts = _heuristic_starts(lines)
+    bounds = sorted(set([0] + starts)) + [len(lines)]
+    segments = [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+    count = get_prompt_builder().counter.count
+    chunks: List[CodeChunk] = []
+    first, tokens = 0, 0
+
+    def close(end: int):
+        nonlocal first, tokens
+        if end > first:
+            text = "\n".join(lines[first:end])
+            chunks.append(CodeChunk(first + 1, end, text))
+        first, tokens = end, 0
+
+    for start, end in segments:
+        size = count("\n".join(lines[start:end]))
+        if tokens and tokens + size > chunk_tokens:
+            close(start)
+        if size <= chunk_tokens:
+            tokens += size
+            continue
+        # One definition is larger than a part on its own
+        for line in range(start, end):
+            line_tokens = count(lines[line]) + 1
+            if tokens and tokens + line_tokens > chunk_tokens:
+                close(line)
+            tokens += line_tokens
+    close(len(lines))
+    return chunks
+
+
+def plan_large_input(
+    user_message: str, settings: Optional[LargeInputSettings] = None
+) -> Optional[LargeInput]:
+    """How to split user_message, None if it is small enough to send as it is"""
+    settings = settings or LargeInputSettings.from_env()
+    if not settings.enabled:
+        return None
+    count = get_prompt_builder().counter.count
+    tokens = count(user_message)
+    if tokens < settings.min_tokens:
+        return None
+    question, code, language = _split_message(user_message)
+    chunk_tokens = max(settings.chunk_tokens, -(-tokens // settings.max_chunks))
+    chunks = split_code(code, chunk_tokens)
+    if len(chunks) < 2:
+        return None
+    logger.info(f"Splitting {tokens} tokens of code into {len(chunks)} parts")
+    return LargeInput(
+        question=question or DEFAULT_QUESTION,
+        language=language,
+        line_count=code.count("\n") + 1,
+        chunks=chunks,
+    )
+
+
+def _part_title(chunk: CodeChunk) -> str:
+    return f"Reading lines {chunk.first_line}-{chunk.last_line}..."
+
+
+def _map_prompts(plan: LargeInput, index: int) -> ResponseInputParam:
+    chunk = plan.chunks[index]
+    part = (
+        f"Part {index + 1} of {len(plan.chunks)} of the code in question, "
+        f"lines {chunk.first_line}-{chunk.last_line} of {plan.line_count}:\n\n"
+        f"```{plan.language}\n{chunk.text}\n```"
+    )
+    # The code goes in a system message so that a provider looking at the latest
+    # user message (e.g. for dice rolls) only sees the question
+    return [
+        {"role": "system", "content": part},
+        {
+            "role": "user",
+            "content": (
+                f"{plan.question}\n\nOnly this part of the code is shown; the other "
+                "parts are reviewed separately. Write short notes on what in this "
+                "part matters for the question, with line numbers. Don't write a "
+                "final answer."
+            ),
+        },
+    ]
+
+
+def _reduce_prompts(
+    prompts: ResponseInputParam, plan: LargeInput, notes: List[Optional[str]]
+) -> ResponseInputParam:
+    sections = []
+    for index, (chunk, note) in enumerate(zip(plan.chunks, notes)):
+        sections.append(
+            f"Part {index + 1} (lines {chunk.first_line}-{chunk.last_line}):\n"
+            + (note or "(this part could not be reviewed)")
+        )
+    merged = (
+        f"{plan.question}\n\nThe code ({plan.line_count} lines) was too long to "
+        f"review at once, so it was reviewed in {len(plan.chunks)} parts. "
+        "Notes on each part:\n\n" + "\n\n".join(sections) + "\n\nUsing these notes, "
+        "answer the question about the whole code."
+    )
+    return list(prompts)[:-1] + [{"role": "user", "content": merged}]
+
+
+def _rotation(providers: Sequence[Provider], index: int) -> List[Provider]:
+    """
+    Providers for a part, starting at a different one per part to spread load
+
+    last_resort providers (the local model) are left out of the rotation and
+    only tried after all the others, as they are for live requests.
+    """
+    rotated = [provider for provider in providers if not provider.last_resort]
+    if rotated:
+        offset = index % len(rotated)
+        rotated = rotated[offset:] + rotated[:offset]
+    return rotated + [provider for provider in providers if provider.last_resort]
+
+
+def _note(buffer: Union[TextBuffer, AsyncTextBuffer]) -> str:
+    """The notes in a buffer, without the banner a Hugging Face answer starts with"""
+    return buffer.text.removeprefix(HUGGINGFACE_BANNER).strip()
+
+
+class _Progress:
+    """TaskUpdateChunks for the parts; workers pick parts up in order"""
+
+    def __init__(self, plan: LargeInput, workers: int):
+        self.plan = plan
+        self.next_start = min(workers, len(plan.chunks))
+
+    def started(self) -> List[TaskUpdateChunk]:
+        return [
+            TaskUpdateChunk(
+                id=f"part-{index}",
+                title=_part_title(chunk),
+                status="in_progress" if index < self.next_start else "pending",
+            )
+            for index, chunk in enumerate(self.plan.chunks)
+        ]
+
+    def finished(self, index: int, ok: bool) -> List[TaskUpdateChunk]:
+        chunk = self.plan.chunks[index]
+        updates = [
+            TaskUpdateChunk(
+                id=f"part-{index}",
+                title=_part_title(chunk),
+                status="complete" if ok else "error",
+            )
+        ]
+        if self.next_start < len(self.plan.chunks):
+            pending = self.plan.chunks[self.next_start]
+            updates.append(
+                TaskUpdateChunk(
+                    id=f"part-{self.next_start}",
+                    title=_part_title(pending),
+                    status="in_progress",
+                )
+            )
+            self.next_start += 1
+        return updates
+
+
+def _analyze_part(
+    plan: LargeInput, index: int, providers: Sequence[Provider], deadline: Deadline
+) -> Optional[str]:
+    prompts = _map_prompts(plan, index)
+    for provider in _rotation(providers, index):
+        if deadline.expired():
+            break
+        if not get_breaker(provider.name).allow_request():
+            continue
+        buffer = TextBuffer()
+        try:
+            provider.run(buffer, prompts, deadline)
+        except Exception as e:
+            logger.info(f"{provider.name} could not review part {index + 1}: {e}")
+            continue
+        note = _note(buffer)
+        if note:
+            return note
+    return None
+
+
+def map_reduce(
+    streamer: MarkdownStream,
+    prompts: ResponseInputParam,
+    plan: LargeInput,
+    providers: Sequence[Provider],
+    deadline: Deadline,
+    answer: Callable[[MarkdownStream, ResponseInputParam], None],
+    settings: Optional[LargeInputSettings] = None,
+):
+    """
+    Review each part of the code on its own, then stream one merged answer
+
+    Parts are reviewed by up to settings.workers providers calls at a time, spread
+    over the providers; each part shows as a task that completes when its notes
+    are in. answer(streamer, prompts) streams the final answer from the notes.
+    The parts only get the deadline minus settings.reduce_reserve of it, so the
+    answer always has that much time left; parts not reviewed by then are
+    skipped and the answer is written from the notes there are.
+    """
+    settings = settings or LargeInputSettings.from_env()
+    progress = _Progress(plan, settings.workers)
+    streamer.append(chunks=progress.started())
+    notes: List[Optional[str]] = [None] * len(plan.chunks)
+    map_deadline = settings.map_deadline(deadline)
+    with ThreadPoolExecutor(
+        max_workers=settings.workers, thread_name_prefix="large-input"
+    ) as pool:
+        futures = {
+            pool.submit(_analyze_part, plan, index, providers, map_deadline): index
+            for index in range(len(plan.chunks))
+        }
+        # Task updates are appended from this thread only
+        for future in as_completed(futures):
+            index = futures[future]
+            notes[index] = future.result()
+            streamer.append(chunks=progress.finished(index, notes[index] is not None))
+    _log_skipped(notes, map_deadline)
+    answer(streamer, _reduce_prompts(prompts, plan, notes))
+
+
+def _log_skipped(notes: List[Optional[str]], map_deadline: Deadline):
+    if map_deadline.expired():
+        missing = sum(1 for note in notes if note is None)
+        logger.warning(
+            f"Review time ran out with {missing} of {len(notes)} parts unreviewed, "
+            "answering from the notes there are"
+        )
+
+
+async def _aanalyze_part(
+    plan: LargeInput,
+    index: int,
+    providers: Sequence[Provider],
+    deadline: Deadline,
+    slots: asyncio.Semaphore,
+) -> Optional[str]:
+    prompts = _map_prompts(plan, index)
+    async with slots:
+        for provider in _rotation(providers, index):
+            if deadline.expired():
+                break
+            if not get_breaker(provider.name).allow_request():
+                continue
+            buffer = AsyncTextBuffer()
+            try:
+                await provider.arun(buffer, prompts, deadline)
+            except Exception as e:
+                logger.info(f"{provider.name} could not review part {index + 1}: {e}")
+                continue
+            note = _note(buffer)
+            if note:
+                return note
+    return None
+
+
+async def async_map_reduce(
+    streamer: AsyncMarkdownStream,
+    prompts: ResponseInputParam,
+    plan: LargeInput,
+    providers: Sequence[Provider],
+    deadline: Deadline,
+    answer: Callable[[AsyncMarkdownStream, ResponseInputParam], Awaitable[None]],
+    settings: Optional[LargeInputSettings] = None,
+):
+    """Async version of map_reduce"""
+    settings = settings or LargeInputSettings.from_env()
+    progress = _Progress(plan, settings.workers)
+    await streamer.append(chunks=progress.started())
+    notes: List[Optional[str]] = [None] * len(plan.chunks)
+    slots = asyncio.Semaphore(settings.workers)
+    map_deadline = settings.map_deadline(deadline)
+
+    async def review(index: int):
+        return index, await _aanalyze_part(plan, index, providers, map_deadline, slots)
+
+    for next_done in asyncio.as_completed(
+        [review(index) for index in range(len(plan.chunks))]
+    ):
+        index, note = await next_done
+        notes[index] = note
+        await streamer.append(chunks=progress.finished(index, note is not None))
+    _log_skipped(notes, map_deadline)
+    await answer(streamer, _reduce_prompts(prompts, plan, notes))
@@ -1,59 +1,189 @@
 import json
 import logging
 import os
+from typing import Any, Dict, List, Optional, Tuple
 
-import openai
 from openai.types.responses import ResponseInputParam
 from slack_sdk.models.messages.chunk import TaskUpdateChunk
 from slack_sdk.web.chat_stream import ChatStream
 
-from agent.tools.dice import roll_dice, roll_dice_definition
+from agent.cache import RecordingStreamer
+from agent.clients import get_huggingface_client, get_openai_client
+from agent.deadlines import Deadline
+from agent.failover import (
+    CUT_OFF_NOTICE,
+    UNAVAILABLE_MESSAGE,
+    Failover,
+    PreparedRequest,
+    prepare_request,
+)
+from agent.fast_path import (
+    DICE,
+    DICE_EXPRESSION,
+    match_fast_path,
+    mentions_dice,
+    record_fast_path,
+)
+from agent.formatter import HUGGINGFACE_BANNER, SlackMarkdownFormatter
+from agent.hedging import hedged_stream
+from agent.keywords import (
+    CODE,
+    ERROR,
+    EXPLAIN,
+    GREETING,
+    JAVASCRIPT,
+    OPTIMIZE,
+    PYTHON,
+    match_topics,
+)
+from agent.large_input import map_reduce, plan_large_input
+from agent.local_model import DEFAULT_LOCAL_MODEL, local_model_ready, stream_local
+from agent.prompts import SYSTEM_PROMPT, latest_user_message, to_chat_messages
+from agent.providers import Provider, register_provider
+from agent.single_flight import single_flight
+from agent.slack_rate_limit import stream_pressure
+from agent.streaming import (
+    CoalescingStreamer,
+    FlushPolicy,
+    MarkdownStream,
+    PipelinedStreamer,
+    PipelineSettings,
+    StreamCancelled,
+    StreamTimer,
+)
+from agent.tools.dice import roll_dice
+from agent.tools.runner import (
+    TOOL_DEFINITIONS,
+    RoundTimings,
+    ToolLoopSettings,
+    run_tool_calls,
+)
 
 logger = logging.getLogger(__name__)
 
+OPENAI_MODEL = "gpt-4o-mini"
+HUGGINGFACE_MODEL = "Qwen/Qwen2.5-Coder-32B-Instruct"
 
-def _format_slack_response(response: str) -> str:
-    """Format AI response for Slack with proper markdown"""
+_INTRO_RESPONSE = """👋 こんにちは！コード専門のアシスタントです。
 
-    # Clean up the response
-    response = response.strip()
+**お手伝いできること:**
+💻 コードの説明と解析
+🐛 エラーの診断と修正
+⚡ パフォーマンス最適化
+🔧 新機能の実装支援
+❓ プログラミングの質問回答
+
+何かお困りのことがあれば、お気軽にお聞きください！"""
 
-    # Remove common AI response prefixes
-    prefixes_to_remove = ["Response:", "Assistant:", "AI:", "Bot:", "Here's", "Here is"]
+_ENGLISH_INTRO_RESPONSE = """👋 Hi! I'm an assistant for your code.
 
-    for prefix in prefixes_to_remove:
-        if response.startswith(prefix):
-            response = response[len(prefix) :].strip()
-            break
+**I can help with:**
+💻 Explaining and analyzing code
+🐛 Diagnosing and fixing errors
+⚡ Optimizing performance
+🔧 Implementing new features
+❓ Answering programming questions
 
-    # Ensure code blocks are properly formatted for Slack
-    import re
+Paste some code or ask me anything about programming!"""
 
-    # Convert triple backticks to Slack format if needed
-    response = re.sub(
-        r"```(\w+)?\n(.*?)\n```", r"```\1\n\2\n```", response, flags=re.DOTALL
+
+def _build_huggingface_messages(
+    system_prompt: str, user_message: str, conversation_history: Optional[list] = None
+) -> list:
+    """Chat messages for the system prompt, earlier turns and the user message"""
+    messages = [{"role": "system", "content": system_prompt}]
+    # Earlier turns are chat messages; older callers pass "User: ..." strings
+    messages.extend(
+        turn for turn in conversation_history or [] if isinstance(turn, dict)
     )
+    messages.append({"role": "user", "content": user_message})
+    return messages
 
-    # Ensure single backticks for inline code
-    response = re.sub(r"`([^`\n]+)`", r"`\1`", response)
-
-    # Add emoji for better visual appeal
-    if any(
-        keyword in response.lower()
-        for keyword in ["code", "function", "class", "method", "variable"]
-    ):
-        return f"💻 {response}"
-    elif any(
-        keyword in response.lower() for keyword in ["error", "bug", "issue", "problem"]
-    ):
-        return f"🐛 {response}"
-    elif any(
-        keyword in response.lower()
-        for keyword in ["optimize", "improve", "better", "performance"]
-    ):
-        return f"⚡ {response}"
-    else:
-        return f"🤖 {response}"
+
+def _split_conversation(prompts: ResponseInputParam) -> Tuple[list, str]:
+    """Chat messages before the latest user message, and that message"""
+    messages = to_chat_messages(prompts)[1:]
+    if messages and messages[-1]["role"] == "user":
+        return messages[:-1], messages[-1]["content"]
+    return messages, ""
+
+
+def _stream_huggingface_chat_completion(
+    streamer: MarkdownStream,
+    system_prompt: str,
+    user_message: str,
+    conversation_history: list,
+    deadline: Deadline,
+) -> bool:
+    """
+    Stream a Hugging Face chat completion into Slack as deltas arrive
+
+    Raises if the API call fails or runs out of time. Returns False if there was
+    nothing to append.
+    """
+    api_key = os.getenv("HUGGINGFACE_API_KEY")
+    if not api_key:
+        logger.warning("HUGGINGFACE_API_KEY not found")
+        return False
+
+    formatter = SlackMarkdownFormatter()
+    timer = StreamTimer("huggingface")
+    watch = deadline.watch("huggingface")
+    try:
+        client = get_huggingface_client(api_key, timeout=watch.read_timeout())
+        logger.info(
+            f"Streaming {HUGGINGFACE_MODEL} with message: {user_message[:100]}..."
+        )
+        stream = client.chat_completion(
+            **_huggingface_request(system_prompt, user_message, conversation_history)
+        )
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                watch.tick(bool(delta))
+                if not delta:
+                    continue
+                timer.mark(delta)
+                text = _with_banner(formatter, formatter.feed, delta)
+                if text:
+                    streamer.append(markdown_text=text)
+        finally:
+            # Stop reading the response if the stream is cut short
+            stream.close()
+    except Exception as e:
+        logger.error(f"Error streaming Hugging Face Chat Completion API: {e}")
+        raise
+    finally:
+        timer.report()
+
+    text = _with_banner(formatter, formatter.finish)
+    if text:
+        streamer.append(markdown_text=text)
+    return formatter.started
+
+
+def _huggingface_request(
+    system_prompt: str, user_message: str, conversation_history: list
+) -> Dict[str, Any]:
+    """Arguments for a streamed InferenceClient.chat_completion"""
+    return {
+        "model": HUGGINGFACE_MODEL,
+        "messages": _build_huggingface_messages(
+            system_prompt, user_message, conversation_history
+        ),
+        "max_tokens": 2000,
+        "temperature": 0.7,
+        "stream": True,
+    }
+
+
+def _with_banner(formatter: SlackMarkdownFormatter, step, *args) -> str:
+    """Run a formatter step, putting the banner in front of the first text"""
+    started = formatter.started
+    text = step(*args)
+    if text and not started:
+        return HUGGINGFACE_BANNER + text
+    return text
 
 
 def _call_huggingface_chat_completion(
@@ -66,26 +196,21 @@ def _call_huggingface_chat_completion(
         logger.warning("HUGGINGFACE_API_KEY not found")
         return ""
     try:
-        from huggingface_hub import InferenceClient
-
         logger.info("Using Hugging Face Chat Completion API")
 
-        # Create inference client using the new router endpoint
-        client = InferenceClient(token=api_key, base_url="https://router.huggingface.co/v1")
+        # Shared inference client for the router endpoint, reusing pooled connections
+        client = get_huggingface_client(api_key)
 
         # Build messages array like in Node.js sample
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message},
-        ]
+        messages = _build_huggingface_messages(system_prompt, user_message)
 
         logger.info(
-            f"Calling Qwen/Qwen2.5-Coder-32B-Instruct with message: {user_message[:100]}..."
+            f"Calling {HUGGINGFACE_MODEL} with message: {user_message[:100]}..."
         )
 
         # Use the same model as Node.js sample
         result = client.chat_completion(
-            model="Qwen/Qwen2.5-Coder-32B-Instruct",
+            model=HUGGINGFACE_MODEL,
             messages=messages,
             max_tokens=2000,
             temperature=0.7,
@@ -115,50 +240,27 @@ def _call_huggingface_chat_completion(
 
         logger.error(f"Full traceback: {traceback.format_exc()}")
 
-        # Fallback to contextual responses if API fails
-        logger.info("DEBUG: Falling back to contextual response generation")
+        return _contextual_fallback_response(user_message)
 
-        # Analyze the user message for context and intent
-        user_message_lower = user_message.lower()
-        logger.info(
-            f"DEBUG: user_message_lower for contextual responses: {user_message_lower}"
-        )
 
-        # Code-related questions
-        code_keywords = [
-            "python",
-            "javascript",
-            "java",
-            "c++",
-            "react",
-            "node",
-            "html",
-            "css",
-            "function",
-            "method",
-            "class",
-            "variable",
-            "array",
-            "object",
-            "string",
-            "code",
-            "programming",
-            "syntax",
-            "algorithm",
-            "debug",
-            "error",
-            "bug",
-        ]
-
-        if any(keyword in user_message_lower for keyword in code_keywords):
-            logger.info("DEBUG: Found code-related keywords, processing...")
-
-            # Check for specific Python explanation requests
-            if "python" in user_message_lower and any(
-                q in user_message_lower for q in ["what is", "explain", "について"]
-            ):
-                logger.info("DEBUG: Found Python explanation request")
-                return """💻 Pythonは、シンプルで読みやすい構文を持つプログラミング言語です。
+def _contextual_fallback_response(user_message: str) -> str:
+    """Canned, topic-aware answer used when the Hugging Face API call fails"""
+
+    # Fallback to contextual responses if API fails
+    logger.info("DEBUG: Falling back to contextual response generation")
+
+    # Every topic of the keyword table that the message mentions, looked up at once
+    topics = match_topics(user_message)
+    logger.info(f"DEBUG: topics for contextual responses: {sorted(topics)}")
+
+    # Code-related questions
+    if CODE in topics:
+        logger.info("DEBUG: Found code-related keywords, processing...")
+
+        # Check for specific Python explanation requests
+        if PYTHON in topics and EXPLAIN in topics:
+            logger.info("DEBUG: Found Python explanation request")
+            return """💻 Pythonは、シンプルで読みやすい構文を持つプログラミング言語です。
 
 **特徴:**
 - 初心者にも学びやすい
@@ -180,10 +282,10 @@ print(message)
 
 何か具体的なPythonの質問があれば、お気軽にお聞きください！"""
 
-            # Check for JavaScript
-            elif "javascript" in user_message_lower or "js" in user_message_lower:
-                logger.info("DEBUG: Found JavaScript keywords")
-                return """💻 JavaScriptは、主にWebブラウザで動作するプログラミング言語です。
+        # Check for JavaScript
+        elif JAVASCRIPT in topics:
+            logger.info("DEBUG: Found JavaScript keywords")
+            return """💻 JavaScriptは、主にWebブラウザで動作するプログラミング言語です。
 
 **用途:**
 - Webページのインタラクティブな機能
@@ -205,19 +307,9 @@ document.getElementById("myButton").addEventListener("click", function() {
 
 具体的なJavaScriptの質問があれば、詳しく説明します！"""
 
-            # Optimization questions
-            elif any(
-                keyword in user_message_lower
-                for keyword in [
-                    "optimize",
-                    "最適化",
-                    "performance",
-                    "パフォーマンス",
-                    "speed",
-                    "高速",
-                ]
-            ):
-                return """⚡ コードの最適化についてお手伝いします！
+        # Optimization questions
+        elif OPTIMIZE in topics:
+            return """⚡ コードの最適化についてお手伝いします！
 
 **最適化のポイント:**
 - アルゴリズムの計算量改善
@@ -227,44 +319,13 @@ document.getElementById("myButton").addEventListener("click", function() {
 
 最適化したいコードを教えていただければ、具体的な改善提案をします！"""
 
-            # General help or greeting
-            elif any(
-                keyword in user_message_lower
-                for keyword in [
-                    "hello",
-                    "hi",
-                    "こんにちは",
-                    "はじめまして",
-                    "help",
-                    "ヘルプ",
-                ]
-            ):
-                return """👋 こんにちは！コード専門のアシスタントです。
+        # General help or greeting
+        elif GREETING in topics:
+            return _INTRO_RESPONSE
 
-**お手伝いできること:**
-💻 コードの説明と解析
-🐛 エラーの診断と修正
-⚡ パフォーマンス最適化
-🔧 新機能の実装支援
-❓ プログラミングの質問回答
-
-何かお困りのことがあれば、お気軽にお聞きください！"""
-
-            # Error/debugging questions
-            elif any(
-                keyword in user_message_lower
-                for keyword in [
-                    "error",
-                    "エラー",
-                    "bug",
-                    "バグ",
-                    "debug",
-                    "fix",
-                    "修正",
-                    "解決",
-                ]
-            ):
-                return """🐛 エラーやバグの解決をお手伝いします！
+        # Error/debugging questions
+        elif ERROR in topics:
+            return """🐛 エラーやバグの解決をお手伝いします！
 
 **トラブルシューティングのために以下の情報があると助かります:**
 1. エラーメッセージの全文
@@ -274,10 +335,10 @@ document.getElementById("myButton").addEventListener("click", function() {
 
 コードとエラーメッセージを共有していただければ、原因と解決策を提案します！"""
 
-            # General programming response for all other code-related questions
-            else:
-                logger.info("DEBUG: Using general programming response")
-                return """💻 プログラミングに関するご質問ですね！
+        # General programming response for all other code-related questions
+        else:
+            logger.info("DEBUG: Using general programming response")
+            return """💻 プログラミングに関するご質問ですね！
 
 コードの説明、デバッグ、最適化など、どのようなことでもお手伝いします。
 
@@ -289,9 +350,9 @@ document.getElementById("myButton").addEventListener("click", function() {
 
 コードを貼り付けていただければ、詳しく分析してアドバイスします！"""
 
-        # Fallback for non-programming questions
-        else:
-            return f"""🤖 「{user_message}」についてのご質問ですね。
+    # Fallback for non-programming questions
+    else:
+        return f"""🤖 「{user_message}」についてのご質問ですね。
 
 私はプログラミング専門のアシスタントです。以下のようなことでお手伝いできます：
 
@@ -308,153 +369,388 @@ document.getElementById("myButton").addEventListener("click", function() {
 def call_llm(
     streamer: ChatStream,
     prompts: ResponseInputParam,
+    deadline: Optional[Deadline] = None,
 ):
     """
-    Stream an LLM response to prompts with fallback to Hugging Face chat completion
-    Tries OpenAI first, falls back to Hugging Face if OpenAI fails
+    Stream an LLM response to prompts with fallback across providers
+    The router picks the provider order (OpenAI, Hugging Face and any other
+    configured backend); a provider that fails hands over to the next one.
+    The deadline should be started when the Slack event arrives; a provider that
+    is slow to connect, slow to start, stalls or runs past the total budget is cut
+    off, and once the total budget is spent the local fallback answers
 
     https://docs.slack.dev/tools/python-slack-sdk/web#sending-streaming-messages
     https://platform.openai.com/docs/guides/text
     https://platform.openai.com/docs/guides/streaming-responses
     https://platform.openai.com/docs/guides/function-calling
     """
-    openai_api_key = os.getenv("OPENAI_API_KEY")
+    # Deltas are merged before they reach Slack so that each token fragment is
+    # not its own chat.appendStream call, and more so near the rate limit
+    writer = CoalescingStreamer(
+        streamer, FlushPolicy.from_env(), pressure=stream_pressure(streamer)
+    )
+    pipeline = PipelineSettings.from_env()
+    if pipeline.enabled:
+        # Slack appends run on their own thread so a slow chat.appendStream does not
+        # hold up reading the provider stream
+        writer = PipelinedStreamer(writer, queue_size=pipeline.queue_size)
+    if deadline is None:
+        deadline = Deadline.start()
+    try:
+        _call_llm_with_fallback(writer, prompts, deadline)
+    finally:
+        writer.flush()
+
+
+def _call_llm_with_fallback(
+    streamer: MarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """Try providers in the order picked by the router until one succeeds"""
+    user_message = latest_user_message(prompts)
+    # Greetings, help requests and dice rolls are answered without a provider
+    reply = _fast_path_reply(user_message)
+    if reply is not None:
+        streamer.append(markdown_text=reply)
+        return
+    request = prepare_request(prompts, user_message, mentions_dice(user_message))
+
+    hit = request.cache.lookup(request.providers)
+    if hit is not None:
+        # The whole response is appended at once and goes out with the flush
+        streamer.append(markdown_text=request.replay(hit))
+        return
+
+    plan = plan_large_input(user_message) if request.providers else None
+    if plan is not None:
+        # Code too long for one request is reviewed in parts, then answered
+        request.decision.details["large_input_parts"] = len(plan.chunks)
+        map_reduce(
+            streamer,
+            request.prompts,
+            plan,
+            request.providers,
+            deadline,
+            lambda target, merged: _stream_from_providers(
+                target, merged, plan.question, request, deadline
+            ),
+        )
+        return
 
-    if openai_api_key:
-        # Try OpenAI first
+    def generate(target: MarkdownStream):
+        _stream_from_providers(target, request.prompts, user_message, request, deadline)
+
+    key = request.single_flight_key()
+    if key is not None:
+        # Identical requests in flight share one generation
+        request.decision.details["coalesced"] = single_flight(key, streamer, generate)
+    else:
+        generate(streamer)
+
+
+def _stream_from_providers(
+    streamer: MarkdownStream,
+    prompts: ResponseInputParam,
+    user_message: str,
+    request: PreparedRequest,
+    deadline: Deadline,
+):
+    """Stream from the ranked providers, then the local fallback if all fail"""
+    cache = request.cache
+    failover = Failover(request.decision, deadline)
+    for provider in failover:
+        # Also tells whether the attempt showed anything before it failed
+        target = RecordingStreamer(streamer)
         try:
-            logger.info("Trying OpenAI API")
-            _call_openai_llm(streamer, prompts)
+            logger.info(f"Trying {provider.name} ({provider.model})")
+            if failover.should_hedge():
+                served = hedged_stream(
+                    target,
+                    prompts,
+                    provider,
+                    failover.next_available,
+                    failover.hedging,
+                    deadline,
+                )
+            else:
+                provider.run(target, prompts, deadline)
+                served = provider
+        except StreamCancelled:
+            # Nobody is reading the response any more
+            raise
+        except Exception as provider_error:
+            if failover.failed(provider, provider_error, target.text):
+                continue
+            streamer.append(markdown_text=CUT_OFF_NOTICE)
             return
-        except Exception as openai_error:
-            logger.warning(
-                f"OpenAI API failed: {openai_error}, falling back to Hugging Face"
-            )
-    else:
-        logger.info("No OpenAI API key found, using Hugging Face directly")
+        failover.succeeded(served)
+        if cache.enabled and target.cacheable:
+            cache.store(served, target.text)
+        return
 
-    # Fallback to Hugging Face chat completion
+    failover.exhausted()
     try:
-        logger.info("Using Hugging Face chat completion API")
-        streamer.append(markdown_text="🤖 Using Hugging Face AI...\n\n")
-        _call_huggingface_fallback(streamer, prompts)
-    except Exception as hf_error:
-        logger.error(f"Hugging Face chat completion failed: {hf_error}")
-        streamer.append(
-            markdown_text="❌ Sorry, all AI services are currently unavailable. Please try again later."
-        )
+        _call_local_fallback(streamer, user_message)
+    except StreamCancelled:
+        raise
+    except Exception as local_error:
+        logger.error(f"Local fallback failed: {local_error}")
+        streamer.append(markdown_text=UNAVAILABLE_MESSAGE)
+
+
+def _fast_path_reply(user_message: str) -> Optional[str]:
+    """A local answer to a greeting, help request or NdM dice roll, if it is one"""
+    intent = match_fast_path(user_message)
+    reply = None
+    if intent is not None:
+        if intent.name == DICE:
+            reply = _dice_reply(user_message)
+        elif user_message.isascii():
+            reply = _ENGLISH_INTRO_RESPONSE
+        else:
+            reply = _INTRO_RESPONSE
+    record_fast_path(intent, reply is not None)
+    return reply
 
 
-def _call_openai_llm(streamer: ChatStream, prompts: ResponseInputParam):
-    """Original OpenAI implementation"""
-    llm = openai.OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-    )
-    tool_calls = []
-    response = llm.responses.create(
-        model="gpt-4o-mini",
-        input=prompts,
-        tools=[
-            roll_dice_definition,
-        ],
-        stream=True,
-    )
-    for event in response:
+def _call_local_fallback(streamer: MarkdownStream, user_message: str):
+    """Answer without any provider once all of them have failed"""
+    if _roll_dice_from_message(streamer, user_message):
+        return
+    streamer.append(markdown_text=_contextual_fallback_response(user_message))
+
+
+def _call_openai_llm(
+    streamer: MarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """
+    OpenAI implementation with tool calls
+
+    Each round streams one response. Function calls from a round run in parallel
+    and their results are sent back in the next round, chained to the previous
+    response with previous_response_id so earlier turns aren't uploaded again.
+    The last round allowed by LLM_TOOL_MAX_ROUNDS can't call tools, so the model
+    has to answer.
+    """
+    llm = get_openai_client(api_key=os.getenv("OPENAI_API_KEY"))
+    settings = ToolLoopSettings.from_env()
+    timings = RoundTimings()
+    history = list(prompts)
+    round_input = history
+    previous_response_id = None
+    try:
+        for round_number in range(1, settings.max_rounds + 1):
+            timings.start_round()
+            openai_round = _OpenAIRound(timings)
+            _stream_openai_round(
+                streamer,
+                llm,
+                openai_round,
+                round_input,
+                previous_response_id,
+                round_number < settings.max_rounds,
+                deadline,
+            )
+            tool_calls = openai_round.tool_calls
+            timings.end_model(len(tool_calls))
+            if not tool_calls:
+                return
+            outputs, chunks = _tool_call_outputs(
+                tool_calls, run_tool_calls(tool_calls, settings.workers)
+            )
+            # Tasks are marked as completed in Slack together, in one append
+            streamer.append(chunks=chunks)
+            timings.end_tools()
+            round_input, previous_response_id = _next_round_input(
+                settings, history, tool_calls, outputs, openai_round.response_id
+            )
+    finally:
+        timings.report("openai")
+
+
+class _OpenAIRound:
+    """
+    One streamed response of the OpenAI tool loop
+
+    Turns response events into appends and keeps the function calls and the
+    response id; the sync and async loops only differ in how they read events.
+    """
+
+    def __init__(self, timings: RoundTimings):
+        self.tool_calls: list = []
+        self.response_id: Optional[str] = None
+        self.timer = StreamTimer("openai")
+        self._timings = timings
+        self._formatter = SlackMarkdownFormatter(decorate=False)
+
+    def request(
+        self,
+        round_input: ResponseInputParam,
+        previous_response_id: Optional[str],
+        allow_tools: bool,
+        timeout,
+    ) -> Dict[str, Any]:
+        """Arguments for responses.create"""
+        options: Dict[str, Any] = {}
+        if previous_response_id:
+            options["previous_response_id"] = previous_response_id
+        return {
+            "model": OPENAI_MODEL,
+            "input": round_input,
+            "tools": TOOL_DEFINITIONS,
+            "tool_choice": "auto" if allow_tools else "none",
+            "stream": True,
+            "timeout": timeout,
+            **options,
+        }
+
+    def handle(self, event) -> Optional[Dict[str, Any]]:
+        """The append for a response event, None if it shows nothing"""
+        if event.type == "response.created":
+            self.response_id = event.response.id
+
         # Markdown text from the LLM response is streamed in chat as it arrives
         if event.type == "response.output_text.delta":
-            streamer.append(markdown_text=f"{event.delta}")
+            self._timings.mark_first_token()
+            self.timer.mark(event.delta)
+            text = self._formatter.feed(event.delta)
+            if text:
+                return {"markdown_text": text}
 
         # Function calls are saved for later computation and a new task is shown
-        if event.type == "response.output_item.done":
-            if event.item.type == "function_call":
-                tool_calls.append(event.item)
-                if event.item.name == "roll_dice":
-                    args = json.loads(event.item.arguments)
-                    streamer.append(
-                        chunks=[
-                            TaskUpdateChunk(
-                                id=f"{event.item.call_id}",
-                                title=f"Rolling a {args['count']}d{args['sides']}...",
-                                status="in_progress",
-                            ),
-                        ],
-                    )
-
-    # Tool calls are performed and tasks are marked as completed in Slack
-    if tool_calls:
-        for call in tool_calls:
-            if call.name == "roll_dice":
-                args = json.loads(call.arguments)
-                prompts.append(
-                    {
-                        "id": str(call.id) if call.id else "",
-                        "call_id": call.call_id,
-                        "type": "function_call",
-                        "name": "roll_dice",
-                        "arguments": call.arguments,
-                    }
+        if (
+            event.type == "response.output_item.done"
+            and event.item.type == "function_call"
+        ):
+            self._timings.mark_first_token()
+            self.tool_calls.append(event.item)
+            return {
+                "chunks": [
+                    TaskUpdateChunk(
+                        id=f"{event.item.call_id}",
+                        title=_tool_task_title(event.item),
+                        status="in_progress",
+                    ),
+                ]
+            }
+        return None
+
+    def finish(self) -> str:
+        """Text still held by the formatter once the response is complete"""
+        return self._formatter.finish()
+
+
+def _stream_openai_round(
+    streamer: MarkdownStream,
+    llm,
+    openai_round: _OpenAIRound,
+    round_input: ResponseInputParam,
+    previous_response_id: Optional[str],
+    allow_tools: bool,
+    deadline: Deadline,
+):
+    """Stream one response into the streamer"""
+    watch = deadline.watch("openai")
+    try:
+        response = llm.responses.create(
+            **openai_round.request(
+                round_input, previous_response_id, allow_tools, watch.timeout()
+            )
+        )
+        # Closing the stream on the way out stops generation if it is cut short
+        with watch.closes(response):
+            for event in response:
+                # Text and tool-call argument deltas both count as progress
+                watch.tick(event.type.endswith(".delta"))
+                append = openai_round.handle(event)
+                if append:
+                    streamer.append(**append)
+    finally:
+        openai_round.timer.report()
+
+    text = openai_round.finish()
+    if text:
+        streamer.append(markdown_text=text)
+
+
+def _tool_task_title(call) -> str:
+    if call.name == "roll_dice":
+        try:
+            args = json.loads(call.arguments)
+            return f"Rolling a {args['count']}d{args['sides']}..."
+        except (ValueError, KeyError):
+            pass
+    return f"Running {call.name}..."
+
+
+def _tool_call_outputs(tool_calls: list, results: List[dict]) -> Tuple[list, list]:
+    """The function call outputs for the model and the finished task chunks"""
+    chunks = []
+    outputs = []
+    for call, result in zip(tool_calls, results):
+        outputs.append(
+            {
+                "type": "function_call_output",
+                "call_id": call.call_id,
+                "output": json.dumps(result),
+            }
+        )
+        if result.get("error") is not None:
+            chunks.append(
+                TaskUpdateChunk(
+                    id=f"{call.call_id}",
+                    title=f"{result['error']}",
+                    status="error",
                 )
-                result = roll_dice(**args)
-                prompts.append(
-                    {
-                        "type": "function_call_output",
-                        "call_id": call.call_id,
-                        "output": json.dumps(result),
-                    }
+            )
+        else:
+            chunks.append(
+                TaskUpdateChunk(
+                    id=f"{call.call_id}",
+                    title=f"{result.get('description', call.name)}",
+                    status="complete",
                 )
-                if result.get("error") is not None:
-                    streamer.append(
-                        chunks=[
-                            TaskUpdateChunk(
-                                id=f"{call.call_id}",
-                                title=f"{result['error']}",
-                                status="error",
-                            ),
-                        ],
-                    )
-                else:
-                    streamer.append(
-                        chunks=[
-                            TaskUpdateChunk(
-                                id=f"{call.call_id}",
-                                title=f"{result['description']}",
-                                status="complete",
-                            ),
-                        ],
-                    )
-
-        # Complete the LLM response after making tool calls
-        _call_openai_llm(streamer, prompts)
-
-
-def _call_huggingface_fallback(streamer: ChatStream, prompts: ResponseInputParam):
+            )
+    return outputs, chunks
+
+
+def _next_round_input(
+    settings: ToolLoopSettings,
+    history: list,
+    tool_calls: list,
+    outputs: list,
+    response_id: Optional[str],
+) -> Tuple[ResponseInputParam, Optional[str]]:
+    """Input and previous_response_id for the round after tool calls"""
+    if settings.chain_responses and response_id:
+        return outputs, response_id
+    # Without chaining, the calls are resent along with the whole history
+    for call in tool_calls:
+        history.append(
+            {
+                "id": str(call.id) if call.id else "",
+                "call_id": call.call_id,
+                "type": "function_call",
+                "name": call.name,
+                "arguments": call.arguments,
+            }
+        )
+    history.extend(outputs)
+    return history, None
+
+
+def _call_huggingface_fallback(
+    streamer: MarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
     """Hugging Face API fallback implementation with system prompt"""
 
     logger.info("DEBUG: _call_huggingface_fallback called")
     logger.info(f"DEBUG: prompts = {prompts}")
 
     # System prompt for code assistant (matching Node.js sample)
-    system_prompt = """You're an AI assistant specialized in answering questions about code.
-You'll analyze code-related questions and provide clear, accurate responses.
-When you include markdown text, convert them to Slack compatible ones.
-When you include code examples, convert them to Slack compatible ones. (There must be an empty line before a code block.)
-When a prompt has Slack's special syntax like <@USER_ID> or <#CHANNEL_ID>, you must keep them as-is in your response."""
-
-    # Extract conversation history from prompts
-    conversation_history = []
-    user_message = ""
-
-    for prompt in prompts:
-        logger.info(f"DEBUG: Processing prompt: {prompt}")
-        if isinstance(prompt, dict) and prompt.get("role") == "user":
-            content = prompt.get("content", "")
-            user_message = str(content) if content else ""
-            conversation_history.append(f"User: {user_message}")
-            logger.info(f"DEBUG: Extracted user_message: {user_message}")
-        elif isinstance(prompt, dict) and prompt.get("role") == "assistant":
-            content = prompt.get("content", "")
-            if content:
-                conversation_history.append(f"Assistant: {str(content)}")
+    system_prompt = SYSTEM_PROMPT
+
+    # Earlier turns of the thread, then the latest user message
+    conversation_history, user_message = _split_conversation(prompts)
 
     if not user_message:
         user_message = "Hello! How can I help you today?"
@@ -466,12 +762,35 @@ When a prompt has Slack's special syntax like <@USER_ID> or <#CHANNEL_ID>, you m
     # Use system prompt as context for question-answering model
 
     # Check if this is a dice roll request
-    if any(word in user_message.lower() for word in ["roll", "dice", "random"]):
-        # Handle dice rolling manually since Hugging Face doesn't support function calls
-        import re
+    if _roll_dice_from_message(streamer, user_message):
+        return
+
+    # Stream the Hugging Face chat completion into Slack as it is generated
+    logger.info("DEBUG: Calling _stream_huggingface_chat_completion")
+    streamed = _stream_huggingface_chat_completion(
+        streamer, system_prompt, user_message, conversation_history, deadline
+    )
+
+    if not streamed:
+        # Raised rather than answered with an apology, so the failure reaches the
+        # breaker and the router, the next provider is tried and nothing is cached
+        raise RuntimeError("huggingface returned an empty response")
+
+
+def _roll_dice_from_message(streamer: MarkdownStream, user_message: str) -> bool:
+    """Answer NdM dice requests without an LLM, returns True if it did"""
+    response_text = _dice_reply(user_message)
+    if response_text is None:
+        return False
+    streamer.append(markdown_text=response_text)
+    return True
 
-        dice_pattern = r"(\d+)d(\d+)"
-        matches = re.findall(dice_pattern, user_message.lower())
+
+def _dice_reply(user_message: str) -> Optional[str]:
+    """Roll the NdM dice a message asks for, None if it doesn't ask for any"""
+    if mentions_dice(user_message):
+        # Handle dice rolling manually for providers without function calls
+        matches = DICE_EXPRESSION.findall(user_message.lower())
 
         if matches:
             total_result = []
@@ -488,24 +807,37 @@ When a prompt has Slack's special syntax like <@USER_ID> or <#CHANNEL_ID>, you m
                     else:
                         dice_results.append(result["description"])
 
-                response_text = f"🎲 {', '.join(dice_results)}\n\nAnything else I can help you with?"
-                streamer.append(markdown_text=response_text)
-                return
+                return f"🎲 {', '.join(dice_results)}\n\nAnything else I can help you with?"
+    return None
 
-    # Use Hugging Face chat completion API (using existing function)
-    logger.info("DEBUG: Calling _call_huggingface_chat_completion")
-    api_response = _call_huggingface_chat_completion(
-        system_prompt, user_message, conversation_history
-    )
-    logger.info(f"DEBUG: api_response = {api_response}")
 
-    if api_response:
-        logger.info("DEBUG: API response received, formatting for Slack")
-        formatted_response = _format_slack_response(api_response)
-        logger.info(f"DEBUG: formatted_response = {formatted_response}")
-        streamer.append(markdown_text=formatted_response)
-    else:
-        logger.warning("DEBUG: No API response, using fallback message")
-        # If contextual response generation fails, use simple fallback
-        fallback_response = "🤖 申し訳ございません。現在、システムに一時的な問題が発生しています。プログラミングに関するご質問であれば、再度お試しください。"
-        streamer.append(markdown_text=fallback_response)
+register_provider(
+    Provider(
+        name="openai",
+        default_model=OPENAI_MODEL,
+        api_key_env="OPENAI_API_KEY",
+        stream=_call_openai_llm,
+        supports_tools=True,
+    )
+)
+register_provider(
+    Provider(
+        name="huggingface",
+        default_model=HUGGINGFACE_MODEL,
+        api_key_env="HUGGINGFACE_API_KEY",
+        stream=_call_huggingface_fallback,
+    )
+)
+register_provider(
+    Provider(
+        name="local",
+        default_model=DEFAULT_LOCAL_MODEL,
+        api_key_env="LOCAL_MODEL",
+        model_env="LOCAL_MODEL",
+        stream=stream_local,
+        ready=local_model_ready,
+        # A small CPU model answers only when the remote APIs can't, however
+        # fast its first token is
+        last_resort=True,
+    )
+)
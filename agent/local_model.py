@@ -0,0 +1,466 @@
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from openai.types.responses import ResponseInputParam
+
+from agent.deadlines import Deadline, DeadlineExceeded
+from agent.formatter import SlackMarkdownFormatter
+from agent.prompts import to_chat_messages
+from agent.streaming import MarkdownStream, StreamTimer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_MODEL = "Qwen/Qwen2.5-0.5B-Instruct"
+
+_DONE = object()
+
+# Lifecycle states of the local model
+IDLE = "idle"
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+# Seconds before a model that failed to load is tried again
+_RETRY_LOAD_AFTER = 300.0
+
+
+class ModelNotReady(RuntimeError):
+    """The local model is still loading, or failed to load"""
+
+
+@dataclass(frozen=True)
+class LocalModelSettings:
+    """
+    Settings for generating responses with a small model on the CPU
+
+    Args:
+        model: Hugging Face instruct model to run; None (LOCAL_MODEL unset)
+          disables local inference
+        max_batch_size: Requests generated together in one forward pass
+        batch_wait: Seconds to wait for more requests before starting a batch
+        max_new_tokens: Longest response generated
+        temperature: Sampling temperature, 0 for greedy decoding
+        top_p: Nucleus sampling threshold
+        threads: Torch CPU threads, 0 to keep torch's default
+        preload: Start loading the model when the app starts rather than on the
+          first request that reaches the local provider
+        quantize: "int8" to quantize the linear layers' weights after loading
+          (smaller and usually faster on CPU), "none" to keep them as they are
+        dtype: Torch dtype to load the weights in, or "auto" for the checkpoint's
+        warmup_tokens: Tokens generated once after loading, 0 to skip warmup
+    """
+
+    model: Optional[str] = None
+    max_batch_size: int = 8
+    batch_wait: float = 0.02
+    max_new_tokens: int = 384
+    temperature: float = 0.7
+    top_p: float = 0.9
+    threads: int = 0
+    preload: bool = True
+    quantize: str = "none"
+    dtype: str = "float32"
+    warmup_tokens: int = 8
+
+    @classmethod
+    def from_env(cls) -> "LocalModelSettings":
+        return cls(
+            model=os.getenv("LOCAL_MODEL") or None,
+            max_batch_size=int(
+                os.getenv("LOCAL_MODEL_MAX_BATCH_SIZE", cls.max_batch_size)
+            ),
+            batch_wait=float(os.getenv("LOCAL_MODEL_BATCH_WAIT", cls.batch_wait)),
+            max_new_tokens=int(
+                os.getenv("LOCAL_MODEL_MAX_NEW_TOKENS", cls.max_new_tokens)
+            ),
+            temperature=float(os.getenv("LOCAL_MODEL_TEMPERATURE", cls.temperature)),
+            top_p=float(os.getenv("LOCAL_MODEL_TOP_P", cls.top_p)),
+            threads=int(os.getenv("LOCAL_MODEL_THREADS", cls.threads)),
+            preload=os.getenv("LOCAL_MODEL_PRELOAD", "true").lower() == "true",
+            quantize=os.getenv("LOCAL_MODEL_QUANTIZE", cls.quantize).lower(),
+            dtype=os.getenv("LOCAL_MODEL_DTYPE", cls.dtype),
+            warmup_tokens=int(
+                os.getenv("LOCAL_MODEL_WARMUP_TOKENS", cls.warmup_tokens)
+            ),
+        )
+
+
+@dataclass
+class _Request:
+    prompt: str
+    max_new_tokens: int
+    output: "queue.Queue[Any]" = field(default_factory=queue.Queue)
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class LocalModel:
+    """
+    A transformers causal LM shared by every request in the process
+
+    The model is loaded, optionally quantized and warmed up on a background
+    thread (start_loading); until it is ready, stream() raises ModelNotReady
+    instead of waiting. Requests then go through one scheduler thread. It takes the first waiting request,
+    waits up to batch_wait for others (up to max_batch_size) and generates the
+    whole batch together, one forward pass per token for all of them, using the
+    KV cache. Requests that arrive while a batch is generating start with the
+    next one. Each request gets its text through a streaming iterator.
+    """
+
+    def __init__(self, settings: LocalModelSettings):
+        if not settings.model:
+            raise ValueError("LocalModelSettings.model is required")
+        self.settings = settings
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._state = IDLE
+        self._failed_at = 0.0
+        self._error: Optional[str] = None
+        self._load_seconds: Optional[float] = None
+        self._warmup_seconds: Optional[float] = None
+        self._tokenizer = None
+        self._model = None
+        self._eos_ids: List[int] = []
+        self._stats = {"requests": 0, "batches": 0, "batched_requests": 0, "tokens": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self._state == READY
+
+    def status(self) -> Dict[str, Any]:
+        """Lifecycle state of the model and how long loading and warmup took"""
+        with self._lock:
+            return {
+                "state": self._state,
+                "model": self.settings.model,
+                "quantize": self.settings.quantize,
+                "load_seconds": self._load_seconds,
+                "warmup_seconds": self._warmup_seconds,
+                "error": self._error,
+            }
+
+    def start_loading(self):
+        """Load, warm up and start serving on a background thread, once"""
+        with self._lock:
+            if self._state in (LOADING, WARMING, READY):
+                return
+            if self._state == FAILED and (
+                time.monotonic() - self._failed_at < _RETRY_LOAD_AFTER
+            ):
+                return
+            self._state = LOADING
+            self._loaded.clear()
+        threading.Thread(
+            target=self._load, name="local-model-loader", daemon=True
+        ).start()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until loading has finished, for scripts; True if the model is ready"""
+        self.start_loading()
+        self._loaded.wait(timeout)
+        return self.ready
+
+    def _load(self):
+        try:
+            started = time.monotonic()
+            # torch is only imported here, off the startup path
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+
+            if self.settings.threads:
+                torch.set_num_threads(self.settings.threads)
+            tokenizer = AutoTokenizer.from_pretrained(self.settings.model)
+            # Prompts in a batch are padded on the left so they all end together
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token_id is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            # safetensors weights are memory-mapped rather than read into private
+            # memory; with dtype "auto" (the checkpoint's own) and no quantization
+            # they stay backed by the file, so worker processes share the pages
+            model = AutoModelForCausalLM.from_pretrained(
+                self.settings.model,
+                torch_dtype=(
+                    "auto"
+                    if self.settings.dtype == "auto"
+                    else getattr(torch, self.settings.dtype)
+                ),
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            )
+            model.eval()
+            if self.settings.quantize == "int8":
+                # Linear weights to int8, activations quantized on the fly
+                model = torch.ao.quantization.quantize_dynamic(
+                    model.float(), {torch.nn.Linear}, dtype=torch.qint8
+                )
+            eos = model.generation_config.eos_token_id
+            eos_ids = eos if isinstance(eos, list) else [eos]
+            self._eos_ids = [
+                i for i in eos_ids + [tokenizer.eos_token_id] if i is not None
+            ]
+            self._tokenizer = tokenizer
+            self._model = model
+            self._load_seconds = round(time.monotonic() - started, 2)
+
+            with self._lock:
+                self._state = WARMING
+            started = time.monotonic()
+            self._warm_up()
+            self._warmup_seconds = round(time.monotonic() - started, 2)
+
+            threading.Thread(
+                target=self._serve, name="local-model", daemon=True
+            ).start()
+            with self._lock:
+                self._state = READY
+            logger.info(
+                f"Loaded {self.settings.model} in {self._load_seconds}s "
+                f"and warmed up in {self._warmup_seconds}s"
+            )
+        except Exception as e:
+            with self._lock:
+                self._state = FAILED
+                self._failed_at = time.monotonic()
+                self._error = str(e)
+            logger.error(f"Could not load local model {self.settings.model}: {e}")
+        finally:
+            self._loaded.set()
+
+    def _warm_up(self):
+        """Generate a few tokens so the first request doesn't pay for first-run setup"""
+        if not self.settings.warmup_tokens:
+            return
+        prompt = self._tokenizer.apply_chat_template(
+            [{"role": "user", "content": "Hello"}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        self._generate([_Request(prompt, self.settings.warmup_tokens)])
+
+    def stream(
+        self,
+        messages: List[dict],
+        max_new_tokens: Optional[int] = None,
+        read_timeout: Optional[Callable[[], float]] = None,
+    ) -> Iterator[str]:
+        """
+        Generate a reply to chat messages, yielding text as it is decoded
+
+        read_timeout() gives the seconds to wait for the next piece of text;
+        DeadlineExceeded is raised when none arrives in time. Closing the iterator
+        early drops the request from its batch.
+        """
+        if not self.ready:
+            self.start_loading()
+            raise ModelNotReady(f"{self.settings.model} is {self._state}")
+        prompt = self._tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+        request = _Request(
+            prompt=prompt,
+            max_new_tokens=min(
+                max_new_tokens or self.settings.max_new_tokens,
+                self.settings.max_new_tokens,
+            ),
+        )
+        self._count("requests")
+        self._queue.put(request)
+        try:
+            while True:
+                timeout = read_timeout() if read_timeout else None
+                try:
+                    item = request.output.get(timeout=timeout)
+                except queue.Empty:
+                    raise DeadlineExceeded(
+                        f"local model produced no text within {timeout:.1f}s"
+                    ) from None
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            request.cancelled.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["mean_batch_size"] = (
+            stats["batched_requests"] / stats["batches"] if stats["batches"] else 0.0
+        )
+        stats["waiting"] = self._queue.qsize()
+        return stats
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def _next_batch(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        window_ends = time.monotonic() + self.settings.batch_wait
+        while len(batch) < self.settings.max_batch_size:
+            remaining = window_ends - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Take whatever is already waiting without waiting longer
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return [request for request in batch if not request.cancelled.is_set()]
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            self._count("batches")
+            self._count("batched_requests", len(batch))
+            try:
+                self._generate(batch)
+            except Exception as e:
+                logger.error(f"Local generation failed: {e}")
+                for request in batch:
+                    request.output.put(e)
+            finally:
+                for request in batch:
+                    request.output.put(_DONE)
+
+    def _generate(self, batch: List[_Request]):
+        import torch
+
+        tokenizer, model = self._tokenizer, self._model
+        encoded = tokenizer(
+            [request.prompt for request in batch],
+            return_tensors="pt",
+            padding=True,
+            add_special_tokens=False,
+        )
+        mask = encoded["attention_mask"]
+        positions = (mask.cumsum(-1) - 1).clamp(min=0)
+        tokens: List[List[int]] = [[] for _ in batch]
+        emitted = [0] * len(batch)
+        finished = [False] * len(batch)
+        steps = max(request.max_new_tokens for request in batch)
+        with torch.inference_mode():
+            output = model(
+                input_ids=encoded["input_ids"],
+                attention_mask=mask,
+                position_ids=positions,
+                use_cache=True,
+            )
+            for _ in range(steps):
+                next_tokens = self._sample(output.logits[:, -1, :])
+                for row, request in enumerate(batch):
+                    if finished[row]:
+                        continue
+                    token = int(next_tokens[row])
+                    if request.cancelled.is_set() or token in self._eos_ids:
+                        finished[row] = True
+                        continue
+                    tokens[row].append(token)
+                    text = tokenizer.decode(tokens[row], skip_special_tokens=True)
+                    # Hold back a multi-byte character until all of it is decoded
+                    if not text.endswith("\ufffd") and len(text) > emitted[row]:
+                        request.output.put(text[emitted[row] :])
+                        emitted[row] = len(text)
+                    if len(tokens[row]) >= request.max_new_tokens:
+                        finished[row] = True
+                if all(finished):
+                    break
+                # Finished rows keep decoding padding until the batch is done
+                mask = torch.cat([mask, mask.new_ones((len(batch), 1))], dim=1)
+                output = model(
+                    input_ids=next_tokens[:, None],
+                    attention_mask=mask,
+                    position_ids=mask.sum(dim=1, keepdim=True) - 1,
+                    past_key_values=output.past_key_values,
+                    use_cache=True,
+                )
+        self._count("tokens", sum(len(row) for row in tokens))
+
+    def _sample(self, logits):
+        import torch
+
+        if self.settings.temperature <= 0:
+            return logits.argmax(dim=-1)
+        probs = torch.softmax(logits / self.settings.temperature, dim=-1)
+        sorted_probs, sorted_ids = probs.sort(dim=-1, descending=True)
+        # Keep the smallest set of tokens whose probability adds up to top_p
+        outside = sorted_probs.cumsum(dim=-1) - sorted_probs > self.settings.top_p
+        sorted_probs = sorted_probs.masked_fill(outside, 0.0)
+        choice = torch.multinomial(sorted_probs, num_samples=1)
+        return sorted_ids.gather(-1, choice).squeeze(-1)
+
+
+_local_model: Optional[LocalModel] = None
+_local_model_lock = threading.Lock()
+
+
+def get_local_model() -> LocalModel:
+    """Return the process-wide local model; start_loading() loads it"""
+    global _local_model
+    if _local_model is None:
+        with _local_model_lock:
+            if _local_model is None:
+                _local_model = LocalModel(LocalModelSettings.from_env())
+    return _local_model
+
+
+def preload_local_model():
+    """Start loading the local model in the background if it is configured"""
+    settings = LocalModelSettings.from_env()
+    if settings.model and settings.preload:
+        get_local_model().start_loading()
+
+
+def local_model_ready() -> bool:
+    """Whether the local model can serve now; starts loading it if it hasn't"""
+    model = get_local_model()
+    if not model.ready:
+        model.start_loading()
+    return model.ready
+
+
+def local_model_stats() -> Dict[str, Any]:
+    """Lifecycle state, batches, mean batch size and tokens of the local model"""
+    if _local_model is None:
+        return {}
+    stats = _local_model.status()
+    stats.update(_local_model.stats())
+    return stats
+
+
+def stream_local(
+    streamer: MarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """Stream a response from the local model, as a provider"""
+    model = get_local_model()
+    formatter = SlackMarkdownFormatter(decorate=False)
+    timer = StreamTimer("local")
+    watch = deadline.watch("local")
+    deltas = model.stream(to_chat_messages(prompts), read_timeout=watch.read_timeout)
+    try:
+        for delta in deltas:
+            watch.tick(True)
+            timer.mark(delta)
+            text = formatter.feed(delta)
+            if text:
+                streamer.append(markdown_text=text)
+    finally:
+        # Frees the request's place in its batch if the stream is cut short
+        deltas.close()
+        timer.report()
+    if timer.deltas == 0:
+        raise RuntimeError("local model returned an empty response")
+    text = formatter.finish()
+    if text:
+        streamer.append(markdown_text=text)
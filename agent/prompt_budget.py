@@ -0,0 +1,287 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from openai.types.responses import ResponseInputParam
+
+from agent.prompts import SYSTEM_PROMPT
+from agent.providers import Provider
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("oldest-first", "keep-pinned", "keep-code-blocks")
+
+# Tokens the chat format adds around each message
+MESSAGE_OVERHEAD = 4
+# Tokens kept free in a model's context window for its answer
+REPLY_TOKENS = 2000
+# Context windows of the models the providers use unless configured otherwise
+CONTEXT_WINDOWS = {
+    "gpt-4o-mini": 128000,
+    "Qwen/Qwen2.5-Coder-32B-Instruct": 32768,
+    "qwen/qwen-2.5-coder-32b-instruct": 32768,
+    "llama-3.3-70b-versatile": 131072,
+    "meta/meta-llama-3-8b-instruct": 8192,
+    "Qwen/Qwen2.5-0.5B-Instruct": 32768,
+}
+
+
+def _model_budgets() -> Dict[str, int]:
+    return {model: tokens - REPLY_TOKENS for model, tokens in CONTEXT_WINDOWS.items()}
+
+
+@dataclass(frozen=True)
+class BudgetSettings:
+    """
+    Settings for fitting a conversation into a token budget
+
+    Args:
+        enabled: Drop earlier turns that don't fit the budget
+        default_budget: Prompt tokens (system prompt included) allowed for a model
+          without its own budget
+        budgets: Budgets for particular models: their context window less
+          REPLY_TOKENS for the models in CONTEXT_WINDOWS, overridden and
+          extended by LLM_PROMPT_BUDGETS as comma-separated model=tokens pairs
+        policy: Which turns go first: oldest-first drops the oldest, keep-pinned
+          also keeps the first question of the thread, keep-code-blocks drops
+          turns without code before turns with code. System messages are
+          never dropped
+        encoding: tiktoken encoding used to count tokens, when tiktoken is installed
+        cache_size: Messages whose token counts are remembered
+    """
+
+    enabled: bool = True
+    default_budget: int = 8000
+    budgets: Dict[str, int] = field(default_factory=_model_budgets)
+    policy: str = "oldest-first"
+    encoding: str = "o200k_base"
+    cache_size: int = 4096
+
+    @classmethod
+    def from_env(cls) -> "BudgetSettings":
+        budgets = _model_budgets()
+        for pair in os.getenv("LLM_PROMPT_BUDGETS", "").split(","):
+            model, _, tokens = pair.strip().rpartition("=")
+            if model and tokens:
+                budgets[model] = int(tokens)
+        policy = os.getenv("LLM_PROMPT_TRUNCATION", cls.policy)
+        if policy not in POLICIES:
+            logger.warning(
+                f"Unknown LLM_PROMPT_TRUNCATION {policy}, using oldest-first"
+            )
+            policy = cls.policy
+        return cls(
+            enabled=os.getenv("LLM_PROMPT_BUDGET_ENABLED", "true").lower() == "true",
+            default_budget=int(os.getenv("LLM_PROMPT_BUDGET", cls.default_budget)),
+            budgets=budgets,
+            policy=policy,
+            encoding=os.getenv("LLM_PROMPT_ENCODING", cls.encoding),
+        )
+
+    def budget_for(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+
+def _estimate_tokens(text: str) -> int:
+    # Without tiktoken: about 4 characters per token for ASCII text, and about one
+    # token per character for Japanese and other non-ASCII text
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return -(-ascii_chars // 4) + (len(text) - ascii_chars)
+
+
+class TokenCounter:
+    """
+    Token counts of message texts, each computed once
+
+    Counts come from tiktoken when it is installed and from a character-based
+    estimate otherwise. Counts are kept in an LRU keyed by the text, so the
+    history of a thread is only counted as it grows.
+    """
+
+    def __init__(self, encoding: str, cache_size: int):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._encode = self._load(encoding)
+
+    @property
+    def exact(self) -> bool:
+        return self._encode is not None
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            tokens = self._counts.get(text)
+            if tokens is not None:
+                self._counts.move_to_end(text)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        if self._encode is not None:
+            tokens = len(self._encode(text))
+        else:
+            tokens = _estimate_tokens(text)
+        with self._lock:
+            self._counts[text] = tokens
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return tokens
+
+    @staticmethod
+    def _load(encoding: str) -> Optional[Callable[[str], List[int]]]:
+        try:
+            import tiktoken
+
+            return tiktoken.get_encoding(encoding).encode_ordinary
+        except ImportError:
+            logger.info("tiktoken is not installed, estimating token counts")
+        except Exception as e:
+            logger.warning(f"Could not load tiktoken encoding {encoding}: {e}")
+        return None
+
+
+@dataclass
+class BudgetedPrompts:
+    """Prompts that fit the budget, and what was left out to get there"""
+
+    prompts: ResponseInputParam
+    budget: int
+    tokens: int
+    tokens_trimmed: int = 0
+    messages_trimmed: int = 0
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "trimmed_requests": 0,
+    "tokens_trimmed": 0,
+    "messages_trimmed": 0,
+}
+
+
+def _count_stats(result: BudgetedPrompts):
+    with _stats_lock:
+        _stats["requests"] += 1
+        if result.messages_trimmed:
+            _stats["trimmed_requests"] += 1
+        _stats["tokens_trimmed"] += result.tokens_trimmed
+        _stats["messages_trimmed"] += result.messages_trimmed
+
+
+def _message_text(prompt: Any) -> str:
+    if isinstance(prompt, dict):
+        return str(prompt.get("content") or "")
+    return ""
+
+
+def _trim_order(prompts: Sequence[Any], policy: str) -> List[int]:
+    """Indices of the turns that may be dropped, in the order they go"""
+    candidates = [
+        i
+        for i, prompt in enumerate(prompts[:-1])
+        # Tool calls and outputs belong to the current request
+        if isinstance(prompt, dict) and prompt.get("role") in ("user", "assistant")
+    ]
+    if policy == "keep-pinned":
+        # The thread's first question usually says what the whole thread is about
+        first_user = next(
+            (i for i in candidates if prompts[i].get("role") == "user"), None
+        )
+        return [i for i in candidates if i != first_user]
+    if policy == "keep-code-blocks":
+        with_code = {i for i in candidates if "```" in _message_text(prompts[i])}
+        return [i for i in candidates if i not in with_code] + sorted(with_code)
+    return candidates
+
+
+class PromptBuilder:
+    """
+    Fits the system prompt, a thread's history and the new message into the
+    smallest budget among the models a request may be routed to
+
+    The latest message is always sent, even when it alone is over the budget.
+    """
+
+    def __init__(self, settings: BudgetSettings):
+        self.settings = settings
+        self.counter = TokenCounter(settings.encoding, settings.cache_size)
+
+    def tokens(self, prompt: Any) -> int:
+        return self.counter.count(_message_text(prompt)) + MESSAGE_OVERHEAD
+
+    def fit(
+        self,
+        prompts: ResponseInputParam,
+        providers: Sequence[Provider],
+        system_prompt: str = SYSTEM_PROMPT,
+    ) -> BudgetedPrompts:
+        budget = min(
+            (self.settings.budget_for(provider.model) for provider in providers),
+            default=self.settings.default_budget,
+        )
+        prompts = list(prompts)
+        counts = [self.tokens(prompt) for prompt in prompts]
+        total = self.counter.count(system_prompt) + MESSAGE_OVERHEAD + sum(counts)
+        result = BudgetedPrompts(prompts=prompts, budget=budget, tokens=total)
+        if total <= budget or not self.settings.enabled:
+            return result
+
+        dropped = set()
+        for index in _trim_order(prompts, self.settings.policy):
+            if total <= budget:
+                break
+            dropped.add(index)
+            total -= counts[index]
+            result.tokens_trimmed += counts[index]
+        result.prompts = [p for i, p in enumerate(prompts) if i not in dropped]
+        result.tokens = total
+        result.messages_trimmed = len(dropped)
+        if total > budget:
+            logger.warning(
+                f"Prompt is {total} tokens after trimming, over the {budget} budget"
+            )
+        return result
+
+
+_builder: Optional[PromptBuilder] = None
+_builder_lock = threading.Lock()
+
+
+def get_prompt_builder() -> PromptBuilder:
+    """Return the process-wide prompt builder"""
+    global _builder
+    if _builder is None:
+        with _builder_lock:
+            if _builder is None:
+                _builder = PromptBuilder(BudgetSettings.from_env())
+    return _builder
+
+
+def fit_prompts(
+    prompts: ResponseInputParam, providers: Sequence[Provider]
+) -> BudgetedPrompts:
+    """Trim prompts to the token budget of providers, counting what was trimmed"""
+    result = get_prompt_builder().fit(prompts, providers)
+    _count_stats(result)
+    if result.tokens_trimmed:
+        logger.info(
+            f"Trimmed {result.messages_trimmed} earlier messages "
+            f"({result.tokens_trimmed} tokens) to fit {result.budget} tokens"
+        )
+    return result
+
+
+def prompt_budget_stats() -> Dict[str, Any]:
+    """How often prompts were trimmed, by how much, and token count cache use"""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+    counter = get_prompt_builder().counter
+    stats["count_cache_hits"] = counter.hits
+    stats["count_cache_misses"] = counter.misses
+    stats["exact_counts"] = counter.exact
+    return stats
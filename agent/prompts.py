@@ -0,0 +1,38 @@
+from typing import List
+
+from openai.types.responses import ResponseInputParam
+
+# System prompt for code assistant (matching Node.js sample)
+SYSTEM_PROMPT = """You're an AI assistant specialized in answering questions about code.
+You'll analyze code-related questions and provide clear, accurate responses.
+When you include markdown text, convert them to Slack compatible ones.
+When you include code examples, convert them to Slack compatible ones. (There must be an empty line before a code block.)
+When a prompt has Slack's special syntax like <@USER_ID> or <#CHANNEL_ID>, you must keep them as-is in your response."""
+
+
+def latest_user_message(prompts: ResponseInputParam) -> str:
+    """Return the text of the last user message in prompts"""
+    for prompt in reversed(list(prompts)):
+        if isinstance(prompt, dict) and prompt.get("role") == "user":
+            content = prompt.get("content", "")
+            return str(content) if content else ""
+    return ""
+
+
+def to_chat_messages(
+    prompts: ResponseInputParam, system_prompt: str = SYSTEM_PROMPT
+) -> List[dict]:
+    """
+    Convert Responses API input items to Chat Completions messages
+
+    Function call items only make sense to the Responses API and are skipped.
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    for prompt in prompts:
+        if not isinstance(prompt, dict):
+            continue
+        role = prompt.get("role")
+        content = prompt.get("content")
+        if role in ("system", "user", "assistant") and content:
+            messages.append({"role": role, "content": str(content)})
+    return messages
@@ -0,0 +1,408 @@
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from openai.types.responses import ResponseInputParam
+
+from agent.clients import (
+    get_async_http_client,
+    get_async_openai_client,
+    get_http_client,
+    get_openai_client,
+)
+from agent.deadlines import Deadline
+from agent.formatter import SlackMarkdownFormatter
+from agent.prompts import SYSTEM_PROMPT, to_chat_messages
+from agent.health import get_breaker
+from agent.streaming import (
+    AsyncMarkdownStream,
+    MarkdownStream,
+    StreamCancelled,
+    StreamTimer,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Provider:
+    """
+    An LLM backend that call_llm can route a request to
+
+    Args:
+        name: Unique name, also used for its circuit breaker and stream timings
+        default_model: Model the provider is asked for
+        api_key_env: Environment variable holding the API key
+        stream: Streams a response to prompts into the streamer within the
+          deadline and raises on failure
+        supports_tools: Whether the provider runs the app's tools (e.g. roll_dice)
+        supports_streaming: Whether output arrives as deltas rather than at once
+        model_env: Environment variable that overrides default_model
+        astream: Async version of stream for the asyncio app; without it the
+          async app runs stream on a worker thread
+        ready: Whether the provider can serve right now (e.g. its model has
+          finished loading); the router leaves it out until then
+        last_resort: Only tried after every other provider and never ranked by
+          latency, for backends that should answer only when the others can't
+    """
+
+    name: str
+    default_model: str
+    api_key_env: str
+    stream: Callable[[MarkdownStream, ResponseInputParam, Deadline], None]
+    supports_tools: bool = False
+    supports_streaming: bool = True
+    model_env: Optional[str] = None
+    astream: Optional[
+        Callable[[AsyncMarkdownStream, ResponseInputParam, Deadline], Awaitable[None]]
+    ] = None
+    ready: Optional[Callable[[], bool]] = None
+    last_resort: bool = False
+
+    @property
+    def api_key(self) -> Optional[str]:
+        return os.getenv(self.api_key_env)
+
+    @property
+    def model(self) -> str:
+        if self.model_env:
+            return os.getenv(self.model_env, self.default_model)
+        return self.default_model
+
+    def is_configured(self) -> bool:
+        key = self.api_key
+        return bool(key) and not key.startswith("YOUR_")
+
+    def run(
+        self, streamer: MarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+    ):
+        """
+        Stream a response and record the outcome on the provider's circuit breaker
+
+        The caller is expected to have checked get_breaker(name).allow_request().
+        """
+        breaker = get_breaker(self.name)
+        try:
+            self.stream(streamer, prompts, deadline)
+        except StreamCancelled:
+            breaker.record_cancelled()
+            raise
+        except Exception as e:
+            cancelled = deadline.cancelled()
+            if cancelled is not None:
+                # Closing the response from outside breaks the read in progress
+                breaker.record_cancelled()
+                raise cancelled from e
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+
+    async def arun(
+        self,
+        streamer: AsyncMarkdownStream,
+        prompts: ResponseInputParam,
+        deadline: Deadline,
+    ):
+        """Async run(), with the same circuit breaker accounting"""
+        breaker = get_breaker(self.name)
+        try:
+            if self.astream is not None:
+                await self.astream(streamer, prompts, deadline)
+            else:
+                await asyncio.to_thread(
+                    self.stream,
+                    _ThreadBridge(streamer, asyncio.get_running_loop()),
+                    prompts,
+                    deadline,
+                )
+        except (StreamCancelled, asyncio.CancelledError):
+            breaker.record_cancelled()
+            raise
+        except Exception as e:
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+
+
+class _ThreadBridge:
+    """Lets a sync provider running on a worker thread append to an async stream"""
+
+    def __init__(self, streamer: AsyncMarkdownStream, loop: asyncio.AbstractEventLoop):
+        self._streamer = streamer
+        self._loop = loop
+
+    def append(self, **kwargs):
+        return asyncio.run_coroutine_threadsafe(
+            self._streamer.append(**kwargs), self._loop
+        ).result()
+
+
+_lock = threading.Lock()
+_providers: Dict[str, Provider] = {}
+
+
+def register_provider(provider: Provider):
+    """Add or replace a provider that the router can pick"""
+    with _lock:
+        _providers[provider.name] = provider
+
+
+def get_providers() -> List[Provider]:
+    """All registered providers, in registration order"""
+    with _lock:
+        return list(_providers.values())
+
+
+def configured_providers() -> List[Provider]:
+    """Registered providers that have an API key set and are ready"""
+    return [
+        provider
+        for provider in get_providers()
+        if provider.is_configured() and (provider.ready is None or provider.ready())
+    ]
+
+
+def _stream_chat_completions(
+    streamer: MarkdownStream,
+    prompts: ResponseInputParam,
+    deadline: Deadline,
+    *,
+    name: str,
+    model: str,
+    api_key: Optional[str],
+    base_url: str,
+):
+    """Stream from an OpenAI-compatible Chat Completions endpoint"""
+    client = get_openai_client(api_key=api_key, base_url=base_url, name=name)
+    formatter = SlackMarkdownFormatter(decorate=False)
+    timer = StreamTimer(name)
+    watch = deadline.watch(name)
+    try:
+        stream = client.chat.completions.create(
+            model=model,
+            messages=to_chat_messages(prompts),
+            max_tokens=2000,
+            temperature=0.7,
+            stream=True,
+            timeout=watch.timeout(),
+        )
+        # Closing the stream on the way out stops generation if it is cut short
+        with watch.closes(stream):
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                watch.tick(bool(delta))
+                if not delta:
+                    continue
+                timer.mark(delta)
+                text = formatter.feed(delta)
+                if text:
+                    streamer.append(markdown_text=text)
+    finally:
+        timer.report()
+    if timer.deltas == 0:
+        raise RuntimeError(f"{name} returned an empty response")
+    text = formatter.finish()
+    if text:
+        streamer.append(markdown_text=text)
+
+
+async def _astream_chat_completions(
+    streamer: AsyncMarkdownStream,
+    prompts: ResponseInputParam,
+    deadline: Deadline,
+    *,
+    name: str,
+    model: str,
+    api_key: Optional[str],
+    base_url: str,
+):
+    """Async version of _stream_chat_completions"""
+    client = get_async_openai_client(api_key=api_key, base_url=base_url, name=name)
+    formatter = SlackMarkdownFormatter(decorate=False)
+    timer = StreamTimer(name)
+    watch = deadline.watch(name)
+    try:
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=to_chat_messages(prompts),
+            max_tokens=2000,
+            temperature=0.7,
+            stream=True,
+            timeout=watch.timeout(),
+        )
+        async with stream:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                watch.tick(bool(delta))
+                if not delta:
+                    continue
+                timer.mark(delta)
+                text = formatter.feed(delta)
+                if text:
+                    await streamer.append(markdown_text=text)
+    finally:
+        timer.report()
+    if timer.deltas == 0:
+        raise RuntimeError(f"{name} returned an empty response")
+    text = formatter.finish()
+    if text:
+        await streamer.append(markdown_text=text)
+
+
+def _openai_compatible(
+    name: str, default_model: str, api_key_env: str, model_env: str, base_url: str
+) -> Provider:
+    def stream(
+        streamer: MarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+    ):
+        _stream_chat_completions(
+            streamer,
+            prompts,
+            deadline,
+            name=name,
+            model=provider.model,
+            api_key=provider.api_key,
+            base_url=base_url,
+        )
+
+    async def astream(
+        streamer: AsyncMarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+    ):
+        await _astream_chat_completions(
+            streamer,
+            prompts,
+            deadline,
+            name=name,
+            model=provider.model,
+            api_key=provider.api_key,
+            base_url=base_url,
+        )
+
+    provider = Provider(
+        name=name,
+        default_model=default_model,
+        api_key_env=api_key_env,
+        model_env=model_env,
+        stream=stream,
+        astream=astream,
+    )
+    return provider
+
+
+def _replicate_request(prompts: ResponseInputParam) -> dict:
+    """Arguments for the synchronous ("Prefer: wait") prediction request"""
+    messages = to_chat_messages(prompts)
+    conversation = "\n\n".join(
+        f"{message['role']}: {message['content']}" for message in messages[1:]
+    )
+    return {
+        "url": f"https://api.replicate.com/v1/models/{_replicate.model}/predictions",
+        "headers": {
+            "Authorization": f"Bearer {_replicate.api_key}",
+            "Prefer": "wait",
+        },
+        "json": {
+            "input": {
+                "system_prompt": SYSTEM_PROMPT,
+                "prompt": conversation,
+                "max_tokens": 2000,
+                "temperature": 0.7,
+            }
+        },
+    }
+
+
+def _replicate_text(prediction: dict) -> str:
+    if prediction.get("status") != "succeeded":
+        raise RuntimeError(
+            f"Replicate prediction {prediction.get('status')}: "
+            f"{prediction.get('error')}"
+        )
+    output = prediction.get("output") or []
+    text = "".join(output) if isinstance(output, list) else str(output)
+    if not text.strip():
+        raise RuntimeError("replicate returned an empty response")
+    formatter = SlackMarkdownFormatter(decorate=False)
+    return formatter.feed(text) + formatter.finish()
+
+
+def _stream_replicate(
+    streamer: MarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """Run a Replicate prediction synchronously and append the result at once"""
+    timer = StreamTimer("replicate")
+    # The whole answer arrives at once, so it has the first-token budget
+    watch = deadline.watch("replicate")
+    try:
+        response = get_http_client("replicate").post(
+            **_replicate_request(prompts), timeout=watch.timeout()
+        )
+        watch.tick()
+        response.raise_for_status()
+        text = _replicate_text(response.json())
+        timer.mark(text)
+    finally:
+        timer.report()
+    streamer.append(markdown_text=text)
+
+
+async def _astream_replicate(
+    streamer: AsyncMarkdownStream, prompts: ResponseInputParam, deadline: Deadline
+):
+    """Async version of _stream_replicate"""
+    timer = StreamTimer("replicate")
+    watch = deadline.watch("replicate")
+    try:
+        response = await get_async_http_client("replicate").post(
+            **_replicate_request(prompts), timeout=watch.timeout()
+        )
+        watch.tick()
+        response.raise_for_status()
+        text = _replicate_text(response.json())
+        timer.mark(text)
+    finally:
+        timer.report()
+    await streamer.append(markdown_text=text)
+
+
+_replicate = Provider(
+    name="replicate",
+    default_model="meta/meta-llama-3-8b-instruct",
+    api_key_env="REPLICATE_API_TOKEN",
+    model_env="REPLICATE_MODEL",
+    stream=_stream_replicate,
+    astream=_astream_replicate,
+    supports_streaming=False,
+)
+
+register_provider(
+    _openai_compatible(
+        "groq",
+        "llama-3.3-70b-versatile",
+        "GROQ_API_KEY",
+        "GROQ_MODEL",
+        "https://api.groq.com/openai/v1",
+    )
+)
+register_provider(
+    _openai_compatible(
+        "openrouter",
+        "qwen/qwen-2.5-coder-32b-instruct",
+        "OPENROUTER_API_KEY",
+        "OPENROUTER_MODEL",
+        "https://openrouter.ai/api/v1",
+    )
+)
+register_provider(
+    _openai_compatible(
+        "together",
+        "Qwen/Qwen2.5-Coder-32B-Instruct",
+        "TOGETHER_API_KEY",
+        "TOGETHER_MODEL",
+        "https://api.together.xyz/v1",
+    )
+)
+register_provider(_replicate)
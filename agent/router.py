@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from agent.health import OPEN, get_breaker
+from agent.providers import Provider, configured_providers
+from agent.streaming import add_timings_listener
+
+logger = logging.getLogger(__name__)
+
+LATENCY = "latency"
+PRIORITY = "priority"
+
+
+@dataclass(frozen=True)
+class RoutingPolicy:
+    """
+    How the router orders providers for a request
+
+    Args:
+        mode: "latency" ranks by expected response time, "priority" keeps the
+          static order
+        order: Provider names in priority order, also the tie breaker for latency
+        ewma_alpha: Weight of the newest sample in the moving averages
+        expected_tokens: Response length used to turn tokens/sec into seconds
+        error_penalty: How much a provider's error rate inflates its expected time
+        prior_first_token_ms: Assumed time to first token before any sample
+        prior_tokens_per_second: Assumed throughput before any sample
+    """
+
+    mode: str = LATENCY
+    order: Tuple[str, ...] = (
+        "openai",
+        "groq",
+        "openrouter",
+        "together",
+        "huggingface",
+        "replicate",
+        "local",
+    )
+    ewma_alpha: float = 0.3
+    expected_tokens: int = 300
+    error_penalty: float = 4.0
+    prior_first_token_ms: float = 1000.0
+    prior_tokens_per_second: float = 50.0
+
+    @classmethod
+    def from_env(cls) -> "RoutingPolicy":
+        order = os.getenv("LLM_PROVIDER_ORDER")
+        return cls(
+            mode=os.getenv("LLM_ROUTING_POLICY", cls.mode).lower(),
+            order=tuple(name.strip() for name in order.split(","))
+            if order
+            else cls.order,
+            ewma_alpha=float(os.getenv("LLM_ROUTING_EWMA_ALPHA", cls.ewma_alpha)),
+            expected_tokens=int(
+                os.getenv("LLM_ROUTING_EXPECTED_TOKENS", cls.expected_tokens)
+            ),
+            error_penalty=float(
+                os.getenv("LLM_ROUTING_ERROR_PENALTY", cls.error_penalty)
+            ),
+        )
+
+
+class ProviderStats:
+    """Moving averages of one provider's observed stream timings"""
+
+    def __init__(self):
+        self.first_token_ms: Optional[float] = None
+        self.tokens_per_second: Optional[float] = None
+        self.samples = 0
+
+    def observe(self, timings: Dict[str, Any], alpha: float):
+        first_token_ms = timings.get("first_token_ms")
+        last_token_ms = timings.get("last_token_ms")
+        if first_token_ms is None:
+            return
+        self.samples += 1
+        self.first_token_ms = _ewma(self.first_token_ms, first_token_ms, alpha)
+        # Each streamed delta is roughly one token
+        generation_seconds = (last_token_ms - first_token_ms) / 1000
+        if timings["deltas"] > 1 and generation_seconds > 0:
+            rate = (timings["deltas"] - 1) / generation_seconds
+            self.tokens_per_second = _ewma(self.tokens_per_second, rate, alpha)
+
+
+def _ewma(current: Optional[float], sample: float, alpha: float) -> float:
+    return sample if current is None else alpha * sample + (1 - alpha) * current
+
+
+@dataclass
+class RouteDecision:
+    """Provider order picked for one request, kept in Router.decisions()"""
+
+    providers: List[Provider]
+    details: Dict[str, Any]
+
+    def record_served(self, provider: Optional[Provider]):
+        """Note which provider ended up answering, None if all of them failed"""
+        self.details["served_by"] = provider.name if provider else None
+
+
+class Router:
+    """
+    Picks the provider order for each request
+
+    Providers that can't serve the request (missing tool calling or streaming)
+    and providers whose circuit is open are moved to the end, so they are still
+    tried as a last resort. The rest are ordered by the policy; in latency mode by
+    expected time to first token plus generation time, inflated by the error rate.
+    Providers marked last_resort (the local model) are not scored and always come
+    after all the others. Recent decisions are kept for inspection.
+    """
+
+    def __init__(self, policy: Optional[RoutingPolicy] = None):
+        self.policy = policy or RoutingPolicy()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ProviderStats] = {}
+        self._decisions: Deque[Dict[str, Any]] = deque(maxlen=100)
+
+    def rank(
+        self,
+        providers: Optional[List[Provider]] = None,
+        needs_tools: bool = False,
+        needs_streaming: bool = True,
+    ) -> RouteDecision:
+        providers = configured_providers() if providers is None else providers
+        scored = []
+        for provider in providers:
+            capable = (provider.supports_tools or not needs_tools) and (
+                provider.supports_streaming or not needs_streaming
+            )
+            breaker = get_breaker(provider.name)
+            available = breaker.state != OPEN
+            expected_ms = (
+                None
+                if provider.last_resort
+                else self._expected_ms(provider, breaker.error_rate())
+            )
+            scored.append((provider, capable and available, expected_ms))
+
+        def sort_key(entry):
+            provider, eligible, expected_ms = entry
+            position = self._position(provider.name)
+            if self.policy.mode == PRIORITY or provider.last_resort:
+                return (provider.last_resort, not eligible, 0.0, position)
+            return (False, not eligible, expected_ms, position)
+
+        scored.sort(key=sort_key)
+        decision = {
+            "at": time.time(),
+            "mode": self.policy.mode,
+            "needs_tools": needs_tools,
+            "ranking": [
+                {
+                    "provider": provider.name,
+                    "eligible": eligible,
+                    "expected_ms": None
+                    if expected_ms is None
+                    else round(expected_ms, 1),
+                }
+                for provider, eligible, expected_ms in scored
+            ],
+            "served_by": None,
+        }
+        with self._lock:
+            self._decisions.append(decision)
+        logger.info(
+            "Routing order: "
+            + ", ".join(
+                f"{entry['provider']}({entry['expected_ms']}ms)"
+                if entry["expected_ms"] is not None
+                else f"{entry['provider']}(last resort)"
+                for entry in decision["ranking"]
+            )
+        )
+        return RouteDecision([provider for provider, _, _ in scored], decision)
+
+    def observe(self, timings: Dict[str, Any]):
+        with self._lock:
+            stats = self._stats.setdefault(timings["provider"], ProviderStats())
+            stats.observe(timings, self.policy.ewma_alpha)
+
+    def decisions(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._decisions)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    "first_token_ms": stats.first_token_ms,
+                    "tokens_per_second": stats.tokens_per_second,
+                    "samples": stats.samples,
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def _expected_ms(self, provider: Provider, error_rate: float) -> float:
+        policy = self.policy
+        with self._lock:
+            stats = self._stats.get(provider.name)
+            first_token_ms = stats.first_token_ms if stats else None
+            tokens_per_second = stats.tokens_per_second if stats else None
+        if first_token_ms is None:
+            first_token_ms = policy.prior_first_token_ms
+        if not tokens_per_second:
+            tokens_per_second = policy.prior_tokens_per_second
+        expected = first_token_ms + policy.expected_tokens / tokens_per_second * 1000
+        return expected * (1 + policy.error_penalty * error_rate)
+
+    def _position(self, name: str) -> int:
+        order = self.policy.order
+        return order.index(name) if name in order else len(order)
+
+
+_router: Optional[Router] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Router:
+    """Return the process-wide router, created from the environment on first use"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = Router(RoutingPolicy.from_env())
+                add_timings_listener(_router.observe)
+    return _router
@@ -0,0 +1,430 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from openai.types.responses import ResponseInputParam
+
+from agent.prompts import SYSTEM_PROMPT, latest_user_message
+from agent.providers import Provider
+
+logger = logging.getLogger(__name__)
+
+# Seconds before loading a model that failed to load is tried again
+_RETRY_LOAD_AFTER = 300.0
+# Embeddings of questions looked up, kept for storing their answers
+_RECENT_QUESTIONS = 256
+
+
+@dataclass(frozen=True)
+class SemanticCacheSettings:
+    """
+    Settings for answering near-duplicate questions from earlier responses
+
+    Args:
+        enabled: Look up similar earlier questions before calling a provider
+        model: Hugging Face sentence embedding model, run locally on the CPU
+        threshold: Cosine similarity a cached question needs to be reused
+        capacity: Entries kept; the least recently used is replaced when full
+        max_question_chars: Longer questions (usually pasted code) are not cached,
+          since similar wording around different code needs a different answer
+        path: File the index is saved to and loaded from, None to keep it in memory
+        save_every: Save the index after this many new entries
+    """
+
+    enabled: bool = False
+    model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    threshold: float = 0.92
+    capacity: int = 10_000
+    max_question_chars: int = 500
+    path: Optional[str] = None
+    save_every: int = 50
+
+    @classmethod
+    def from_env(cls) -> "SemanticCacheSettings":
+        return cls(
+            enabled=os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true",
+            model=os.getenv("SEMANTIC_CACHE_MODEL", cls.model),
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", cls.threshold)),
+            capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", cls.capacity)),
+            max_question_chars=int(
+                os.getenv("SEMANTIC_CACHE_MAX_QUESTION_CHARS", cls.max_question_chars)
+            ),
+            path=os.getenv("SEMANTIC_CACHE_PATH") or None,
+            save_every=int(os.getenv("SEMANTIC_CACHE_SAVE_EVERY", cls.save_every)),
+        )
+
+
+class VectorIndex:
+    """
+    Fixed-capacity cosine similarity index over unit vectors
+
+    Vectors live in one preallocated float32 matrix, so a lookup is a single
+    matrix-vector product. Each entry belongs to a scope (provider, model and
+    system prompt) and only matches queries in the same scopes. When the index is
+    full, the least recently used entry is overwritten.
+    """
+
+    def __init__(self, dim: int, capacity: int):
+        self.dim = dim
+        self.capacity = capacity
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._scopes = np.full(capacity, -1, dtype=np.int32)
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._responses: List[Optional[str]] = [None] * capacity
+        self._scope_ids: Dict[str, int] = {}
+        self._size = 0
+        self._tick = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vector: np.ndarray, scope: str, response: str):
+        if self._size < self.capacity:
+            slot = self._size
+            self._size += 1
+        else:
+            slot = int(np.argmin(self._last_used))
+            self.evictions += 1
+        self._tick += 1
+        self._vectors[slot] = vector
+        self._scopes[slot] = self._scope_id(scope)
+        self._last_used[slot] = self._tick
+        self._responses[slot] = response
+
+    def search(
+        self, vector: np.ndarray, scopes: Sequence[str], threshold: float
+    ) -> Optional[Tuple[str, str, float]]:
+        """Return (response, scope, similarity) of the best match above threshold"""
+        ids = [self._scope_ids[scope] for scope in scopes if scope in self._scope_ids]
+        if not ids or not self._size:
+            return None
+        scores = self._vectors[: self._size] @ vector
+        if len(ids) < len(self._scope_ids):
+            scores[~np.isin(self._scopes[: self._size], ids)] = -1.0
+        slot = int(np.argmax(scores))
+        score = float(scores[slot])
+        if score < threshold:
+            return None
+        self._tick += 1
+        self._last_used[slot] = self._tick
+        scope = next(
+            name
+            for name, scope_id in self._scope_ids.items()
+            if scope_id == self._scopes[slot]
+        )
+        return self._responses[slot], scope, score
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """A copy of the index for write(), so it can be written without a lock"""
+        size = self._size
+        metadata = {
+            "scopes": self._scope_ids,
+            "responses": self._responses[:size],
+            "tick": self._tick,
+        }
+        return {
+            "vectors": self._vectors[:size].copy(),
+            "scopes": self._scopes[:size].copy(),
+            "last_used": self._last_used[:size].copy(),
+            "metadata": np.array(json.dumps(metadata, ensure_ascii=False)),
+        }
+
+    @staticmethod
+    def write(snapshot: Dict[str, np.ndarray], path: str):
+        """Write a snapshot to path atomically"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **snapshot)
+        os.replace(tmp_path, path)
+
+    def save(self, path: str):
+        """Write the index to path atomically"""
+        self.write(self.snapshot(), path)
+
+    @classmethod
+    def load(cls, path: str, dim: int, capacity: int) -> "VectorIndex":
+        index = cls(dim, capacity)
+        with np.load(path, allow_pickle=False) as data:
+            vectors = data["vectors"]
+            if vectors.shape[1] != dim:
+                raise ValueError(
+                    f"Index at {path} has dimension {vectors.shape[1]}, expected {dim}"
+                )
+            metadata = json.loads(str(data["metadata"]))
+            # Keep the most recently used entries if the capacity went down
+            keep = np.argsort(data["last_used"])[::-1][:capacity]
+            size = len(keep)
+            index._vectors[:size] = vectors[keep]
+            index._scopes[:size] = data["scopes"][keep]
+            index._last_used[:size] = data["last_used"][keep]
+        responses = metadata["responses"]
+        for i, source in enumerate(keep):
+            index._responses[i] = responses[source]
+        index._scope_ids = metadata["scopes"]
+        index._size = size
+        index._tick = metadata["tick"]
+        return index
+
+    def _scope_id(self, scope: str) -> int:
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None:
+            scope_id = len(self._scope_ids)
+            self._scope_ids[scope] = scope_id
+        return scope_id
+
+
+class Embedder:
+    """
+    Sentence embeddings from a local transformers model on the CPU
+
+    The model is loaded on a background thread the first time it is needed;
+    until it is ready encode() returns None, so a request never waits for it.
+    A model that failed to load is tried again after _RETRY_LOAD_AFTER.
+    """
+
+    def __init__(self, model: str):
+        self.model_name = model
+        self._lock = threading.Lock()
+        self._loading = False
+        self._failed_at: Optional[float] = None
+        self._tokenizer = None
+        self._model = None
+        self.dim: Optional[int] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def start_loading(self):
+        with self._lock:
+            if self._loading or self.ready:
+                return
+            if self._failed_at is not None and (
+                time.monotonic() - self._failed_at < _RETRY_LOAD_AFTER
+            ):
+                return
+            self._loading = True
+        threading.Thread(
+            target=self._load, name="semantic-cache-embedder", daemon=True
+        ).start()
+
+    def encode(self, text: str) -> Optional[np.ndarray]:
+        """Unit-length embedding of text, None while the model is still loading"""
+        if not self.ready:
+            self.start_loading()
+            return None
+        import torch
+
+        inputs = self._tokenizer(
+            text, truncation=True, max_length=256, return_tensors="pt"
+        )
+        with torch.inference_mode():
+            output = self._model(**inputs).last_hidden_state
+        # Mean pooling over the tokens, as sentence-transformers models expect
+        mask = inputs["attention_mask"].unsqueeze(-1).to(output.dtype)
+        vector = ((output * mask).sum(dim=1) / mask.sum(dim=1))[0].numpy()
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    def _load(self):
+        try:
+            from transformers import AutoModel, AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            model = AutoModel.from_pretrained(self.model_name)
+            model.eval()
+            self.dim = model.config.hidden_size
+            self._tokenizer = tokenizer
+            self._model = model
+            logger.info(f"Loaded embedding model {self.model_name} ({self.dim} dims)")
+        except Exception as e:
+            with self._lock:
+                self._loading = False
+                self._failed_at = time.monotonic()
+            logger.error(f"Could not load embedding model {self.model_name}: {e}")
+
+
+def _scope(provider: Provider, system_prompt: str = SYSTEM_PROMPT) -> str:
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+    return f"{provider.name}:{provider.model}:{prompt_hash}"
+
+
+class SemanticCache:
+    """
+    Answers questions that are worded like an earlier one
+
+    Only single-message conversations without much text are cached: with earlier
+    turns or pasted code, a similar-looking last message doesn't mean the same
+    question.
+
+    A lookup has to embed the question before the provider is called, but
+    storing the answer happens on a background thread: it reuses the lookup's
+    embedding, and the index is saved from a snapshot taken under the lock and
+    written outside it, so lookups never wait for the file.
+    """
+
+    def __init__(self, settings: SemanticCacheSettings, embedder: Embedder):
+        self.settings = settings
+        self._embedder = embedder
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._index: Optional[VectorIndex] = None
+        self._unsaved = 0
+        self._recent: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="semantic-cache"
+        )
+        self._pending: Optional[Future] = None
+        self._stats = {"hits": 0, "misses": 0, "skipped": 0, "stores": 0}
+
+    def question(self, prompts: ResponseInputParam) -> Optional[str]:
+        """The text to embed for prompts, None if they can't be cached"""
+        messages = [prompt for prompt in prompts if isinstance(prompt, dict)]
+        # The app's greeting at the top of a thread doesn't change the question
+        while messages and messages[0].get("role") == "assistant":
+            messages.pop(0)
+        if len(messages) != 1:
+            return None
+        text = latest_user_message(messages).strip()
+        if not text or len(text) > self.settings.max_question_chars or "```" in text:
+            return None
+        return text
+
+    def lookup(
+        self, prompts: ResponseInputParam, providers: List[Provider]
+    ) -> Optional[Tuple[Provider, str]]:
+        question = self.question(prompts)
+        vector = self._embedder.encode(question) if question else None
+        if vector is None:
+            self._count("skipped")
+            return None
+        scopes = {_scope(provider): provider for provider in providers}
+        with self._lock:
+            self._recent[question] = vector
+            self._recent.move_to_end(question)
+            while len(self._recent) > _RECENT_QUESTIONS:
+                self._recent.popitem(last=False)
+            index = self._get_index(len(vector))
+            match = index.search(vector, list(scopes), self.settings.threshold)
+            self._stats["hits" if match else "misses"] += 1
+        if match is None:
+            return None
+        response, scope, score = match
+        logger.info(f"Semantic cache hit (similarity {score:.3f})")
+        return scopes[scope], response
+
+    def put(self, prompts: ResponseInputParam, provider: Provider, text: str):
+        """Store a response on the background thread"""
+        question = self.question(prompts)
+        if not question:
+            return
+        self._pending = self._writer.submit(self._put, question, _scope(provider), text)
+
+    def flush(self):
+        """Wait for the responses put so far to be stored"""
+        pending = self._pending
+        if pending is not None:
+            pending.result()
+
+    def save(self):
+        self.flush()
+        with self._lock:
+            snapshot = self._take_snapshot() if self._unsaved else None
+        if snapshot is not None:
+            self._write(snapshot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["entries"] = len(self._index) if self._index else 0
+            stats["evictions"] = self._index.evictions if self._index else 0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _get_index(self, dim: int) -> VectorIndex:
+        if self._index is None:
+            path = self.settings.path
+            if path and os.path.exists(path):
+                try:
+                    self._index = VectorIndex.load(path, dim, self.settings.capacity)
+                    logger.info(
+                        f"Loaded {len(self._index)} semantic cache entries from {path}"
+                    )
+                except Exception as e:
+                    logger.warning(f"Ignoring semantic cache file {path}: {e}")
+            if self._index is None:
+                self._index = VectorIndex(dim, self.settings.capacity)
+        return self._index
+
+    def _put(self, question: str, scope: str, text: str):
+        with self._lock:
+            vector = self._recent.pop(question, None)
+        if vector is None:
+            try:
+                vector = self._embedder.encode(question)
+            except Exception as e:
+                logger.warning(
+                    f"Could not embed a question for the semantic cache: {e}"
+                )
+                return
+            if vector is None:
+                return
+        with self._lock:
+            self._get_index(len(vector)).add(vector, scope, text)
+            self._stats["stores"] += 1
+            self._unsaved += 1
+            snapshot = None
+            if self._unsaved >= self.settings.save_every:
+                snapshot = self._take_snapshot()
+        if snapshot is not None:
+            self._write(snapshot)
+
+    def _take_snapshot(self) -> Optional[Dict[str, np.ndarray]]:
+        if not self.settings.path or self._index is None:
+            return None
+        self._unsaved = 0
+        return self._index.snapshot()
+
+    def _write(self, snapshot: Dict[str, np.ndarray]):
+        # Serializes writes, which share a temporary file
+        with self._save_lock:
+            try:
+                VectorIndex.write(snapshot, self.settings.path)
+            except OSError as e:
+                logger.warning(f"Could not save the semantic cache: {e}")
+
+
+_cache: Optional[SemanticCache] = None
+_cache_lock = threading.Lock()
+_cache_loaded = False
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Return the process-wide semantic cache, or None if it is disabled"""
+    global _cache, _cache_loaded
+    if not _cache_loaded:
+        with _cache_lock:
+            if not _cache_loaded:
+                settings = SemanticCacheSettings.from_env()
+                if settings.enabled:
+                    embedder = Embedder(settings.model)
+                    embedder.start_loading()
+                    _cache = SemanticCache(settings, embedder)
+                    atexit.register(_cache.save)
+                _cache_loaded = True
+    return _cache
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from agent.streaming import AsyncMarkdownStream, MarkdownStream, StreamCancelled
+
+logger = logging.getLogger(__name__)
+
+# One append as the upstream stream made it: (markdown_text, chunks)
+_Event = Tuple[Optional[str], Optional[List[Any]]]
+
+
+@dataclass(frozen=True)
+class SingleFlightSettings:
+    """
+    Settings for sharing one upstream generation between identical requests
+
+    Args:
+        enabled: Let a request join an identical one that is still generating
+    """
+
+    enabled: bool = False
+
+    @classmethod
+    def from_env(cls) -> "SingleFlightSettings":
+        return cls(
+            enabled=os.getenv("LLM_SINGLE_FLIGHT_ENABLED", "false").lower() == "true",
+        )
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "flights": 0,
+    "joined": 0,
+    "abandoned": 0,
+}
+
+
+def single_flight_stats() -> Dict[str, Any]:
+    """How many generations ran and how many requests joined one instead"""
+    with _stats_lock:
+        stats = dict(_stats)
+    requests = stats["flights"] + stats["joined"]
+    stats["upstream_calls_saved"] = stats["joined"]
+    stats["join_rate"] = stats["joined"] / requests if requests else 0.0
+    return stats
+
+
+def _count(key: str, amount: int = 1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _batches(events: List[_Event]) -> List[_Event]:
+    """Merge runs of text so a subscriber that fell behind catches up in one append"""
+    batches: List[_Event] = []
+    for markdown_text, chunks in events:
+        if not chunks and batches and not batches[-1][1]:
+            batches[-1] = ((batches[-1][0] or "") + (markdown_text or ""), None)
+        else:
+            batches.append((markdown_text, chunks))
+    return batches
+
+
+class _Flight:
+    """
+    Everything one upstream generation has emitted so far
+
+    The generation only appends to the log; every request sharing it, the one
+    that started it included, copies the log to its own streamer from its own
+    position. A slow Slack stream therefore only delays itself, and a request that
+    joins late replays what it missed. Once every subscriber has left, the next
+    upstream append raises StreamCancelled to stop the generation.
+    """
+
+    def __init__(self):
+        self.events: List[_Event] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = threading.Condition()
+
+    def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[List[Any]] = None,
+        **kwargs,
+    ) -> Any:
+        with self.changed:
+            if not self.subscribers:
+                raise StreamCancelled("Every request sharing the stream has left")
+            self.events.append((markdown_text, list(chunks) if chunks else None))
+            self.changed.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.changed:
+            self.done = True
+            self.error = error
+            self.changed.notify_all()
+
+    def follow(self, streamer: MarkdownStream):
+        """Copy the log to streamer until the generation finishes"""
+        position = 0
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: self.done or len(self.events) > position)
+                events = self.events[position:]
+                position += len(events)
+                done, error = self.done, self.error
+            for markdown_text, chunks in _batches(events):
+                streamer.append(markdown_text=markdown_text, chunks=chunks)
+            if done and position == len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(
+    key: str,
+    streamer: MarkdownStream,
+    generate: Callable[[MarkdownStream], None],
+) -> bool:
+    """
+    Stream the response for key, sharing a generation already running for it
+
+    generate(streamer) produces the response; it runs on its own thread so that
+    no subscriber's Slack stream can hold it up. Returns True if the request
+    joined an existing generation rather than starting one.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        joined = flight is not None
+        if flight is None:
+            flight = _flights[key] = _Flight()
+        with flight.changed:
+            flight.subscribers += 1
+    _count("joined" if joined else "flights")
+    if joined:
+        logger.info("Joining an identical request that is already generating")
+    else:
+        threading.Thread(
+            target=_fly, args=(key, flight, generate), name="single-flight", daemon=True
+        ).start()
+    try:
+        flight.follow(streamer)
+    finally:
+        with flight.changed:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.done:
+                _count("abandoned")
+    return joined
+
+
+def _fly(key: str, flight: _Flight, generate: Callable[[MarkdownStream], None]):
+    error = None
+    try:
+        generate(flight)
+    except BaseException as e:
+        error = e
+    finally:
+        # Requests arriving from now on start a new generation (or hit the cache)
+        with _flights_lock:
+            if _flights.get(key) is flight:
+                del _flights[key]
+        flight.finish(error)
+
+
+class _AsyncFlight(_Flight):
+    """_Flight for the asyncio app, where every subscriber is a task on one loop"""
+
+    def __init__(self):
+        super().__init__()
+        self.async_changed = asyncio.Event()
+
+    def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[List[Any]] = None,
+        **kwargs,
+    ) -> Any:
+        super().append(markdown_text=markdown_text, chunks=chunks)
+        self.async_changed.set()
+
+    def finish(self, error: Optional[BaseException] = None):
+        super().finish(error)
+        self.async_changed.set()
+
+    async def afollow(self, streamer: AsyncMarkdownStream):
+        position = 0
+        while True:
+            while not self.done and len(self.events) == position:
+                self.async_changed.clear()
+                await self.async_changed.wait()
+            events = self.events[position:]
+            position += len(events)
+            done = self.done
+            for markdown_text, chunks in _batches(events):
+                await streamer.append(markdown_text=markdown_text, chunks=chunks)
+            if done and position == len(self.events):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class _AsyncFlightStream:
+    """The async streamer an async generation writes to"""
+
+    def __init__(self, flight: _AsyncFlight):
+        self._flight = flight
+
+    async def append(self, **kwargs) -> Any:
+        return self._flight.append(**kwargs)
+
+
+_async_flights: Dict[str, _AsyncFlight] = {}
+# Generations keep running when the request that started them is cancelled
+_async_tasks: Set["asyncio.Task[None]"] = set()
+
+
+async def async_single_flight(
+    key: str,
+    streamer: AsyncMarkdownStream,
+    generate: Callable[[AsyncMarkdownStream], Awaitable[None]],
+) -> bool:
+    """Async version of single_flight; the generation runs as its own task"""
+    flight = _async_flights.get(key)
+    joined = flight is not None
+    if flight is None:
+        flight = _async_flights[key] = _AsyncFlight()
+    flight.subscribers += 1
+    _count("joined" if joined else "flights")
+    if joined:
+        logger.info("Joining an identical request that is already generating")
+    else:
+        task = asyncio.create_task(_afly(key, flight, generate))
+        _async_tasks.add(task)
+        task.add_done_callback(_async_tasks.discard)
+    try:
+        await flight.afollow(streamer)
+    finally:
+        flight.subscribers -= 1
+        if not flight.subscribers and not flight.done:
+            _count("abandoned")
+    return joined
+
+
+async def _afly(
+    key: str,
+    flight: _AsyncFlight,
+    generate: Callable[[AsyncMarkdownStream], Awaitable[None]],
+):
+    error = None
+    try:
+        await generate(_AsyncFlightStream(flight))
+    except BaseException as e:
+        error = e
+        if isinstance(e, asyncio.CancelledError):
+            raise
+    finally:
+        if _async_flights.get(key) is flight:
+            del _async_flights[key]
+        flight.finish(error)
@@ -0,0 +1,236 @@
+import http.client
+import io
+import logging
+import os
+import select
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.response import addinfourl
+
+from agent.slack_rate_limit import build_handlers as build_rate_limit_handlers
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SlackHttpSettings:
+    """
+    Settings for sending Slack Web API calls over pooled keep-alive connections
+
+    Args:
+        enabled: Reuse connections to the Slack API instead of opening one per call
+        pool_size: Idle connections kept open to the Slack API for reuse
+        keepalive_expiry: Seconds an idle connection is kept before closing
+    """
+
+    enabled: bool = False
+    pool_size: int = 16
+    keepalive_expiry: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "SlackHttpSettings":
+        return cls(
+            enabled=os.getenv("SLACK_HTTP_POOL_ENABLED", "false").lower() == "true",
+            pool_size=int(os.getenv("SLACK_HTTP_POOL_SIZE", cls.pool_size)),
+            keepalive_expiry=float(
+                os.getenv("SLACK_HTTP_KEEPALIVE_EXPIRY", cls.keepalive_expiry)
+            ),
+        )
+
+
+class _ConnectionPool:
+    """Keep-alive HTTP(S) connections to one host, most recently used first"""
+
+    def __init__(
+        self, base_url: str, settings: SlackHttpSettings, clock=time.monotonic
+    ):
+        url = urllib.parse.urlsplit(base_url)
+        self.https = url.scheme == "https"
+        self.host = url.hostname or ""
+        self.port = url.port
+        self.settings = settings
+        self._clock = clock
+        self._ssl = ssl.create_default_context() if self.https else None
+        self._lock = threading.Lock()
+        self._idle: Deque[Tuple[http.client.HTTPConnection, float]] = deque()
+        self._stats = {"requests": 0, "connections": 0, "reused": 0}
+
+    def request(
+        self, method: str, path: str, body, headers: Dict[str, str], timeout: float
+    ) -> Tuple[http.client.HTTPResponse, bytes]:
+        connection, reused = self._acquire(timeout)
+        try:
+            try:
+                connection.request(method, path, body=body, headers=headers)
+            except OSError:
+                connection.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection; nothing was sent, so the
+                # request is safe to send again on a new one
+                connection, reused = self._connect(timeout), False
+                connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+        return response, data
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle"] = len(self._idle)
+        return stats
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+    def _acquire(self, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        now = self._clock()
+        with self._lock:
+            self._stats["requests"] += 1
+            while self._idle:
+                connection, idle_since = self._idle.pop()
+                if now - idle_since < self.settings.keepalive_expiry and (
+                    not _closed_by_server(connection)
+                ):
+                    self._stats["reused"] += 1
+                    connection.sock.settimeout(timeout)
+                    return connection, True
+                connection.close()
+        return self._connect(timeout), False
+
+    def _connect(self, timeout: float) -> http.client.HTTPConnection:
+        with self._lock:
+            self._stats["connections"] += 1
+        if self.https:
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=timeout, context=self._ssl
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _release(self, connection: http.client.HTTPConnection):
+        with self._lock:
+            if len(self._idle) < self.settings.pool_size:
+                self._idle.append((connection, self._clock()))
+                return
+        connection.close()
+
+
+def _closed_by_server(connection: http.client.HTTPConnection) -> bool:
+    # An idle keep-alive connection only becomes readable when the server has
+    # closed it (or sent something unexpected); either way it can't be reused
+    sock = connection.sock
+    if sock is None:
+        return True
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class PooledSlackHandler(urllib.request.BaseHandler):
+    """
+    A urllib handler that sends requests to the Slack API over kept-alive
+    connections
+
+    slack_sdk's WebClient sends every call with urllib, which opens a new
+    connection (and TLS session) each time. Bolt also builds a new WebClient for
+    every request, so the pooling has to sit below the client: installed as
+    urllib's opener, this handler takes the requests for base_url and sends them
+    over keep-alive connections shared by all threads. Other URLs, requests going
+    through a proxy and WebClients with their own ssl context or proxy use urllib
+    as before. Error statuses still become HTTPError, so slack_sdk's retry
+    handlers (e.g. for 429) work unchanged.
+    """
+
+    # Before urllib's own HTTP(S)Handler (500), after ProxyHandler (100)
+    handler_order = 400
+
+    def __init__(self, base_url: str, settings: SlackHttpSettings):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.pool = _ConnectionPool(self.base_url, settings)
+
+    def http_open(self, req: urllib.request.Request):
+        return self._open(req)
+
+    def https_open(self, req: urllib.request.Request):
+        return self._open(req)
+
+    def close(self):
+        self.pool.close()
+
+    def _open(self, req: urllib.request.Request):
+        if req.has_proxy() or not req.full_url.startswith(self.base_url):
+            return None
+        try:
+            response, data = self.pool.request(
+                req.get_method(),
+                req.selector,
+                req.data,
+                dict(req.header_items()),
+                req.timeout,
+            )
+        except OSError as e:
+            # urllib callers expect URLError for connection problems
+            raise urllib.error.URLError(e) from e
+        result = addinfourl(
+            io.BytesIO(data), response.msg, req.full_url, response.status
+        )
+        result.msg = response.reason
+        return result
+
+
+_handler: Optional[PooledSlackHandler] = None
+_handler_lock = threading.Lock()
+
+
+def install_slack_transport(
+    base_url: str,
+    settings: Optional[SlackHttpSettings] = None,
+    rate_limit: bool = True,
+) -> Optional[PooledSlackHandler]:
+    """
+    Send Web API calls to base_url over pooled connections and under the client
+    side rate limits, whichever are enabled
+
+    rate_limit=False leaves the rate limits out whatever SLACK_RATE_LIMIT_ENABLED
+    says. Both only apply to urllib, i.e. the sync WebClients of app.py and
+    app_oauth.py; the AsyncWebClient of app_async.py sends its calls with aiohttp and is neither
+    pooled nor rate limited by this.
+    """
+    global _handler
+    settings = settings or SlackHttpSettings.from_env()
+    with _handler_lock:
+        if _handler is not None:
+            _handler.close()
+            _handler = None
+        handlers: List[urllib.request.BaseHandler] = (
+            build_rate_limit_handlers(base_url) if rate_limit else []
+        )
+        if settings.enabled:
+            _handler = PooledSlackHandler(base_url, settings)
+            handlers.append(_handler)
+            logger.info(
+                f"Slack API calls to {_handler.base_url} use up to "
+                f"{settings.pool_size} pooled connections"
+            )
+        if handlers:
+            urllib.request.install_opener(urllib.request.build_opener(*handlers))
+        else:
+            urllib.request.install_opener(None)
+    return _handler
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Calls per minute per workspace and method that each Slack rate limit tier allows
+# https://docs.slack.dev/apis/web-api/rate-limits
+TIER_CALLS_PER_MINUTE = {1: 1, 2: 20, 3: 50, 4: 100}
+
+# Tiers of the Web API methods the app calls; methods not listed count as tier 3
+METHOD_TIERS: Dict[str, int] = {
+    "chat.startStream": 3,
+    "chat.appendStream": 4,
+    "chat.stopStream": 3,
+    "chat.postEphemeral": 4,
+    "chat.postMessage": 4,
+    "assistant.threads.setStatus": 3,
+    "assistant.threads.setTitle": 3,
+    "assistant.threads.setSuggestedPrompts": 3,
+    "conversations.replies": 3,
+}
+DEFAULT_TIER = 3
+
+
+def _parse_tiers(value: str) -> Dict[str, int]:
+    """Parse "chat.appendStream=4,chat.stopStream=3" into method tiers"""
+    tiers = {}
+    for item in value.split(","):
+        method, _, tier = item.partition("=")
+        if method.strip() and tier.strip():
+            tiers[method.strip()] = int(tier)
+    return tiers
+
+
+@dataclass(frozen=True)
+class SlackRateLimitSettings:
+    """
+    Settings for pacing Slack Web API calls under Slack's rate limit tiers
+
+    Args:
+        enabled: Wait for a token of the method's tier before calling Slack
+        method_tiers: Tier of each Web API method, on top of METHOD_TIERS
+        burst_seconds: Seconds of a tier's rate that can be spent at once
+        max_wait: Longest a call waits for a token or a Retry-After before it
+          is sent anyway (and Slack decides)
+    """
+
+    enabled: bool = True
+    method_tiers: Dict[str, int] = field(default_factory=dict)
+    burst_seconds: float = 10.0
+    max_wait: float = 30.0
+
+    @classmethod
+    def from_env(cls) -> "SlackRateLimitSettings":
+        return cls(
+            enabled=os.getenv("SLACK_RATE_LIMIT_ENABLED", "true").lower() == "true",
+            method_tiers=_parse_tiers(os.getenv("SLACK_RATE_LIMIT_TIERS", "")),
+            burst_seconds=float(
+                os.getenv("SLACK_RATE_LIMIT_BURST_SECONDS", cls.burst_seconds)
+            ),
+            max_wait=float(os.getenv("SLACK_RATE_LIMIT_MAX_WAIT", cls.max_wait)),
+        )
+
+    def tier(self, method: str) -> int:
+        return self.method_tiers.get(method, METHOD_TIERS.get(method, DEFAULT_TIER))
+
+
+class _Bucket:
+    """Tokens of one method in one workspace, refilled at the method's tier rate"""
+
+    def __init__(self, tier: int, settings: SlackRateLimitSettings, now: float):
+        self.rate = TIER_CALLS_PER_MINUTE.get(tier, TIER_CALLS_PER_MINUTE[1]) / 60
+        self.capacity = max(self.rate * settings.burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self.updated = now
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.stats = {"calls": 0, "waited": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    def refill(self, now: float):
+        # updated is in the future while a Retry-After holds the bucket empty
+        if now > self.updated:
+            self.tokens = min(
+                self.tokens + (now - self.updated) * self.rate, self.capacity
+            )
+            self.updated = now
+
+    def available_in(self, now: float) -> float:
+        """Seconds until a call may take a token, 0 if it may now"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return max(1.0 - self.tokens, 0.0) / self.rate
+
+    def pressure(self, now: float) -> float:
+        if now < self.blocked_until or self.waiting:
+            return 1.0
+        return 1.0 - min(self.tokens / self.capacity, 1.0)
+
+
+class SlackRateLimiter:
+    """
+    Token buckets per workspace and Web API method for Slack API calls
+
+    Slack rate limits each method of each workspace on its own, at the rate of
+    the method's tier, and so does this: acquire() blocks the calling thread
+    until the method's bucket has a token, and a 429 blocks only that method
+    for its Retry-After. chat.stopStream and feedback messages therefore never
+    wait behind the chat.appendStream calls of busy streams; the appends are
+    the ones that are held back, and merged into fewer, larger ones, when their
+    own limit is near (see pressure()).
+    """
+
+    def __init__(self, settings: SlackRateLimitSettings, clock=time.monotonic):
+        self.settings = settings
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+
+    def acquire(self, workspace: str, method: str) -> float:
+        """Wait for a token for method, returning the seconds waited"""
+        with self._condition:
+            started = now = self._clock()
+            bucket = self._bucket(workspace, method, now)
+            bucket.waiting += 1
+            try:
+                while True:
+                    bucket.refill(now)
+                    wait = bucket.available_in(now)
+                    if wait <= 0:
+                        bucket.tokens -= 1
+                        break
+                    remaining = started + self.settings.max_wait - now
+                    if remaining <= 0:
+                        logger.warning(
+                            f"Calling {method} after waiting {now - started:.1f}s "
+                            "for the rate limit"
+                        )
+                        break
+                    self._condition.wait(min(wait, remaining))
+                    now = self._clock()
+            finally:
+                bucket.waiting -= 1
+                self._condition.notify_all()
+            waited = now - started
+            bucket.stats["calls"] += 1
+            if waited > 0:
+                bucket.stats["waited"] += 1
+                bucket.stats["wait_seconds"] += waited
+        return waited
+
+    def rate_limited(self, workspace: str, method: str, retry_after: float):
+        """Hold back every call of method in workspace for retry_after"""
+        with self._condition:
+            now = self._clock()
+            bucket = self._bucket(workspace, method, now)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+            # Slack says the method is used up, whatever the bucket thought; one
+            # call may go when the Retry-After is over
+            bucket.tokens = 1.0
+            bucket.updated = now + retry_after
+            bucket.stats["rate_limited"] += 1
+            self._condition.notify_all()
+        logger.warning(f"{method} was rate limited, holding back for {retry_after}s")
+
+    def pressure(self, workspace: str, method: str = "chat.appendStream") -> float:
+        """
+        How close method is to its limit in workspace
+
+        0.0 when the bucket is full (or unused), 1.0 when it is empty, blocked by
+        a Retry-After or has calls waiting.
+        """
+        with self._condition:
+            bucket = self._buckets.get((workspace, method))
+            if bucket is None:
+                return 0.0
+            now = self._clock()
+            bucket.refill(now)
+            return bucket.pressure(now)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._condition:
+            return {
+                f"{workspace}/{method}": dict(bucket.stats)
+                for (workspace, method), bucket in self._buckets.items()
+            }
+
+    def _bucket(self, workspace: str, method: str, now: float) -> _Bucket:
+        key = (workspace, method)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(
+                self.settings.tier(method), self.settings, now
+            )
+        return bucket
+
+
+def _digest(authorization: str) -> str:
+    # Each token belongs to one workspace (or org) install; only a digest of it is
+    # kept so that stats and logs never show the token
+    return hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:12]
+
+
+def _workspace(req: urllib.request.Request) -> str:
+    return _digest(req.get_header("Authorization") or "")
+
+
+def token_workspace(token: Optional[str]) -> str:
+    """The workspace key of the calls WebClient makes with token"""
+    return _digest(f"Bearer {token}" if token else "")
+
+
+def _retry_after(headers) -> float:
+    try:
+        return max(float(headers.get("Retry-After", 1)), 0.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class RateLimitHandler(urllib.request.BaseHandler):
+    """
+    A urllib handler that paces requests to the Slack API with a SlackRateLimiter
+
+    Requests for base_url wait for a token before they are sent. A 429 blocks
+    the method for its Retry-After and, if that is within max_wait, the
+    request is sent again once; otherwise the HTTPError reaches slack_sdk as
+    before.
+    """
+
+    def __init__(self, base_url: str, limiter: SlackRateLimiter):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.limiter = limiter
+
+    def http_request(self, req: urllib.request.Request):
+        method = self._method(req)
+        if method:
+            self.limiter.acquire(_workspace(req), method)
+        return req
+
+    https_request = http_request
+
+    def http_error_429(self, req: urllib.request.Request, fp, code, msg, headers):
+        method = self._method(req)
+        if not method:
+            return None
+        retry_after = _retry_after(headers)
+        self.limiter.rate_limited(_workspace(req), method, retry_after)
+        if getattr(req, "_rate_limit_retried", False) or (
+            retry_after > self.limiter.settings.max_wait
+        ):
+            return None
+        req._rate_limit_retried = True  # type: ignore[attr-defined]
+        fp.read()
+        fp.close()
+        # Goes through http_request again, which waits out the Retry-After
+        return self.parent.open(req, timeout=req.timeout)
+
+    def _method(self, req: urllib.request.Request) -> Optional[str]:
+        url = req.full_url
+        if not url.startswith(self.base_url):
+            return None
+        return url[len(self.base_url) :].split("?", 1)[0] or None
+
+
+_limiter: Optional[SlackRateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[SlackRateLimiter]:
+    """The process-wide limiter, None if rate limiting is turned off"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                settings = SlackRateLimitSettings.from_env()
+                if not settings.enabled:
+                    return None
+                _limiter = SlackRateLimiter(settings)
+    return _limiter
+
+
+def append_pressure(workspace: str) -> float:
+    """
+    How close chat.appendStream is to its rate limit in workspace, 0.0 (idle)
+    to 1.0
+    """
+    limiter = _limiter
+    return limiter.pressure(workspace) if limiter is not None else 0.0
+
+
+def stream_pressure(streamer: Any) -> Callable[[], float]:
+    """append_pressure() of the workspace a ChatStream sends to"""
+    # ChatStream calls with its own token if it was given one, else its client's
+    client = getattr(streamer, "_client", None)
+    token = getattr(streamer, "_token", None) or getattr(client, "token", None)
+    workspace = token_workspace(token)
+    return lambda: append_pressure(workspace)
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    """Calls, waits and 429s per workspace digest and method"""
+    limiter = _limiter
+    return limiter.stats() if limiter is not None else {}
+
+
+def build_handlers(base_url: str) -> List[urllib.request.BaseHandler]:
+    """The urllib handlers that rate limit calls to base_url, if enabled"""
+    limiter = get_rate_limiter()
+    if limiter is None:
+        return []
+    handler = RateLimitHandler(base_url, limiter)
+    logger.info(f"Slack API calls to {handler.base_url} are paced per tier")
+    return [handler]
@@ -0,0 +1,221 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+-- Running total of the response sizes, so writers don't sum the whole table
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    size INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses BEGIN
+    UPDATE totals SET size = size + new.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_updated AFTER UPDATE OF size ON responses
+BEGIN
+    UPDATE totals SET size = size - old.size + new.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses BEGIN
+    UPDATE totals SET size = size - old.size WHERE id = 0;
+END;
+-- After the triggers, so a store written before the total existed starts right
+INSERT OR IGNORE INTO totals (id, size)
+    SELECT 0, COALESCE(SUM(size), 0) FROM responses;
+"""
+
+
+@dataclass(frozen=True)
+class StoreSettings:
+    """
+    Settings for the on-disk response store shared by all app processes
+
+    Args:
+        path: SQLite database file, None to disable the store
+        max_bytes: Total response text kept before the least recently used
+          responses are deleted
+        ttl: Seconds a stored response stays valid
+        busy_timeout: Seconds to wait for another process holding the write lock
+        mmap_bytes: How much of the database file reads may memory-map
+    """
+
+    path: Optional[str] = None
+    max_bytes: int = 64 * 1024 * 1024
+    ttl: float = 86400.0
+    busy_timeout: float = 5.0
+    mmap_bytes: int = 256 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "StoreSettings":
+        return cls(
+            path=os.getenv("LLM_STORE_PATH") or None,
+            max_bytes=int(os.getenv("LLM_STORE_MAX_BYTES", cls.max_bytes)),
+            ttl=float(os.getenv("LLM_STORE_TTL", cls.ttl)),
+            busy_timeout=float(os.getenv("LLM_STORE_BUSY_TIMEOUT", cls.busy_timeout)),
+            mmap_bytes=int(os.getenv("LLM_STORE_MMAP_BYTES", cls.mmap_bytes)),
+        )
+
+
+class ResponseStore:
+    """
+    Responses in a SQLite database in WAL mode, keyed like the in-memory cache
+
+    WAL lets any number of processes read while one writes, and reads go through
+    a memory map, so a lookup costs about as much as a dict access once the pages
+    are warm. Each thread has its own connection. Writers evict the least recently
+    used responses once the total size is over max_bytes; the total is kept up to
+    date by triggers and expired responses are found through an index, so a write
+    never scans the table. last_used is only refreshed when it is more than a
+    minute old, so hits rarely write.
+    """
+
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, settings: StoreSettings, clock=time.time):
+        if not settings.path:
+            raise ValueError("StoreSettings.path is required")
+        self.settings = settings
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        directory = os.path.dirname(settings.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as db:
+            db.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[str]:
+        now = self._clock()
+        db = self._connection()
+        row = db.execute(
+            "SELECT response, created, last_used FROM responses WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or now - row[1] >= self.settings.ttl:
+            self._count("misses")
+            return None
+        if now - row[2] >= self.TOUCH_INTERVAL:
+            try:
+                with db:
+                    db.execute(
+                        "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+                    )
+            except sqlite3.OperationalError as e:
+                # Another process holds the write lock; recency can wait
+                logger.debug(f"Skipped refreshing a stored response: {e}")
+        self._count("hits")
+        return row[0]
+
+    def put(self, key: str, text: str):
+        size = len(text.encode("utf-8"))
+        if size > self.settings.max_bytes:
+            return
+        now = self._clock()
+        db = self._connection()
+        with db:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete
+            # would not fire the trigger that keeps the total
+            db.execute(
+                "INSERT INTO responses (key, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "response = excluded.response, size = excluded.size, "
+                "created = excluded.created, last_used = excluded.last_used",
+                (key, text, size, now, now),
+            )
+            evicted = self._evict(db, now)
+        with self._lock:
+            self._stats["writes"] += 1
+            self._stats["evictions"] += evicted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        row = (
+            self._connection()
+            .execute("SELECT (SELECT COUNT(*) FROM responses), size FROM totals")
+            .fetchone()
+        )
+        stats["entries"], stats["bytes"] = row
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> int:
+        """Delete expired responses, then the least recently used over max_bytes"""
+        evicted = db.execute(
+            "DELETE FROM responses WHERE created <= ?", (now - self.settings.ttl,)
+        ).rowcount
+        (total,) = db.execute("SELECT size FROM totals").fetchone()
+        excess = total - self.settings.max_bytes
+        if excess <= 0:
+            return evicted
+        keys = []
+        for key, size in db.execute(
+            "SELECT key, size FROM responses ORDER BY last_used"
+        ):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        db.executemany("DELETE FROM responses WHERE key = ?", keys)
+        return evicted + len(keys)
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(
+                self.settings.path,
+                timeout=self.settings.busy_timeout,
+                check_same_thread=False,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(f"PRAGMA mmap_size={int(self.settings.mmap_bytes)}")
+            self._local.db = db
+        return db
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+
+_store: Optional[ResponseStore] = None
+_store_lock = threading.Lock()
+_store_loaded = False
+
+
+def get_response_store() -> Optional[ResponseStore]:
+    """Return the process-wide response store, or None if LLM_STORE_PATH is unset"""
+    global _store, _store_loaded
+    if not _store_loaded:
+        with _store_lock:
+            if not _store_loaded:
+                settings = StoreSettings.from_env()
+                if settings.path:
+                    try:
+                        _store = ResponseStore(settings)
+                    except sqlite3.Error as e:
+                        logger.error(f"Could not open the response store: {e}")
+                _store_loaded = True
+    return _store
@@ -0,0 +1,577 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from slack_sdk.models.messages.chunk import Chunk
+
+logger = logging.getLogger(__name__)
+
+# chat.appendStream rejects markdown_text longer than this, so a pending buffer is
+# flushed once it gets here even if a code fence is still open.
+SLACK_MARKDOWN_TEXT_LIMIT = 12000
+
+
+class StreamCancelled(Exception):
+    """Raised from append() to stop a provider stream whose output is not wanted"""
+
+
+class MarkdownStream(Protocol):
+    """The subset of slack_sdk's ChatStream used by the agent"""
+
+    def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[Sequence[Union[Dict, Chunk]]] = None,
+        **kwargs,
+    ) -> Any: ...
+
+
+class AsyncMarkdownStream(Protocol):
+    """The subset of slack_sdk's AsyncChatStream used by the async agent"""
+
+    def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[Sequence[Union[Dict, Chunk]]] = None,
+        **kwargs,
+    ) -> Awaitable[Any]: ...
+
+
+class TextBuffer:
+    """
+    A streamer that keeps the text instead of sending it to Slack
+
+    For provider calls whose output is used by the app rather than shown, such
+    as summaries. Task chunks (tool calls) are ignored.
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+
+    def append(self, *, markdown_text: Optional[str] = None, **kwargs) -> Any:
+        if markdown_text:
+            self._parts.append(markdown_text)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+
+class AsyncTextBuffer(TextBuffer):
+    """TextBuffer for async provider streams"""
+
+    async def append(  # type: ignore[override]
+        self, *, markdown_text: Optional[str] = None, **kwargs
+    ) -> Any:
+        if markdown_text:
+            self._parts.append(markdown_text)
+
+
+@dataclass(frozen=True)
+class FlushPolicy:
+    """
+    When buffered LLM deltas are sent to Slack as a single chat.appendStream call
+
+    Args:
+        max_bytes: Flush once this many UTF-8 bytes are pending
+        max_interval: Flush once the oldest pending delta is this many seconds old
+        min_bytes: Never flush less than this on a size or time trigger
+        boundary_lookback: How far back from the end of the buffer to look for a
+          markdown boundary (newline or space) to cut at
+        pressure_scale: How many times larger and less frequent appends get when
+          chat.appendStream is at its rate limit
+    """
+
+    max_bytes: int = 1024
+    max_interval: float = 0.5
+    min_bytes: int = 16
+    boundary_lookback: int = 256
+    pressure_scale: float = 8.0
+
+    @classmethod
+    def from_env(cls) -> "FlushPolicy":
+        return cls(
+            max_bytes=int(os.getenv("STREAM_FLUSH_MAX_BYTES", cls.max_bytes)),
+            max_interval=float(
+                os.getenv("STREAM_FLUSH_MAX_INTERVAL", cls.max_interval)
+            ),
+            min_bytes=int(os.getenv("STREAM_FLUSH_MIN_BYTES", cls.min_bytes)),
+            boundary_lookback=int(
+                os.getenv("STREAM_FLUSH_BOUNDARY_LOOKBACK", cls.boundary_lookback)
+            ),
+            pressure_scale=float(
+                os.getenv("STREAM_FLUSH_PRESSURE_SCALE", cls.pressure_scale)
+            ),
+        )
+
+    def under_pressure(self, pressure: float) -> "FlushPolicy":
+        """
+        The policy scaled up for a rate limit pressure between 0.0 and 1.0
+
+        Appends are held longer and sent in larger pieces, up to pressure_scale
+        times the usual, so a busy workspace gets fewer chat.appendStream calls
+        instead of 429s.
+        """
+        pressure = min(max(pressure, 0.0), 1.0)
+        if not pressure:
+            return self
+        scale = 1.0 + (self.pressure_scale - 1.0) * pressure
+        return replace(
+            self,
+            max_bytes=min(int(self.max_bytes * scale), SLACK_MARKDOWN_TEXT_LIMIT),
+            max_interval=self.max_interval * scale,
+            min_bytes=int(self.min_bytes * scale),
+        )
+
+
+_totals_lock = threading.Lock()
+_totals = {"streams": 0, "deltas": 0, "appends": 0, "appends_saved": 0}
+
+
+def coalescing_stats() -> Dict[str, int]:
+    """Process-wide counters for all coalesced streams finished so far"""
+    with _totals_lock:
+        return dict(_totals)
+
+
+class CoalescingStreamer:
+    """
+    Merges markdown deltas before handing them to a ChatStream
+
+    Every call to ChatStream.append that reaches Slack is one chat.appendStream
+    round trip. This wrapper holds deltas until the flush policy says to send them,
+    cuts on markdown boundaries and never splits an open code fence. Chunks such
+    as TaskUpdateChunk are sent right away, after any pending text, so ordering is
+    kept.
+    """
+
+    def __init__(
+        self,
+        streamer: MarkdownStream,
+        policy: Optional[FlushPolicy] = None,
+        clock=time.monotonic,
+        pressure: Optional[Callable[[], float]] = None,
+    ):
+        self._streamer = streamer
+        self._policy = policy or FlushPolicy()
+        self._clock = clock
+        # Rate limit pressure on chat.appendStream, see FlushPolicy.under_pressure
+        self._pressure = pressure
+        self._pending = ""
+        self._pending_since: Optional[float] = None
+        self._in_fence = False
+        # Index in _pending where the currently open fence starts
+        self._fence_start: Optional[int] = None
+        # Length of the backtick run at the end of _pending
+        self._tick_run = 0
+        self._deltas = 0
+        self._appends = 0
+        self._closed = False
+
+    def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[Sequence[Union[Dict, Chunk]]] = None,
+        **kwargs,
+    ) -> Any:
+        send = self._accept(markdown_text, chunks)
+        if send is None:
+            return None
+        return self._send(*send, **kwargs)
+
+    @property
+    def policy(self) -> FlushPolicy:
+        return self._policy
+
+    def poll(self) -> Any:
+        """Flush pending text if the policy's time trigger has fired"""
+        return self.append()
+
+    def flush(self):
+        """
+        Hand any pending text to the wrapped streamer
+
+        The text is not forced out as its own API call, so ChatStream can still
+        merge it into the final chat.stopStream.
+        """
+        text = self._drain()
+        if text:
+            self._streamer.append(markdown_text=text)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "deltas": self._deltas,
+            "appends": self._appends,
+            "appends_saved": max(self._deltas - self._appends, 0),
+            "pending_bytes": len(self._pending.encode("utf-8")),
+        }
+
+    def _accept(
+        self,
+        markdown_text: Optional[str],
+        chunks: Optional[Sequence[Union[Dict, Chunk]]],
+    ) -> Optional[Tuple[str, Sequence[Union[Dict, Chunk]]]]:
+        """Buffer a delta and return the text and chunks to send now, if any"""
+        if markdown_text:
+            self._deltas += 1
+            self._scan(markdown_text)
+            if self._pending_since is None:
+                self._pending_since = self._clock()
+            self._pending += markdown_text
+        if chunks is not None:
+            # Pending text goes out in the same call so it stays ahead of the chunks
+            return self._take(len(self._pending)), chunks
+        cut = self._flush_point()
+        if cut:
+            return self._take(cut), []
+        return None
+
+    def _drain(self) -> str:
+        """Take all pending text for the final append and record the totals"""
+        text = ""
+        if self._pending:
+            self._appends += 1
+            text = self._take(len(self._pending))
+        if not self._closed:
+            self._closed = True
+            self._record_totals()
+        return text
+
+    def _scan(self, text: str):
+        """Track code fences across delta boundaries"""
+        offset = len(self._pending)
+        for i, ch in enumerate(text):
+            if ch == "`":
+                self._tick_run += 1
+                if self._tick_run == 3:
+                    self._in_fence = not self._in_fence
+                    self._fence_start = offset + i - 2 if self._in_fence else None
+            else:
+                self._tick_run = 0
+
+    def _flush_point(self) -> int:
+        """Return how many pending characters to flush now, or 0 to keep buffering"""
+        pending = self._pending
+        if not pending:
+            return 0
+        size = len(pending.encode("utf-8"))
+        if size >= SLACK_MARKDOWN_TEXT_LIMIT:
+            return len(pending)
+        policy = self._policy
+        if self._pressure is not None:
+            policy = policy.under_pressure(self._pressure())
+        due = size >= policy.max_bytes or (
+            self._pending_since is not None
+            and self._clock() - self._pending_since >= policy.max_interval
+        )
+        if not due or size < policy.min_bytes:
+            return 0
+        limit = len(pending)
+        if self._fence_start is not None:
+            limit = self._fence_start
+        elif self._tick_run:
+            # Could be the start of a fence that the next delta completes
+            limit -= self._tick_run
+        if limit <= 0:
+            return 0
+        window_start = max(limit - policy.boundary_lookback, 0)
+        cut = pending.rfind("\n", window_start, limit)
+        if cut < 0:
+            cut = pending.rfind(" ", window_start, limit)
+        if cut < 0:
+            return limit
+        return cut + 1
+
+    def _take(self, count: int) -> str:
+        text, self._pending = self._pending[:count], self._pending[count:]
+        if self._fence_start is not None:
+            self._fence_start = max(self._fence_start - count, 0)
+        self._pending_since = self._clock() if self._pending else None
+        return text
+
+    def _send(self, text: str, chunks: Sequence[Union[Dict, Chunk]], **kwargs) -> Any:
+        self._appends += 1
+        # An explicit chunks list makes ChatStream call chat.appendStream now
+        # instead of holding the text in its own length-based buffer.
+        return self._streamer.append(
+            markdown_text=text or None, chunks=list(chunks), **kwargs
+        )
+
+    def _record_totals(self):
+        stats = self.stats()
+        with _totals_lock:
+            _totals["streams"] += 1
+            _totals["deltas"] += stats["deltas"]
+            _totals["appends"] += stats["appends"]
+            _totals["appends_saved"] += stats["appends_saved"]
+        logger.info(
+            f"Coalesced {stats['deltas']} deltas into {stats['appends']} appends "
+            f"({stats['appends_saved']} saved)"
+        )
+
+
+class AsyncCoalescingStreamer(CoalescingStreamer):
+    """CoalescingStreamer for an AsyncChatStream, append() and flush() are awaited"""
+
+    def __init__(
+        self,
+        streamer: AsyncMarkdownStream,
+        policy: Optional[FlushPolicy] = None,
+        clock=time.monotonic,
+    ):
+        super().__init__(streamer, policy, clock)  # type: ignore[arg-type]
+
+    async def append(  # type: ignore[override]
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[Sequence[Union[Dict, Chunk]]] = None,
+        **kwargs,
+    ) -> Any:
+        send = self._accept(markdown_text, chunks)
+        if send is None:
+            return None
+        # _send returns the AsyncChatStream.append coroutine
+        return await self._send(*send, **kwargs)
+
+    async def poll(self) -> Any:  # type: ignore[override]
+        return await self.append()
+
+    async def flush(self):  # type: ignore[override]
+        text = self._drain()
+        if text:
+            await self._streamer.append(markdown_text=text)
+
+
+@dataclass(frozen=True)
+class PipelineSettings:
+    """
+    Settings for running Slack appends on their own sender thread
+
+    Args:
+        enabled: Read provider events and send to Slack concurrently
+        queue_size: Items the provider may get ahead of Slack before it is blocked
+    """
+
+    enabled: bool = False
+    queue_size: int = 256
+
+    @classmethod
+    def from_env(cls) -> "PipelineSettings":
+        return cls(
+            enabled=os.getenv("STREAM_PIPELINE", "false").lower() == "true",
+            queue_size=int(os.getenv("STREAM_PIPELINE_QUEUE_SIZE", cls.queue_size)),
+        )
+
+
+_END_OF_STREAM = object()
+
+
+class PipelinedStreamer:
+    """
+    Decouples reading the provider stream from sending appends to Slack
+
+    append() only puts the delta or chunks on a bounded queue and a dedicated sender
+    thread forwards them, in order, to the wrapped streamer. When Slack falls behind
+    the queue fills up and append() blocks, which is the backpressure on the
+    provider. Whatever piles up while a Slack call is in flight is handed over in one
+    go, so the CoalescingStreamer underneath merges it into fewer appends.
+
+    An error raised by the wrapped streamer is re-raised from the next append() and
+    from flush(), which also waits for everything queued to be sent.
+    """
+
+    def __init__(self, streamer: MarkdownStream, queue_size: int = 256):
+        self._streamer = streamer
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(queue_size, 1))
+        self._error: Optional[BaseException] = None
+        self._max_depth = 0
+        self._blocked_seconds = 0.0
+        self._finished = False
+        # Time-based flushes of the coalescer still fire while the provider is quiet
+        self._poll = getattr(streamer, "poll", None)
+        self._poll_interval = (
+            getattr(getattr(streamer, "policy", None), "max_interval", None)
+            if self._poll is not None
+            else None
+        )
+        self._sender = threading.Thread(
+            target=self._run, name="slack-stream-sender", daemon=True
+        )
+        self._sender.start()
+
+    def append(
+        self,
+        *,
+        markdown_text: Optional[str] = None,
+        chunks: Optional[Sequence[Union[Dict, Chunk]]] = None,
+        **kwargs,
+    ) -> None:
+        self._raise_if_failed()
+        if self._finished:
+            raise RuntimeError("Cannot append to a pipelined stream after flush()")
+        self._put((markdown_text, chunks, kwargs))
+
+    def flush(self):
+        """Signal end of stream, wait for the sender to drain and surface errors"""
+        if not self._finished:
+            self._finished = True
+            self._put(_END_OF_STREAM)
+            self._sender.join()
+            logger.info(
+                f"Pipelined stream finished: max_queue_depth={self._max_depth} "
+                f"producer_blocked={self._blocked_seconds * 1000:.1f}ms"
+            )
+        self._raise_if_failed()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_queue_depth": self._max_depth,
+            "producer_blocked_seconds": self._blocked_seconds,
+        }
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            started = time.monotonic()
+            self._queue.put(item)
+            self._blocked_seconds += time.monotonic() - started
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._poll_interval)
+            except queue.Empty:
+                self._deliver(self._poll)
+                continue
+            batch = [item]
+            # Take everything that queued up while the previous call was in flight
+            while batch[-1] is not _END_OF_STREAM:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for entry in batch:
+                if entry is _END_OF_STREAM:
+                    flush = getattr(self._streamer, "flush", None)
+                    if flush is not None:
+                        self._deliver(flush)
+                    return
+                markdown_text, chunks, kwargs = entry
+                self._deliver(
+                    lambda: self._streamer.append(
+                        markdown_text=markdown_text, chunks=chunks, **kwargs
+                    )
+                )
+
+    def _deliver(self, send):
+        # After a failure the queue is still drained so a blocked producer wakes up
+        # and sees the error on its next append().
+        if self._error is not None:
+            return
+        try:
+            send()
+        except BaseException as e:
+            logger.error(f"Slack stream sender failed: {e}")
+            self._error = e
+
+
+_timings_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+def add_timings_listener(listener: Callable[[Dict[str, Any]], None]):
+    """Call listener with the timings of every provider stream that finishes"""
+    _timings_listeners.append(listener)
+
+
+_untimed: ContextVar[bool] = ContextVar("untimed", default=False)
+
+
+@contextmanager
+def untimed_streams() -> Iterator[None]:
+    """
+    Keep the timings of provider streams run inside out of the timings listeners
+
+    For background calls, such as summaries, that should not move the latency
+    figures the router ranks live requests by. The timings are still logged.
+    """
+    token = _untimed.set(True)
+    try:
+        yield
+    finally:
+        _untimed.reset(token)
+
+
+class StreamTimer:
+    """Records time to first and last token for one provider stream"""
+
+    def __init__(self, provider: str, clock=time.monotonic):
+        self.provider = provider
+        self._clock = clock
+        self.started = clock()
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.deltas = 0
+        self.chars = 0
+
+    def mark(self, text: str):
+        now = self._clock()
+        if self.first_token is None:
+            self.first_token = now
+        self.last_token = now
+        self.deltas += 1
+        self.chars += len(text)
+
+    def report(self) -> Dict[str, Any]:
+        """Log and return the timings in milliseconds since the request started"""
+        timings = {
+            "provider": self.provider,
+            "first_token_ms": self._since_start(self.first_token),
+            "last_token_ms": self._since_start(self.last_token),
+            "deltas": self.deltas,
+            "chars": self.chars,
+        }
+        logger.info(
+            f"{self.provider} stream timings: "
+            f"first_token={_format_ms(timings['first_token_ms'])} "
+            f"last_token={_format_ms(timings['last_token_ms'])} "
+            f"deltas={self.deltas} chars={self.chars}"
+        )
+        if not _untimed.get():
+            for listener in _timings_listeners:
+                listener(timings)
+        return timings
+
+    def _since_start(self, moment: Optional[float]) -> Optional[float]:
+        return None if moment is None else (moment - self.started) * 1000
+
+
+def _format_ms(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.0f}ms"
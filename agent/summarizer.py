@@ -0,0 +1,263 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from openai.types.responses import ResponseInputParam
+
+from agent.deadlines import Deadline
+from agent.failover import CUT_OFF_NOTICE, UNAVAILABLE_MESSAGE
+from agent.health import CLOSED, get_breaker
+from agent.history import get_thread_history
+from agent.formatter import HUGGINGFACE_BANNER
+from agent.providers import Provider
+from agent.router import get_router
+from agent.streaming import TextBuffer, untimed_streams
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = """You keep a running summary of a Slack conversation between a user and a code assistant.
+Update the summary with the new messages. Keep the user's goals, decisions, constraints, names of files, functions and libraries, and any code the later conversation depends on.
+Drop greetings and small talk. Write at most {max_chars} characters, in the language of the conversation, as plain text."""
+
+# Messages the app writes itself; a result containing one is not a summary
+_CANNED_MESSAGES = (UNAVAILABLE_MESSAGE, CUT_OFF_NOTICE.strip())
+
+
+@dataclass(frozen=True)
+class SummarySettings:
+    """
+    Settings for summarizing the older turns of long threads in the background
+
+    Args:
+        enabled: Summarize threads after the app has replied
+        keep_recent: Most recent messages that are always sent as they are
+        min_new: Messages beyond keep_recent that have to pile up before a thread
+          is summarized again
+        thread_interval: Seconds between two summaries of the same thread
+        max_per_minute: Summaries started per minute across all threads
+        max_pending: Threads waiting for a summary; more are skipped
+        max_chars: Length the summary is asked to stay within
+    """
+
+    enabled: bool = False
+    keep_recent: int = 6
+    min_new: int = 6
+    thread_interval: float = 120.0
+    max_per_minute: int = 6
+    max_pending: int = 32
+    max_chars: int = 1500
+
+    @classmethod
+    def from_env(cls) -> "SummarySettings":
+        return cls(
+            enabled=os.getenv("LLM_SUMMARY_ENABLED", "false").lower() == "true",
+            keep_recent=int(os.getenv("LLM_SUMMARY_KEEP_RECENT", cls.keep_recent)),
+            min_new=int(os.getenv("LLM_SUMMARY_MIN_NEW", cls.min_new)),
+            thread_interval=float(
+                os.getenv("LLM_SUMMARY_THREAD_INTERVAL", cls.thread_interval)
+            ),
+            max_per_minute=int(
+                os.getenv("LLM_SUMMARY_MAX_PER_MINUTE", cls.max_per_minute)
+            ),
+            max_pending=int(os.getenv("LLM_SUMMARY_MAX_PENDING", cls.max_pending)),
+            max_chars=int(os.getenv("LLM_SUMMARY_MAX_CHARS", cls.max_chars)),
+        )
+
+
+def _summary_prompts(
+    summary: Optional[str], turns: List[Tuple[Optional[str], str, str]], max_chars: int
+) -> ResponseInputParam:
+    transcript = "\n\n".join(
+        f"{'User' if role == 'user' else 'Assistant'}: {text}"
+        for _, role, text in turns
+    )
+    context = f"Summary so far:\n{summary}\n\n" if summary else ""
+    # The conversation goes in a system message so that a provider looking at the
+    # latest user message (e.g. for dice rolls) only sees the instruction
+    return [
+        {
+            "role": "system",
+            "content": SUMMARY_INSTRUCTIONS.format(max_chars=max_chars),
+        },
+        {"role": "system", "content": f"{context}New messages:\n{transcript}"},
+        {"role": "user", "content": "Write the updated summary."},
+    ]
+
+
+class Summarizer:
+    """
+    Folds the older turns of long threads into a rolling summary per thread
+
+    Jobs run on one background thread after a reply has been sent, so they never
+    delay a response. A thread already waiting for a summary is not queued again,
+    each thread is summarized at most once per thread_interval, and no more than
+    max_per_minute summaries start across all threads, keeping their provider
+    calls well below what live requests make.
+    """
+
+    def __init__(self, settings: SummarySettings, clock=time.monotonic):
+        self.settings = settings
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending: Set[Tuple[str, str]] = set()
+        self._last_run: Dict[Tuple[str, str], float] = {}
+        self._started: Deque[float] = deque()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="summarizer"
+        )
+        self._stats = {
+            "scheduled": 0,
+            "deduplicated": 0,
+            "rate_limited": 0,
+            "dropped": 0,
+            "summaries": 0,
+            "failures": 0,
+            "turns_folded": 0,
+        }
+
+    def schedule(self, channel: str, thread_ts: str) -> bool:
+        """Queue a summary of the thread if it is due; never blocks"""
+        history = get_thread_history()
+        if history is None:
+            return False
+        work = history.summary_input(channel, thread_ts, self.settings.keep_recent)
+        if work is None or len(work[1]) < self.settings.min_new:
+            return False
+        key = (channel, thread_ts)
+        now = self._clock()
+        with self._lock:
+            if key in self._pending:
+                self._stats["deduplicated"] += 1
+                return False
+            if now - self._last_run.get(key, -self.settings.thread_interval) < (
+                self.settings.thread_interval
+            ):
+                self._stats["rate_limited"] += 1
+                return False
+            if len(self._pending) >= self.settings.max_pending:
+                self._stats["dropped"] += 1
+                return False
+            self._pending.add(key)
+            self._stats["scheduled"] += 1
+            if len(self._last_run) > 4 * self.settings.max_pending:
+                self._forget_idle(now)
+        self._executor.submit(self._run, key)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+    def _forget_idle(self, now: float):
+        for key, last_run in list(self._last_run.items()):
+            if now - last_run >= self.settings.thread_interval:
+                del self._last_run[key]
+
+    def _wait_for_slot(self):
+        """Sleep until starting another summary keeps within max_per_minute"""
+        while True:
+            with self._lock:
+                now = self._clock()
+                while self._started and now - self._started[0] >= 60.0:
+                    self._started.popleft()
+                if len(self._started) < self.settings.max_per_minute:
+                    self._started.append(now)
+                    return
+                wait = 60.0 - (now - self._started[0])
+            time.sleep(wait)
+
+    def _run(self, key: Tuple[str, str]):
+        try:
+            self._wait_for_slot()
+            with self._lock:
+                self._last_run[key] = self._clock()
+            self._summarize(*key)
+        except Exception as e:
+            with self._lock:
+                self._stats["failures"] += 1
+            logger.warning(f"Could not summarize thread {key[1]}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def _summarize(self, channel: str, thread_ts: str):
+        history = get_thread_history()
+        if history is None:
+            return
+        # Turns that arrived while the job waited are included
+        work = history.summary_input(channel, thread_ts, self.settings.keep_recent)
+        if work is None:
+            return
+        summary, turns = work
+        prompts = _summary_prompts(summary, turns, self.settings.max_chars)
+        for provider in get_router().rank().providers:
+            text = _try_summary(provider, prompts)
+            if text is None:
+                continue
+            history.apply_summary(channel, thread_ts, text, turns)
+            with self._lock:
+                self._stats["summaries"] += 1
+                self._stats["turns_folded"] += len(turns)
+            logger.info(
+                f"Folded {len(turns)} messages of thread {thread_ts} "
+                f"into a {len(text)} character summary"
+            )
+            return
+        # The turns stay as they are until a later summary succeeds
+        raise RuntimeError("no provider could write the summary")
+
+
+def _try_summary(provider: Provider, prompts: ResponseInputParam) -> Optional[str]:
+    """
+    Ask provider for the summary, None if it can't write one
+
+    Summaries stay out of what live requests depend on: only providers whose
+    circuit is closed are asked, so a half-open circuit's probe is never spent
+    on one, and provider.stream is called rather than provider.run, so neither
+    the breaker nor the router's latency figures see the outcome.
+    """
+    if get_breaker(provider.name).state != CLOSED:
+        return None
+    buffer = TextBuffer()
+    try:
+        with untimed_streams():
+            provider.stream(buffer, prompts, Deadline.start())
+    except Exception as e:
+        logger.info(f"{provider.name} could not summarize: {e}")
+        return None
+    text = buffer.text.removeprefix(HUGGINGFACE_BANNER).strip()
+    if not text or any(message in text for message in _CANNED_MESSAGES):
+        logger.info(f"{provider.name} returned no usable summary")
+        return None
+    return text
+
+
+_summarizer: Optional[Summarizer] = None
+_summarizer_lock = threading.Lock()
+_summarizer_loaded = False
+
+
+def get_summarizer() -> Optional[Summarizer]:
+    """Return the process-wide summarizer, or None if it is disabled"""
+    global _summarizer, _summarizer_loaded
+    if not _summarizer_loaded:
+        with _summarizer_lock:
+            if not _summarizer_loaded:
+                settings = SummarySettings.from_env()
+                _summarizer = Summarizer(settings) if settings.enabled else None
+                _summarizer_loaded = True
+    return _summarizer
+
+
+def schedule_summary(channel: str, thread_ts: str):
+    """Summarize the thread in the background if it has grown long enough"""
+    summarizer = get_summarizer()
+    if summarizer is not None:
+        summarizer.schedule(channel, thread_ts)
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from openai.types.responses import FunctionToolParam
+
+from agent.tools.dice import roll_dice, roll_dice_definition
+
+logger = logging.getLogger(__name__)
+
+# Tools the model may call, by name
+TOOLS: Dict[str, Callable[..., dict]] = {
+    "roll_dice": roll_dice,
+}
+TOOL_DEFINITIONS: List[FunctionToolParam] = [
+    roll_dice_definition,
+]
+
+
+@dataclass(frozen=True)
+class ToolLoopSettings:
+    """
+    Limits for the model/tool round trips of one response
+
+    Args:
+        max_rounds: Model calls allowed per response; the last one may not call
+          tools, so the model has to answer
+        workers: Threads shared by all requests for running tool calls
+        chain_responses: Continue with previous_response_id instead of sending
+          the whole conversation again after each round
+    """
+
+    max_rounds: int = 4
+    workers: int = 4
+    chain_responses: bool = True
+
+    @classmethod
+    def from_env(cls) -> "ToolLoopSettings":
+        return cls(
+            max_rounds=max(int(os.getenv("LLM_TOOL_MAX_ROUNDS", cls.max_rounds)), 1),
+            workers=int(os.getenv("LLM_TOOL_WORKERS", cls.workers)),
+            chain_responses=os.getenv("LLM_TOOL_CHAIN_RESPONSES", "true").lower()
+            == "true",
+        )
+
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor(workers: int) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="tool-worker"
+                )
+    return _executor
+
+
+def run_tool(name: str, arguments: str) -> dict:
+    """Run one tool call, turning bad arguments and tool errors into results"""
+    tool = TOOLS.get(name)
+    if tool is None:
+        return {"error": f"Unknown tool: {name}"}
+    try:
+        return tool(**json.loads(arguments or "{}"))
+    except Exception as e:
+        logger.warning(f"Tool {name} failed: {e}")
+        return {"error": f"{name} failed: {e}"}
+
+
+def run_tool_calls(calls: List[Any], workers: int) -> List[dict]:
+    """
+    Run the function calls of one model round, in parallel when there are several
+
+    Returns the results in the order of calls.
+    """
+    if len(calls) == 1:
+        return [run_tool(calls[0].name, calls[0].arguments)]
+    executor = _get_executor(workers)
+    return list(executor.map(lambda call: run_tool(call.name, call.arguments), calls))
+
+
+class RoundTimings:
+    """Where the time of each model/tool round went, for logging"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.rounds: List[Dict[str, Any]] = []
+
+    def start_round(self):
+        self.rounds.append(
+            {
+                "round": len(self.rounds) + 1,
+                "started": self._clock(),
+                "first_token_ms": None,
+                "model_ms": None,
+                "tool_calls": 0,
+                "tools_ms": 0.0,
+            }
+        )
+
+    def mark_first_token(self):
+        current = self.rounds[-1]
+        if current["first_token_ms"] is None:
+            current["first_token_ms"] = self._elapsed_ms(current["started"])
+
+    def end_model(self, tool_calls: int):
+        current = self.rounds[-1]
+        current["model_ms"] = self._elapsed_ms(current["started"])
+        current["tool_calls"] = tool_calls
+
+    def end_tools(self):
+        current = self.rounds[-1]
+        current["tools_ms"] = self._elapsed_ms(current["started"]) - current["model_ms"]
+
+    def report(self, name: str) -> List[Dict[str, Any]]:
+        summary = "; ".join(
+            f"round {entry['round']}: model {entry['model_ms'] or 0:.0f}ms"
+            + (
+                f" (first token {entry['first_token_ms']:.0f}ms)"
+                if entry["first_token_ms"] is not None
+                else ""
+            )
+            + (
+                f", {entry['tool_calls']} tool calls {entry['tools_ms']:.0f}ms"
+                if entry["tool_calls"]
+                else ""
+            )
+            for entry in self.rounds
+        )
+        logger.info(f"{name} tool loop: {summary}")
+        return [
+            {key: value for key, value in entry.items() if key != "started"}
+            for entry in self.rounds
+        ]
+
+    def _elapsed_ms(self, started: float) -> float:
+        return (self._clock() - started) * 1000
@@ -6,6 +6,8 @@ from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk import WebClient
 
+from agent.local_model import preload_local_model
+from agent.slack_http import install_slack_transport
 from listeners import register_listeners
 
 # Load environment variables
@@ -18,10 +20,16 @@ logging.basicConfig(level=logging.DEBUG)
 agent_logger = logging.getLogger('agent.llm_caller')
 agent_logger.setLevel(logging.DEBUG)
 
+slack_api_url = os.environ.get("SLACK_API_URL", "https://slack.com/api")
+
+# Web API calls (chat.appendStream etc.) are paced under Slack's rate limits and,
+# with SLACK_HTTP_POOL_ENABLED, reuse keep-alive connections to the API
+install_slack_transport(slack_api_url)
+
 app = App(
     token=os.environ.get("SLACK_BOT_TOKEN"),
     client=WebClient(
-        base_url=os.environ.get("SLACK_API_URL", "https://slack.com/api"),
+        base_url=slack_api_url,
         token=os.environ.get("SLACK_BOT_TOKEN"),
     ),
 )
@@ -31,4 +39,6 @@ register_listeners(app)
 
 # Start Bolt app
 if __name__ == "__main__":
+    # Load the local fallback model (LOCAL_MODEL) in the background
+    preload_local_model()
     SocketModeHandler(app, os.environ.get("SLACK_APP_TOKEN")).start()
@@ -0,0 +1,50 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_bolt.async_app import AsyncApp
+from slack_sdk.web.async_client import AsyncWebClient
+
+from agent.clients import aclose_clients
+from agent.local_model import preload_local_model
+from listeners import register_async_listeners
+
+# Load environment variables
+load_dotenv(dotenv_path=".env", override=False)
+
+# Initialization
+logging.basicConfig(level=logging.DEBUG)
+
+# Enable debug logging for our agent module
+agent_logger = logging.getLogger("agent.llm_caller")
+agent_logger.setLevel(logging.DEBUG)
+
+# Same app as app.py, but every listener runs on one asyncio event loop, so an LLM
+# stream waiting on its provider does not hold a thread
+app = AsyncApp(
+    token=os.environ.get("SLACK_BOT_TOKEN"),
+    client=AsyncWebClient(
+        base_url=os.environ.get("SLACK_API_URL", "https://slack.com/api"),
+        token=os.environ.get("SLACK_BOT_TOKEN"),
+    ),
+)
+
+# Register Listeners
+register_async_listeners(app)
+
+
+async def main():
+    # Load the local fallback model (LOCAL_MODEL) in the background
+    preload_local_model()
+    handler = AsyncSocketModeHandler(app, os.environ.get("SLACK_APP_TOKEN"))
+    try:
+        await handler.start_async()
+    finally:
+        await aclose_clients()
+
+
+# Start Bolt app
+if __name__ == "__main__":
+    asyncio.run(main())
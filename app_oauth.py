@@ -4,13 +4,20 @@ import os
 from slack_bolt import App, BoltResponse
 from slack_bolt.oauth.callback_options import CallbackOptions, FailureArgs, SuccessArgs
 from slack_bolt.oauth.oauth_settings import OAuthSettings
+from slack_sdk import WebClient
 from slack_sdk.oauth.installation_store import FileInstallationStore
 from slack_sdk.oauth.state_store import FileOAuthStateStore
 
+from agent.local_model import preload_local_model
+from agent.slack_http import install_slack_transport
 from listeners import register_listeners
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Web API calls of every installation are paced under Slack's rate limits and,
+# with SLACK_HTTP_POOL_ENABLED, reuse keep-alive connections to the API
+install_slack_transport(WebClient.BASE_URL)
+
 
 # Callback to run on successful installation
 def success(args: SuccessArgs) -> BoltResponse:
@@ -54,4 +61,6 @@ register_listeners(app)
 
 # Start Bolt app
 if __name__ == "__main__":
+    # Load the local fallback model (LOCAL_MODEL) in the background
+    preload_local_model()
     app.start(3000)
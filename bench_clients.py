@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-request overhead of building provider clients per call vs. the pooled registry
+
+A local stand-in server plays the OpenAI and Hugging Face router endpoints, so the
+numbers show client construction and connection setup cost without network noise.
+Against the real APIs each new connection also pays a TLS handshake, so the gap
+there is larger.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import openai
+
+from agent import clients
+
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "200"))
+
+CHAT_COMPLETION = {
+    "id": "bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "bench",
+    "choices": [
+        {
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "ok"},
+        }
+    ],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in one segment so keep-alive requests don't stall
+    # on delayed ACKs
+    disable_nagle_algorithm = True
+    wbufsize = 1 << 16
+    connections = set()
+
+    def _reply(self, body: dict):
+        StandInHandler.connections.add(self.client_address)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.wfile.flush()
+
+    def do_GET(self):
+        self._reply({"object": "list", "data": []})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply(CHAT_COMPLETION)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def timed(label: str, call):
+    StandInHandler.connections.clear()
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        call()
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:<40} {elapsed / REQUESTS * 1000:8.3f} ms/request"
+        f"  ({len(StandInHandler.connections)} connections)"
+    )
+
+
+def bench_clients():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    print(f"Benchmarking {REQUESTS} requests against {base_url}\n")
+
+    def openai_per_request():
+        client = openai.OpenAI(api_key="bench", base_url=base_url)
+        client.models.list()
+        client.close()
+
+    def openai_pooled():
+        clients.get_openai_client(api_key="bench", base_url=base_url).models.list()
+
+    timed("OpenAI: new client per request", openai_per_request)
+    timed("OpenAI: pooled registry client", openai_pooled)
+
+    try:
+        from huggingface_hub import InferenceClient
+        from huggingface_hub.utils import reset_sessions
+    except ImportError:
+        print("huggingface_hub not installed, skipping Hugging Face benchmark")
+        return
+
+    messages = [{"role": "user", "content": "hi"}]
+
+    def huggingface_per_request():
+        reset_sessions()
+        client = InferenceClient(token="bench", base_url=base_url)
+        client.chat_completion(model="bench", messages=messages, max_tokens=1)
+
+    def huggingface_pooled():
+        client = clients.get_huggingface_client(api_key="bench", base_url=base_url)
+        client.chat_completion(model="bench", messages=messages, max_tokens=1)
+
+    timed("Hugging Face: new client per request", huggingface_per_request)
+    timed("Hugging Face: pooled registry client", huggingface_pooled)
+
+    clients.close_clients()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    bench_clients()
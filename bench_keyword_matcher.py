@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark the keyword matcher on pasted inputs of 50KB and more
+
+Compares KeywordMatcher (one combined regex of every keyword, a single pass
+over the text) with one precompiled search per keyword and with the plain
+`keyword in text` scans the contextual fallback used to make, on English prose,
+code and Japanese text.
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+import numpy as np
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from agent.keywords import TOPIC_KEYWORDS, KeywordMatcher, _keyword_pattern
+
+SIZES_KB = [int(size) for size in os.getenv("BENCH_SIZES_KB", "50,200").split(",")]
+RUNS = int(os.getenv("BENCH_RUNS", "20"))
+
+PROSE_WORDS = (
+    "the quick brown fox jumps over a lazy dog while the team reviews "
+    "every value result total index count item data list map"
+).split()
+JAPANESE_WORDS = (
+    "今日 は 天気 が 良い ので 散歩 に 行き ます 明日 も 晴れ る でしょう".split()
+)
+CODE_LINE = (
+    "def compute_{i}(data, index):\n"
+    "    result = data[index] * {i}  # scale the value\n"
+    "    return result\n"
+)
+
+
+def make_inputs(size: int, rng: random.Random):
+    prose = []
+    while sum(len(word) + 1 for word in prose) < size:
+        prose.append(rng.choice(PROSE_WORDS))
+    japanese = []
+    while sum(len(word) for word in japanese) * 3 < size:
+        japanese.append(rng.choice(JAPANESE_WORDS))
+    code = []
+    while sum(len(line) for line in code) < size:
+        code.append(CODE_LINE.format(i=len(code)))
+    # The question comes after the paste, as it usually does
+    return {
+        "prose": " ".join(prose) + " how do I fix this python error?",
+        "code": "".join(code) + "\nwhy is this function slow?",
+        "japanese": "".join(japanese) + "このコードのエラーについて教えて",
+    }
+
+
+def keyword_searches(table):
+    keywords = {keyword.lower() for words in table.values() for keyword in words}
+    patterns = {keyword: re.compile(_keyword_pattern(keyword)) for keyword in keywords}
+
+    def match(text):
+        text = text.lower()
+        return {
+            intent
+            for intent, words in table.items()
+            if any(patterns[keyword.lower()].search(text) for keyword in words)
+        }
+
+    return match
+
+
+def substring_scans(table):
+    def match(text):
+        text = text.lower()
+        return {
+            intent
+            for intent, words in table.items()
+            if any(keyword in text for keyword in words)
+        }
+
+    return match
+
+
+def time_ms(match, text) -> float:
+    samples = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        match(text)
+        samples.append(time.perf_counter() - started)
+    return float(np.median(samples)) * 1000
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    matchers = {
+        "KeywordMatcher": KeywordMatcher(TOPIC_KEYWORDS).match,
+        "keyword searches": keyword_searches(TOPIC_KEYWORDS),
+        "substring scans": substring_scans(TOPIC_KEYWORDS),
+    }
+    print(f"Median of {RUNS} runs, {len(TOPIC_KEYWORDS)} topics\n")
+    for size_kb in SIZES_KB:
+        for kind, text in make_inputs(size_kb * 1000, rng).items():
+            size_mb = len(text.encode("utf-8")) / 1e6
+            results = []
+            for name, match in matchers.items():
+                ms = time_ms(match, text)
+                results.append(f"{name} {ms:6.2f} ms ({size_mb / ms * 1000:6.1f} MB/s)")
+            print(f"{size_kb:>4}KB {kind:>8}: " + "  | ".join(results))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark local CPU inference at 1, 4 and 16 concurrent requests
+
+Each level runs once with batching turned off (max batch size 1, so requests
+are generated one after another) and once with dynamic batching, and reports
+total generated tokens per second, time to first text and request latency.
+The model is LOCAL_MODEL, or the default small instruct model.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from agent.local_model import DEFAULT_LOCAL_MODEL, LocalModel, LocalModelSettings
+
+MODEL = os.getenv("LOCAL_MODEL") or DEFAULT_LOCAL_MODEL
+CONCURRENCY = [int(n) for n in os.getenv("BENCH_CONCURRENCY", "1,4,16").split(",")]
+MAX_NEW_TOKENS = int(os.getenv("BENCH_MAX_NEW_TOKENS", "64"))
+MAX_BATCH_SIZE = int(os.getenv("BENCH_MAX_BATCH_SIZE", "16"))
+QUESTIONS = [
+    "How do I reverse a list in Python?",
+    "Pythonでリストを逆順にするには？",
+    "What is the difference between a process and a thread?",
+    "Explain what a Python decorator does in two sentences.",
+]
+
+
+def run(model: LocalModel, concurrency: int):
+    first_text = []
+    latencies = []
+    lock = threading.Lock()
+
+    def request(i: int):
+        messages = [{"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]}]
+        started = time.perf_counter()
+        first = None
+        for _ in model.stream(messages, max_new_tokens=MAX_NEW_TOKENS):
+            if first is None:
+                first = time.perf_counter() - started
+        with lock:
+            first_text.append(first or 0.0)
+            latencies.append(time.perf_counter() - started)
+
+    tokens_before = model.stats()["tokens"]
+    started = time.perf_counter()
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    tokens = model.stats()["tokens"] - tokens_before
+    return tokens / elapsed, first_text, latencies
+
+
+def percentile_ms(samples, pct: float) -> float:
+    return float(np.percentile(samples, pct)) * 1000
+
+
+if __name__ == "__main__":
+    try:
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+    except ImportError:
+        print("transformers and torch are not installed, nothing to benchmark")
+        sys.exit(0)
+
+    print(f"Benchmarking {MODEL}, {MAX_NEW_TOKENS} new tokens per request\n")
+    for max_batch_size in (1, MAX_BATCH_SIZE):
+        model = LocalModel(
+            LocalModelSettings(
+                model=MODEL,
+                max_batch_size=max_batch_size,
+                max_new_tokens=MAX_NEW_TOKENS,
+                temperature=0.0,
+            )
+        )
+        if not model.wait_ready():
+            print(f"Could not load {MODEL}: {model.status()['error']}")
+            sys.exit(1)
+        label = "no batching" if max_batch_size == 1 else f"batch <= {max_batch_size}"
+        for concurrency in CONCURRENCY:
+            tokens_per_second, first_text, latencies = run(model, concurrency)
+            print(
+                f"{label:>12}, {concurrency:>2} concurrent: "
+                f"{tokens_per_second:7.1f} tokens/s"
+                f"  | first text p50 {percentile_ms(first_text, 50):7.0f} ms"
+                f"  | latency p50 {percentile_ms(latencies, 50):7.0f} ms"
+                f"  p99 {percentile_ms(latencies, 99):7.0f} ms"
+            )
+        print(f"{label:>12}: mean batch size {model.stats()['mean_batch_size']:.1f}\n")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark semantic cache lookups at 10k and 100k entries
+
+The index is filled with random unit vectors of the embedding model's size, so
+the numbers are the cost of the similarity search itself. If transformers is
+installed, the time to embed a question with the local model is measured too,
+since every lookup pays for that first.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from agent.semantic_cache import Embedder, SemanticCacheSettings, VectorIndex
+
+DIM = int(os.getenv("BENCH_DIM", "384"))
+SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "10000,100000").split(",")]
+LOOKUPS = int(os.getenv("BENCH_LOOKUPS", "200"))
+SCOPES = ["openai:gpt-4o-mini:bench", "groq:llama-3.3-70b-versatile:bench"]
+
+
+def unit_vectors(count: int, rng: np.random.Generator) -> np.ndarray:
+    vectors = rng.standard_normal((count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile_ms(samples, pct: float) -> float:
+    return float(np.percentile(samples, pct)) * 1000
+
+
+def bench_index(size: int, rng: np.random.Generator):
+    index = VectorIndex(DIM, size)
+    vectors = unit_vectors(size, rng)
+    started = time.perf_counter()
+    for i, vector in enumerate(vectors):
+        index.add(vector, SCOPES[i % len(SCOPES)], f"response {i}")
+    fill_seconds = time.perf_counter() - started
+
+    queries = unit_vectors(LOOKUPS, rng)
+    # Half of the queries are slightly perturbed copies of stored questions
+    targets = rng.integers(0, size, LOOKUPS // 2)
+    near = vectors[targets] + 0.01 * unit_vectors(len(targets), rng)
+    queries[: len(targets)] = near / np.linalg.norm(near, axis=1, keepdims=True)
+
+    samples = []
+    hits = 0
+    for query in queries:
+        started = time.perf_counter()
+        match = index.search(query, SCOPES, threshold=0.92)
+        samples.append(time.perf_counter() - started)
+        hits += match is not None
+
+    evict_started = time.perf_counter()
+    for vector in unit_vectors(100, rng):
+        index.add(vector, SCOPES[0], "replacement")
+    evict_ms = (time.perf_counter() - evict_started) / 100 * 1000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.npz")
+        started = time.perf_counter()
+        index.save(path)
+        save_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        VectorIndex.load(path, DIM, size)
+        load_ms = (time.perf_counter() - started) * 1000
+        file_mb = os.path.getsize(path) / 1e6
+
+    print(
+        f"{size:>7} entries: lookup p50 {percentile_ms(samples, 50):7.3f} ms"
+        f"  p99 {percentile_ms(samples, 99):7.3f} ms"
+        f"  hits {hits}/{LOOKUPS}"
+        f"  | add when full {evict_ms:6.3f} ms"
+        f"  | fill {fill_seconds:5.2f} s"
+        f"  | save {save_ms:6.0f} ms, load {load_ms:6.0f} ms, {file_mb:6.1f} MB"
+    )
+
+
+def bench_embedding():
+    try:
+        import transformers  # noqa: F401
+    except ImportError:
+        print("\ntransformers not installed, skipping embedding benchmark")
+        return
+    embedder = Embedder(SemanticCacheSettings().model)
+    embedder.start_loading()
+    while not embedder.ready:
+        time.sleep(0.1)
+    questions = [
+        "How do I reverse a list in Python?",
+        "Pythonでリストを逆順にするには？",
+        "What is the difference between a process and a thread?",
+    ]
+    embedder.encode(questions[0])
+    samples = []
+    for _ in range(20):
+        for question in questions:
+            started = time.perf_counter()
+            embedder.encode(question)
+            samples.append(time.perf_counter() - started)
+    print(
+        f"\nEmbedding with {embedder.model_name}: "
+        f"p50 {percentile_ms(samples, 50):.1f} ms  p99 {percentile_ms(samples, 99):.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    print(f"Benchmarking {LOOKUPS} lookups on {DIM}-dimensional vectors\n")
+    rng = np.random.default_rng(0)
+    for size in SIZES:
+        bench_index(size, rng)
+    bench_embedding()
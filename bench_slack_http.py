@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark Slack Web API call latency with and without pooled keep-alive connections
+
+A local stand-in server plays the Slack API (pointed at through SLACK_API_URL,
+as the app would be), and a WebClient makes the calls a streamed answer makes.
+Without the pooled transport every call opens a new connection. With
+BENCH_TLS=true (needs the openssl command) the stand-in serves HTTPS with a
+throwaway certificate, so each new connection also pays a TLS handshake as it
+does against the real API.
+"""
+
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from slack_sdk import WebClient
+
+# Add the project directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from agent.slack_http import SlackHttpSettings, install_slack_transport
+
+CALLS = int(os.getenv("BENCH_CALLS", "300"))
+THREADS = int(os.getenv("BENCH_THREADS", "4"))
+TLS = os.getenv("BENCH_TLS", "false").lower() == "true"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in one segment so keep-alive requests don't stall
+    # on delayed ACKs
+    disable_nagle_algorithm = True
+    wbufsize = 1 << 16
+    connections = set()
+
+    def do_POST(self):
+        StandInHandler.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        payload = json.dumps({"ok": True, "ts": "1.0"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def timed(label: str, base_url: str):
+    StandInHandler.connections.clear()
+    samples = []
+    lock = threading.Lock()
+
+    def worker():
+        # Bolt builds a WebClient per request, so do the same
+        client = WebClient(token="xoxb-bench", base_url=base_url)
+        for _ in range(CALLS // THREADS):
+            started = time.perf_counter()
+            client.chat_appendStream(channel="C1", ts="1.0", markdown_text="chunk")
+            with lock:
+                samples.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    print(
+        f"{label:<24} p50 {np.percentile(samples, 50) * 1000:7.3f} ms"
+        f"  p99 {np.percentile(samples, 99) * 1000:7.3f} ms"
+        f"  | {len(samples) / elapsed:7.0f} calls/s"
+        f"  ({len(StandInHandler.connections)} connections)"
+    )
+
+
+def serve_tls(server: ThreadingHTTPServer, directory: str):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1"]
+        + ["-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True,
+        capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    # Clients trust the throwaway certificate through the default context
+    os.environ["SSL_CERT_FILE"] = cert
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    if TLS:
+        serve_tls(server, tempfile.mkdtemp())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheme = "https" if TLS else "http"
+    base_url = f"{scheme}://127.0.0.1:{server.server_port}/api/"
+    print(f"Benchmarking {CALLS} calls on {THREADS} threads against {base_url}\n")
+
+    # Without the rate limits, which would time waits for tokens instead of calls
+    install_slack_transport(
+        base_url, SlackHttpSettings(enabled=False), rate_limit=False
+    )
+    timed("new connection per call", base_url)
+    install_slack_transport(base_url, SlackHttpSettings(enabled=True), rate_limit=False)
+    timed("pooled keep-alive", base_url)
+    server.shutdown()
@@ -1,9 +1,20 @@
+from typing import TYPE_CHECKING
+
 from slack_bolt import App
 
 from listeners import actions, assistant, events
 
+if TYPE_CHECKING:
+    from slack_bolt.async_app import AsyncApp
+
 
 def register_listeners(app: App):
     actions.register(app)
     assistant.register(app)
     events.register(app)
+
+
+def register_async_listeners(app: "AsyncApp"):
+    actions.register_async(app)
+    assistant.register_async(app)
+    events.register_async(app)
@@ -1,7 +1,19 @@
+from typing import TYPE_CHECKING
+
 from slack_bolt import App
 
 from .actions import handle_feedback
 
+if TYPE_CHECKING:
+    from slack_bolt.async_app import AsyncApp
+
 
 def register(app: App):
     app.action("feedback")(handle_feedback)
+
+
+def register_async(app: "AsyncApp"):
+    # Imported here so that the sync app runs without aiohttp installed
+    from .async_actions import async_handle_feedback
+
+    app.action("feedback")(async_handle_feedback)
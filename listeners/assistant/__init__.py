@@ -1,8 +1,13 @@
+from typing import TYPE_CHECKING
+
 from slack_bolt import App, Assistant
 
 from .assistant_thread_started import assistant_thread_started
 from .message import message
 
+if TYPE_CHECKING:
+    from slack_bolt.async_app import AsyncApp
+
 
 # Refer to https://docs.slack.dev/tools/bolt-python/concepts/ai-apps#assistant for more details on the Assistant class
 def register(app: App):
@@ -12,3 +17,18 @@ def register(app: App):
     assistant.user_message(message)
 
     app.assistant(assistant)
+
+
+def register_async(app: "AsyncApp"):
+    # Imported here so that the sync app runs without aiohttp installed
+    from slack_bolt.async_app import AsyncAssistant
+
+    from .async_assistant_thread_started import async_assistant_thread_started
+    from .async_message import async_message
+
+    assistant = AsyncAssistant()
+
+    assistant.thread_started(async_assistant_thread_started)
+    assistant.user_message(async_message)
+
+    app.assistant(assistant)
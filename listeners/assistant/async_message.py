@@ -0,0 +1,187 @@
+import asyncio
+from logging import Logger
+
+from slack_bolt.async_app import AsyncBoltContext, AsyncSay, AsyncSetStatus
+from slack_sdk.models.messages.chunk import (
+    MarkdownTextChunk,
+    PlanUpdateChunk,
+    TaskUpdateChunk,
+)
+from slack_sdk.web.async_client import AsyncWebClient
+
+from agent.async_llm_caller import call_llm
+from agent.cache import AsyncRecordingStreamer
+from agent.deadlines import Deadline
+from agent.history import athread_prompts, record_reply
+from agent.summarizer import schedule_summary
+from listeners.views.feedback_block import create_feedback_block
+
+
+async def async_message(
+    client: AsyncWebClient,
+    context: AsyncBoltContext,
+    logger: Logger,
+    message: dict,
+    payload: dict,
+    say: AsyncSay,
+    set_status: AsyncSetStatus,
+):
+    """
+    Async version of message() for the AsyncApp. Handles when users send messages or select a prompt in an assistant thread and generate AI responses:
+
+    Args:
+        client: Slack AsyncWebClient for making API calls
+        context: Bolt context containing channel and thread information
+        logger: Logger instance for error tracking
+        payload: Event payload with message details (channel, user, text, etc.)
+        say: Function to send messages to the thread
+        set_status: Function to update the assistant's status
+    """
+    # The time budget for the answer starts when the event arrives
+    deadline = Deadline.start()
+    try:
+        logger.info(f"DEBUG: Message received - message: {message}, payload: {payload}")
+        logger.info(
+            f"DEBUG: Context - team_id: {context.team_id}, user_id: {context.user_id}"
+        )
+
+        # Type validation for required fields
+        channel_id = payload.get("channel")
+        thread_ts = payload.get("thread_ts")
+        team_id = context.team_id
+        user_id = context.user_id
+
+        if not channel_id or not thread_ts or not team_id or not user_id:
+            logger.error(
+                f"Missing required fields: channel_id={channel_id}, thread_ts={thread_ts}, team_id={team_id}, user_id={user_id}"
+            )
+            await say(
+                ":warning: 必要な情報が不足しているため、リクエストを処理できませんでした。"
+            )
+            return
+
+        # The first example shows a message with thinking steps that has different
+        # chunks to construct and update a plan alongside text outputs.
+        if message["text"] == "Wonder a few deep thoughts.":
+            await set_status(
+                status="考え中...",
+                loading_messages=[
+                    "ハムスターのタイピング速度を向上させています…",
+                    "インターネットケーブルを整理中…",
+                    "オフィスの金魚に相談しています…",
+                    "あなた専用のレスポンスを磨いています…",
+                    "AIの考えすぎを止めようとしています…",
+                ],
+            )
+
+            await asyncio.sleep(4)
+
+            streamer = await client.chat_stream(
+                channel=channel_id,
+                recipient_team_id=team_id,
+                recipient_user_id=user_id,
+                thread_ts=thread_ts,
+                task_display_mode="plan",
+            )
+            await streamer.append(
+                chunks=[
+                    MarkdownTextChunk(
+                        text="こんにちは。\nタスクを受け取りました。",
+                    ),
+                    MarkdownTextChunk(
+                        text="このタスクは管理可能に見えます。\nそれは良いことです。",
+                    ),
+                    TaskUpdateChunk(
+                        id="001",
+                        title="タスクを理解中...",
+                        status="in_progress",
+                        details="- 目標の特定\n- 制約の特定",
+                    ),
+                    TaskUpdateChunk(
+                        id="002",
+                        title="アクロバットの実行中...",
+                        status="pending",
+                    ),
+                ],
+            )
+            await asyncio.sleep(4)
+
+            await streamer.append(
+                chunks=[
+                    PlanUpdateChunk(
+                        title="最後の仕上げを追加中...",
+                    ),
+                    TaskUpdateChunk(
+                        id="001",
+                        title="タスクを理解中...",
+                        status="complete",
+                        details="\n- これは明らかだったふりをしています",
+                        output="今度はとりとめのない話を続けます",
+                    ),
+                    TaskUpdateChunk(
+                        id="002",
+                        title="アクロバットの実行中...",
+                        status="in_progress",
+                    ),
+                ],
+            )
+            await asyncio.sleep(4)
+
+            feedback_block = create_feedback_block()
+            await streamer.stop(
+                chunks=[
+                    PlanUpdateChunk(
+                        title="ショーをすることにしました",
+                    ),
+                    TaskUpdateChunk(
+                        id="002",
+                        title="アクロバットの実行中...",
+                        status="complete",
+                        details="- ロープの上にジャンプ\n- ボウリングのピンをジャグリング\n- 一輪車にも乗りました",
+                    ),
+                    MarkdownTextChunk(
+                        text="観客は驚いて拍手しているようです :popcorn:"
+                    ),
+                ],
+                blocks=feedback_block,
+            )
+
+        # This second example shows a generated text response for a provided prompt
+        # displayed as a timeline.
+        else:
+            await set_status(
+                status="考え中...",
+                loading_messages=[
+                    "ハムスターのタイピング速度を向上させています…",
+                    "インターネットケーブルを整理中…",
+                    "オフィスの金魚に相談しています…",
+                    "あなた専用のレスポンスを磨いています…",
+                    "AIの考えすぎを止めようとしています…",
+                ],
+            )
+
+            streamer = await client.chat_stream(
+                channel=channel_id,
+                recipient_team_id=team_id,
+                recipient_user_id=user_id,
+                thread_ts=thread_ts,
+                task_display_mode="timeline",
+            )
+            # Earlier messages in the thread are sent along as context
+            prompts = await athread_prompts(
+                client, channel_id, thread_ts, message.get("ts"), message["text"]
+            )
+            reply = AsyncRecordingStreamer(streamer)
+            await call_llm(reply, prompts, deadline)
+
+            feedback_block = create_feedback_block()
+            response = await streamer.stop(
+                blocks=feedback_block,
+            )
+            record_reply(channel_id, thread_ts, response.get("ts"), reply.text)
+            # Long threads get their older turns summarized off the request path
+            schedule_summary(channel_id, thread_ts)
+
+    except Exception as e:
+        logger.exception(f"Failed to handle a user message event: {e}")
+        await say(f":warning: エラーが発生しました！({e})")
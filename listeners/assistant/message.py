@@ -1,7 +1,6 @@
 import time
 from logging import Logger
 
-from openai.types.responses import ResponseInputParam
 from slack_bolt import BoltContext, Say, SetStatus
 from slack_sdk import WebClient
 from slack_sdk.models.messages.chunk import (
@@ -10,7 +9,11 @@ from slack_sdk.models.messages.chunk import (
     TaskUpdateChunk,
 )
 
+from agent.cache import RecordingStreamer
+from agent.deadlines import Deadline
+from agent.history import record_reply, thread_prompts
 from agent.llm_caller import call_llm
+from agent.summarizer import schedule_summary
 from listeners.views.feedback_block import create_feedback_block
 
 
@@ -34,6 +37,8 @@ def message(
         say: Function to send messages to the thread
         set_status: Function to update the assistant's status
     """
+    # The time budget for the answer starts when the event arrives
+    deadline = Deadline.start()
     try:
         logger.info(f"DEBUG: Message received - message: {message}, payload: {payload}")
         logger.info(
@@ -162,18 +167,20 @@ def message(
                 thread_ts=thread_ts,
                 task_display_mode="timeline",
             )
-            prompts: ResponseInputParam = [
-                {
-                    "role": "user",
-                    "content": message["text"],
-                },
-            ]
-            call_llm(streamer, prompts)
+            # Earlier messages in the thread are sent along as context
+            prompts = thread_prompts(
+                client, channel_id, thread_ts, message.get("ts"), message["text"]
+            )
+            reply = RecordingStreamer(streamer)
+            call_llm(reply, prompts, deadline)
 
             feedback_block = create_feedback_block()
-            streamer.stop(
+            response = streamer.stop(
                 blocks=feedback_block,
             )
+            record_reply(channel_id, thread_ts, response.get("ts"), reply.text)
+            # Long threads get their older turns summarized off the request path
+            schedule_summary(channel_id, thread_ts)
 
     except Exception as e:
         logger.exception(f"Failed to handle a user message event: {e}")
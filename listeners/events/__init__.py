@@ -1,7 +1,19 @@
+from typing import TYPE_CHECKING
+
 from slack_bolt import App
 
 from .app_mentioned import app_mentioned_callback
 
+if TYPE_CHECKING:
+    from slack_bolt.async_app import AsyncApp
+
 
 def register(app: App):
     app.event("app_mention")(app_mentioned_callback)
+
+
+def register_async(app: "AsyncApp"):
+    # Imported here so that the sync app runs without aiohttp installed
+    from .async_app_mentioned import async_app_mentioned_callback
+
+    app.event("app_mention")(async_app_mentioned_callback)
@@ -1,10 +1,12 @@
 from logging import Logger
 from typing import Any, Dict
 
-from openai.types.responses import ResponseInputParam
 from slack_bolt import Say
 from slack_sdk import WebClient
 
+from agent.cache import RecordingStreamer
+from agent.deadlines import Deadline
+from agent.history import record_reply, thread_prompts
 from agent.llm_caller import call_llm
 from listeners.views.feedback_block import create_feedback_block
 
@@ -22,6 +24,8 @@ def app_mentioned_callback(
         logger: Logger instance for error tracking
         say: Function to send messages to the thread from the app
     """
+    # The time budget for the answer starts when the event arrives
+    deadline = Deadline.start()
     try:
         logger.info(f"DEBUG: App mentioned event received - event: {event}")
         channel_id = event.get("channel")
@@ -85,19 +89,24 @@ def app_mentioned_callback(
             recipient_user_id=user_id_str,
             thread_ts=thread_ts_str,
         )
-        prompts: ResponseInputParam = [
-            {
-                "role": "user",
-                "content": text,
-            },
-        ]
-        call_llm(streamer, prompts)
+        # A mention outside a thread starts one, so there is no history to read
+        prompts = thread_prompts(
+            client,
+            channel_id_str,
+            thread_ts_str,
+            event.get("ts"),
+            text,
+            new_thread=not event.get("thread_ts"),
+        )
+        reply = RecordingStreamer(streamer)
+        call_llm(reply, prompts, deadline)
 
         try:
             feedback_block = create_feedback_block()
-            streamer.stop(
+            response = streamer.stop(
                 blocks=feedback_block,
             )
+            record_reply(channel_id_str, thread_ts_str, response.get("ts"), reply.text)
         except Exception as e:
             logger.exception(f"Failed to handle a user message event: {e}")
             say(f":warning: Something went wrong! ({e})")
@@ -0,0 +1,11 @@
+import pytest
+
+from agent import health
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers():
+    # Circuit breakers are process-wide; every test starts with closed ones
+    health._breakers.clear()
+    yield
+    health._breakers.clear()
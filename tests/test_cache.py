@@ -0,0 +1,111 @@
+import pytest
+
+from agent import cache, llm_caller, providers
+from agent.cache import ResponseCache
+from agent.deadlines import Deadline
+from agent.health import get_breaker
+from agent.providers import Provider
+from agent.router import PRIORITY, Router, RoutingPolicy
+from agent.streaming import TextBuffer
+
+PROMPTS = [{"role": "user", "content": "How do I reverse a list in Python?"}]
+ANSWER = "Use `items[::-1]` or `items.reverse()`."
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    """An in-memory response cache, with the on-disk and semantic ones off"""
+    response_cache = ResponseCache()
+    monkeypatch.setattr(cache, "_cache", response_cache)
+    monkeypatch.setattr(cache, "_cache_loaded", True)
+    monkeypatch.setattr(cache, "get_response_store", lambda: None)
+    monkeypatch.setattr(cache, "get_semantic_cache", lambda: None)
+    return response_cache
+
+
+@pytest.fixture
+def huggingface_then_answer(monkeypatch):
+    """Hugging Face first with an empty stream, then a provider that answers"""
+    monkeypatch.setattr(providers, "_providers", {})
+    monkeypatch.setattr(
+        "agent.router._router", Router(RoutingPolicy(mode=PRIORITY, order=()))
+    )
+    monkeypatch.setattr(
+        llm_caller, "_stream_huggingface_chat_completion", lambda *args: False
+    )
+    for name in ("huggingface", "other"):
+        monkeypatch.setenv(f"{name.upper()}_API_KEY", "test-key")
+    providers.register_provider(
+        Provider(
+            name="huggingface",
+            default_model="model",
+            api_key_env="HUGGINGFACE_API_KEY",
+            stream=llm_caller._call_huggingface_fallback,
+        )
+    )
+    providers.register_provider(
+        Provider(
+            name="other",
+            default_model="model",
+            api_key_env="OTHER_API_KEY",
+            stream=lambda streamer, prompts, deadline: streamer.append(
+                markdown_text=ANSWER
+            ),
+        )
+    )
+
+
+def test_empty_huggingface_stream_is_a_failure(monkeypatch):
+    monkeypatch.setattr(
+        llm_caller, "_stream_huggingface_chat_completion", lambda *args: False
+    )
+    streamer = TextBuffer()
+
+    with pytest.raises(RuntimeError):
+        llm_caller._call_huggingface_fallback(streamer, PROMPTS, Deadline.start())
+    assert streamer.text == ""
+
+
+def test_error_text_is_not_cached(response_cache, huggingface_then_answer):
+    streamer = TextBuffer()
+
+    llm_caller._call_llm_with_fallback(streamer, PROMPTS, Deadline.start())
+
+    assert streamer.text == ANSWER
+    assert get_breaker("huggingface").snapshot()["errors"] == 1
+    stats = response_cache.stats()
+    assert stats["stores"] == 1
+    hit = response_cache.lookup(PROMPTS, providers.get_providers())
+    assert hit is not None and hit[0].name == "other" and hit[1] == ANSWER
+
+
+def test_cached_answer_is_replayed(response_cache, huggingface_then_answer):
+    llm_caller._call_llm_with_fallback(TextBuffer(), PROMPTS, Deadline.start())
+    streamer = TextBuffer()
+
+    llm_caller._call_llm_with_fallback(streamer, PROMPTS, Deadline.start())
+
+    assert streamer.text == ANSWER
+    assert response_cache.stats()["hits"] == 1
+
+
+def test_lru_evicts_least_recently_used():
+    response_cache = ResponseCache(cache.CacheSettings(max_entries=2))
+    response_cache.put("a", "1")
+    response_cache.put("b", "2")
+    response_cache.get("a")
+    response_cache.put("c", "3")
+
+    assert response_cache.get("b") is None
+    assert response_cache.get("a") == "1"
+    assert response_cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl():
+    now = [0.0]
+    response_cache = ResponseCache(cache.CacheSettings(ttl=10), clock=lambda: now[0])
+    response_cache.put("a", "1")
+    now[0] = 10.0
+
+    assert response_cache.get("a") is None
+    assert response_cache.stats()["expirations"] == 1
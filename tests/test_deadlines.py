@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from agent.deadlines import Deadline, DeadlineExceeded, DeadlineSettings
+
+SETTINGS = DeadlineSettings(first_token=0.2, stall=0.2, total=5.0)
+
+
+async def deltas(gaps):
+    for gap in gaps:
+        await asyncio.sleep(gap)
+        yield "token"
+
+
+async def read_all(watch, events):
+    read = []
+    while True:
+        try:
+            read.append(await watch.next_event(events))
+        except StopAsyncIteration:
+            return read
+        watch.tick()
+
+
+def test_streams_longer_than_the_read_timeout_finish():
+    watch = Deadline.start(SETTINGS).watch("huggingface")
+
+    # 0.5s in total, but never more than 0.05s between two deltas
+    read = asyncio.run(read_all(watch, deltas([0.05] * 10)))
+
+    assert len(read) == 10
+
+
+def test_a_stalled_stream_is_cut_off():
+    watch = Deadline.start(SETTINGS).watch("huggingface")
+
+    with pytest.raises(DeadlineExceeded, match="stalled"):
+        asyncio.run(read_all(watch, deltas([0.01, 1.0])))
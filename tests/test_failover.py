@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from agent import async_llm_caller, health, llm_caller, providers
+from agent.deadlines import Deadline, DeadlineSettings
+from agent.failover import CUT_OFF_NOTICE, Failover
+from agent.health import HALF_OPEN, BreakerSettings, CircuitBreaker, get_breaker
+from agent.providers import Provider
+from agent.router import PRIORITY, RouteDecision, Router, RoutingPolicy
+from agent.streaming import AsyncTextBuffer, TextBuffer
+
+PROMPTS = [{"role": "user", "content": "Why does my loop never end?"}]
+
+
+@pytest.fixture
+def register(monkeypatch):
+    """Replace the registered providers with the ones a test registers"""
+    monkeypatch.setattr(providers, "_providers", {})
+    # Registration order, whatever earlier tests taught the process-wide router
+    monkeypatch.setattr(
+        "agent.router._router", Router(RoutingPolicy(mode=PRIORITY, order=()))
+    )
+
+    def register(name: str, stream):
+        monkeypatch.setenv(f"{name.upper()}_API_KEY", "test-key")
+        providers.register_provider(
+            Provider(
+                name=name,
+                default_model="model",
+                api_key_env=f"{name.upper()}_API_KEY",
+                stream=stream,
+            )
+        )
+
+    return register
+
+
+def fails(streamer, prompts, deadline):
+    raise RuntimeError("connection reset")
+
+
+def answers(streamer, prompts, deadline):
+    streamer.append(markdown_text="The condition never becomes false.")
+
+
+def fails_midway(streamer, prompts, deadline):
+    streamer.append(markdown_text="Your loop ")
+    raise TimeoutError("stalled")
+
+
+def test_fails_over_when_nothing_was_shown(register):
+    register("first", fails)
+    register("second", answers)
+    streamer = TextBuffer()
+
+    llm_caller._call_llm_with_fallback(streamer, PROMPTS, Deadline.start())
+
+    assert streamer.text == "The condition never becomes false."
+    assert get_breaker("first").snapshot()["errors"] == 1
+
+
+def test_does_not_fail_over_after_partial_output(register):
+    calls = []
+    register("first", fails_midway)
+    register("second", lambda *args: calls.append(args))
+    streamer = TextBuffer()
+
+    llm_caller._call_llm_with_fallback(streamer, PROMPTS, Deadline.start())
+
+    assert streamer.text == "Your loop " + CUT_OFF_NOTICE
+    assert calls == []
+    assert get_breaker("first").snapshot()["errors"] == 1
+
+
+def test_async_does_not_fail_over_after_partial_output(register):
+    calls = []
+    register("first", fails_midway)
+    register("second", lambda *args: calls.append(args))
+    streamer = AsyncTextBuffer()
+
+    asyncio.run(
+        async_llm_caller._call_llm_with_fallback(streamer, PROMPTS, Deadline.start())
+    )
+
+    assert streamer.text == "Your loop " + CUT_OFF_NOTICE
+    assert calls == []
+
+
+def test_expired_deadline_leaves_the_probe_slot_free(monkeypatch):
+    now = [0.0]
+    recovering = CircuitBreaker("recovering", BreakerSettings(), lambda: now[0])
+    for _ in range(5):
+        recovering.record_failure()
+    now[0] = 60.0
+    assert recovering.state == HALF_OPEN
+    monkeypatch.setitem(health._breakers, "recovering", recovering)
+    provider = Provider(
+        name="recovering", default_model="model", api_key_env="UNUSED", stream=answers
+    )
+    deadline = Deadline(DeadlineSettings(total=1.0), lambda: now[0], started=0.0)
+
+    assert list(Failover(RouteDecision([provider], {}), deadline)) == []
+    assert recovering.allow_request()
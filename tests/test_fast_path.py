@@ -0,0 +1,40 @@
+import pytest
+
+from agent import fast_path, llm_caller
+from agent.fast_path import DICE, FastPathSettings, match_fast_path
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(
+        fast_path,
+        "_stats",
+        {"requests": 0, "upstream_calls_saved": 0, "intents": {}},
+    )
+
+
+@pytest.mark.parametrize("text", ["roll 2d6", "roll 1d20 and 2d6!", "dice 3d8 please"])
+def test_dice_requests_are_rolled_locally(text):
+    reply = llm_caller._fast_path_reply(text)
+
+    assert reply is not None and reply.startswith("🎲 Rolled a ")
+    assert fast_path.fast_path_stats()["intents"][DICE]["answered"] == 1
+
+
+@pytest.mark.parametrize(
+    "text", ["2d6", "dice", "roll a die", "roll d6", "roll 0d6", "roll 2d0", "roll 2d1"]
+)
+def test_what_the_dice_roller_cant_answer_goes_to_the_llm(text):
+    assert match_fast_path(text) is None
+    assert llm_caller._fast_path_reply(text) is None
+    # Counted as a request, not as a dice request that went unanswered
+    assert fast_path.fast_path_stats()["intents"] == {}
+
+
+def test_large_rolls_go_to_the_llm():
+    settings = FastPathSettings(max_dice=100, max_sides=1000)
+
+    assert match_fast_path("roll 100d1000", settings).name == DICE
+    assert match_fast_path("roll 101d6", settings) is None
+    assert match_fast_path("roll 1000000d1000000", settings) is None
+    assert match_fast_path("roll 2d6 and 2d1001", settings) is None
@@ -0,0 +1,117 @@
+import pytest
+
+from agent.health import CLOSED, HALF_OPEN, OPEN, BreakerSettings, CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("openai", BreakerSettings(), clock)
+
+
+def trip(breaker: CircuitBreaker):
+    for _ in range(5):
+        assert breaker.allow_request()
+        breaker.record_failure(RuntimeError("boom"))
+
+
+def test_stays_closed_below_min_requests(breaker):
+    for _ in range(4):
+        breaker.record_failure()
+
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_stays_closed_below_the_error_rate(breaker):
+    for _ in range(3):
+        breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_the_error_rate(breaker):
+    trip(breaker)
+
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()["last_error"] == "RuntimeError('boom')"
+
+
+def test_old_outcomes_leave_the_window(breaker, clock):
+    for _ in range(4):
+        breaker.record_failure()
+    clock.now = 61.0
+    breaker.record_failure()
+
+    assert breaker.state == CLOSED
+    assert breaker.error_rate() == 1.0
+    assert breaker.snapshot()["requests"] == 1
+
+
+def test_half_open_after_open_seconds(breaker, clock):
+    trip(breaker)
+    clock.now = 29.0
+    assert breaker.state == OPEN
+
+    clock.now = 30.0
+    assert breaker.state == HALF_OPEN
+
+
+def test_half_open_lets_one_probe_through(breaker, clock):
+    trip(breaker)
+    clock.now = 30.0
+
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    # A cancelled probe frees its slot without deciding anything
+    breaker.record_cancelled()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_probe_success_closes(breaker, clock):
+    trip(breaker)
+    clock.now = 30.0
+    assert breaker.allow_request()
+
+    breaker.record_success()
+
+    assert breaker.state == CLOSED
+    # The failures that opened it are forgotten
+    assert breaker.error_rate() == 0.0
+
+
+def test_probe_failure_reopens(breaker, clock):
+    trip(breaker)
+    clock.now = 30.0
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    clock.now = 59.0
+    assert not breaker.allow_request()
+    clock.now = 60.0
+    assert breaker.state == HALF_OPEN
+    transitions = [(t["from"], t["to"]) for t in breaker.snapshot()["transitions"]]
+    assert transitions == [
+        (CLOSED, OPEN),
+        (OPEN, HALF_OPEN),
+        (HALF_OPEN, OPEN),
+        (OPEN, HALF_OPEN),
+    ]
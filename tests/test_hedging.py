@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from agent.deadlines import Deadline
+from agent.health import get_breaker
+from agent.hedging import HedgeSettings, hedged_stream
+from agent.providers import Provider
+from agent.streaming import StreamCancelled, TextBuffer
+
+PROMPTS = [{"role": "user", "content": "Why does my loop never end?"}]
+SETTINGS = HedgeSettings(enabled=True, first_token_deadline=0.01)
+
+
+def provider(name: str, stream) -> Provider:
+    return Provider(
+        name=name, default_model="model", api_key_env="UNUSED", stream=stream
+    )
+
+
+def answers(streamer, prompts, deadline):
+    streamer.append(markdown_text="The condition never becomes false.")
+
+
+class LeftStreamer(TextBuffer):
+    """A streamer whose reader has gone away"""
+
+    def append(self, **kwargs):
+        raise StreamCancelled("The user left")
+
+
+def test_winner_cancelled_downstream_is_not_a_success():
+    with pytest.raises(StreamCancelled):
+        hedged_stream(
+            LeftStreamer(),
+            PROMPTS,
+            provider("first", answers),
+            lambda: None,
+            SETTINGS,
+            Deadline.start(),
+        )
+
+    assert get_breaker("first").snapshot()["errors"] == 0
+
+
+def test_loser_without_output_is_closed_at_once():
+    closed = threading.Event()
+
+    class Response:
+        def close(self):
+            closed.set()
+
+    def waits_for_first_token(streamer, prompts, deadline):
+        watch = deadline.watch("slow")
+        watch.closes(Response())
+        closed.wait(5.0)
+        raise RuntimeError("connection closed")
+
+    streamer = TextBuffer()
+    served = hedged_stream(
+        streamer,
+        PROMPTS,
+        provider("slow", waits_for_first_token),
+        lambda: provider("fast", answers),
+        SETTINGS,
+        Deadline.start(),
+    )
+
+    assert served.name == "fast"
+    assert streamer.text == "The condition never becomes false."
+    assert closed.wait(1.0)
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from agent.keywords import (
+    CODE,
+    ERROR,
+    GREETING,
+    JAVASCRIPT,
+    TOPIC_KEYWORDS,
+    KeywordMatcher,
+    match_topics,
+)
+
+
+@pytest.mark.parametrize(
+    "text, topics",
+    [
+        ("TypeError: unsupported operand", {CODE, ERROR}),
+        ("ZeroDivisionError", {CODE, ERROR}),
+        ("my subclass breaks", {CODE}),
+        ("JavaScript please", {CODE, JAVASCRIPT}),
+        ("js", {JAVASCRIPT}),
+        ("hi there", {GREETING}),
+        # Two-letter keywords only match as a whole word
+        ("this is json", set()),
+    ],
+)
+def test_match_topics(text, topics):
+    assert match_topics(text) == topics
+
+
+def test_overlapping_keywords_are_all_found():
+    matcher = KeywordMatcher({"a": ["node"], "b": ["debug"], "c": ["bug"]})
+
+    assert matcher.match("nodebug") == {"a", "b", "c"}
+
+
+def test_same_topics_as_substring_scans():
+    # Apart from the whole-word rule for two-letter keywords, matching is the
+    # substring check the contextual fallback used to make
+    keywords = [k for words in TOPIC_KEYWORDS.values() for k in words]
+    filler = ["the ", "x", "sub", "Error", "  ", "ing", "\n", "で"]
+    rng = random.Random(0)
+    for _ in range(300):
+        text = "".join(rng.choice(keywords + filler) for _ in range(6)).lower()
+        expected = {
+            topic
+            for topic, words in TOPIC_KEYWORDS.items()
+            if any(
+                word in text
+                for word in words
+                if not (word.isascii() and len(word) <= 2)
+            )
+        }
+        # Only the topics with two-letter keywords may add whole-word matches
+        assert expected <= match_topics(text) <= expected | {GREETING, JAVASCRIPT}
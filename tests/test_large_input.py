@@ -0,0 +1,68 @@
+from agent import large_input
+from agent.deadlines import Deadline, DeadlineSettings
+from agent.formatter import HUGGINGFACE_BANNER
+from agent.large_input import CodeChunk, LargeInput, LargeInputSettings
+from agent.providers import Provider
+from agent.streaming import TextBuffer
+
+PLAN = LargeInput(
+    question="What does this do?",
+    language="python",
+    line_count=30,
+    chunks=[CodeChunk(1 + 10 * i, 10 * (i + 1), f"part {i}") for i in range(3)],
+)
+
+
+def test_reduce_keeps_its_share_of_the_deadline():
+    now = [0.0]
+    deadline = Deadline(DeadlineSettings(total=60.0), lambda: now[0])
+    reviewed = []
+
+    def slow(streamer, prompts, deadline):
+        reviewed.append(prompts[0]["content"])
+        now[0] += 20.0
+        streamer.append(markdown_text="notes")
+
+    answered = []
+
+    def answer(streamer, prompts):
+        answered.append((deadline.remaining(), prompts[-1]["content"]))
+
+    large_input.map_reduce(
+        TextBuffer(),
+        [{"role": "user", "content": "What does this do?"}],
+        PLAN,
+        [Provider("slow", "model", "SLOW_API_KEY", slow)],
+        deadline,
+        answer,
+        LargeInputSettings(workers=1, reduce_reserve=0.4),
+    )
+
+    # The third part would start after the 36 seconds the parts get
+    assert len(reviewed) == 2
+    remaining, merged = answered[0]
+    assert remaining == 20.0
+    assert "Part 3 (lines 21-30):\n(this part could not be reviewed)" in merged
+
+
+def test_local_model_is_only_tried_last():
+    remote = [Provider(name, "model", "UNUSED", None) for name in ("a", "b")]
+    local = Provider("local", "model", "UNUSED", None, last_resort=True)
+
+    rotations = [
+        [provider.name for provider in large_input._rotation(remote + [local], index)]
+        for index in range(3)
+    ]
+
+    assert rotations == [["a", "b", "local"], ["b", "a", "local"], ["a", "b", "local"]]
+
+
+def test_notes_leave_out_the_hugging_face_banner():
+    def banner(streamer, prompts, deadline):
+        streamer.append(markdown_text=HUGGINGFACE_BANNER + "Parses a config file.")
+
+    notes = large_input._analyze_part(
+        PLAN, 0, [Provider("huggingface", "model", "UNUSED", banner)], Deadline.start()
+    )
+
+    assert notes == "Parses a config file."
@@ -0,0 +1,19 @@
+from agent.prompt_budget import BudgetSettings
+
+
+def test_default_models_get_their_context_window():
+    settings = BudgetSettings()
+
+    assert settings.budget_for("gpt-4o-mini") == 126000
+    assert settings.budget_for("meta/meta-llama-3-8b-instruct") == 6192
+    assert settings.budget_for("some/other-model") == 8000
+
+
+def test_env_budgets_override_the_context_windows(monkeypatch):
+    monkeypatch.setenv("LLM_PROMPT_BUDGETS", "gpt-4o-mini=16000,my/model=4000")
+
+    settings = BudgetSettings.from_env()
+
+    assert settings.budget_for("gpt-4o-mini") == 16000
+    assert settings.budget_for("my/model") == 4000
+    assert settings.budget_for("Qwen/Qwen2.5-Coder-32B-Instruct") == 30768
@@ -0,0 +1,85 @@
+from agent.health import get_breaker
+from agent.providers import Provider
+from agent.router import PRIORITY, Router, RoutingPolicy
+
+
+def make_provider(name: str, **kwargs) -> Provider:
+    return Provider(
+        name=name,
+        default_model="model",
+        api_key_env=f"{name.upper()}_API_KEY",
+        stream=lambda streamer, prompts, deadline: None,
+        **kwargs,
+    )
+
+
+def observe(router: Router, name: str, first_token_ms: float, tokens_per_second):
+    deltas = 100
+    router.observe(
+        {
+            "provider": name,
+            "first_token_ms": first_token_ms,
+            "last_token_ms": first_token_ms + (deltas - 1) / tokens_per_second * 1000,
+            "deltas": deltas,
+        }
+    )
+
+
+def names(decision):
+    return [provider.name for provider in decision.providers]
+
+
+def test_latency_ranks_faster_provider_first():
+    router = Router()
+    openai, groq = make_provider("openai"), make_provider("groq")
+    observe(router, "openai", 1500, 40)
+    observe(router, "groq", 300, 200)
+
+    assert names(router.rank([openai, groq])) == ["groq", "openai"]
+
+
+def test_last_resort_comes_after_slower_remote_providers():
+    router = Router()
+    local = make_provider("local", last_resort=True)
+    openai, huggingface = make_provider("openai"), make_provider("huggingface")
+    # Without samples the local model would score the 7000ms prior, ahead of a
+    # healthy OpenAI at 9000ms
+    observe(router, "openai", 1500, 40)
+
+    decision = router.rank([local, openai, huggingface])
+
+    assert names(decision)[-1] == "local"
+    assert set(names(decision)[:2]) == {"openai", "huggingface"}
+    assert decision.details["ranking"][-1]["expected_ms"] is None
+
+
+def test_last_resort_comes_after_providers_with_an_open_circuit():
+    router = Router()
+    local = make_provider("local", last_resort=True)
+    openai = make_provider("openai")
+    breaker = get_breaker("openai")
+    for _ in range(5):
+        breaker.record_failure()
+
+    assert names(router.rank([local, openai])) == ["openai", "local"]
+    assert router.rank([local, openai]).details["ranking"][0]["eligible"] is False
+
+
+def test_providers_without_tools_go_after_capable_ones():
+    router = Router()
+    openai = make_provider("openai", supports_tools=True)
+    groq = make_provider("groq")
+    observe(router, "groq", 100, 500)
+
+    assert names(router.rank([groq, openai], needs_tools=True)) == ["openai", "groq"]
+
+
+def test_priority_mode_keeps_the_static_order():
+    router = Router(RoutingPolicy(mode=PRIORITY, order=("huggingface", "openai")))
+    local = make_provider("local", last_resort=True)
+    openai, huggingface = make_provider("openai"), make_provider("huggingface")
+    observe(router, "openai", 100, 500)
+
+    decision = router.rank([local, openai, huggingface])
+
+    assert names(decision) == ["huggingface", "openai", "local"]
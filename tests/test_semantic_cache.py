@@ -0,0 +1,55 @@
+import sys
+import time
+
+import numpy as np
+
+from agent.providers import Provider
+from agent.semantic_cache import (
+    Embedder,
+    SemanticCache,
+    SemanticCacheSettings,
+    VectorIndex,
+)
+
+PROMPTS = [{"role": "user", "content": "How do I reverse a list?"}]
+PROVIDER = Provider("openai", "model", "UNUSED", None)
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text: str) -> np.ndarray:
+        self.encoded.append(text)
+        return np.array([1.0, 0.0], dtype=np.float32)
+
+
+def test_put_reuses_the_lookups_embedding_and_saves_off_the_request(tmp_path):
+    embedder = FakeEmbedder()
+    path = str(tmp_path / "index.npz")
+    cache = SemanticCache(SemanticCacheSettings(path=path, save_every=1), embedder)
+
+    assert cache.lookup(PROMPTS, [PROVIDER]) is None
+    cache.put(PROMPTS, PROVIDER, "Use reversed() or slicing.")
+    cache.flush()
+
+    assert embedder.encoded == ["How do I reverse a list?"]
+    assert cache.lookup(PROMPTS, [PROVIDER]) == (PROVIDER, "Use reversed() or slicing.")
+    assert len(VectorIndex.load(path, 2, 10)) == 1
+
+
+def test_failed_model_load_is_retried_later(monkeypatch):
+    monkeypatch.setitem(sys.modules, "transformers", None)
+    embedder = Embedder("missing/model")
+
+    assert embedder.encode("hello") is None
+    for _ in range(100):
+        if not embedder._loading:
+            break
+        time.sleep(0.01)
+
+    assert not embedder._loading
+    assert embedder._failed_at is not None
+    # Not retried on every request, only once _RETRY_LOAD_AFTER has passed
+    embedder.start_loading()
+    assert not embedder._loading
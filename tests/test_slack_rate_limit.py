@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+from slack_sdk import WebClient
+
+from agent.slack_rate_limit import (
+    SlackRateLimiter,
+    SlackRateLimitSettings,
+    stream_pressure,
+    token_workspace,
+)
+
+WORKSPACE = "T1"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _SkippingCondition(threading.Condition):
+    """A Condition whose waits move the fake clock on instead of sleeping"""
+
+    def __init__(self, clock: FakeClock):
+        super().__init__()
+        self.clock = clock
+
+    def wait(self, timeout=None):
+        self.clock.now += timeout
+        return False
+
+
+def limiter(**settings) -> SlackRateLimiter:
+    clock = FakeClock()
+    limiter = SlackRateLimiter(SlackRateLimitSettings(**settings), clock)
+    limiter._condition = _SkippingCondition(clock)
+    return limiter
+
+
+def test_calls_wait_for_their_methods_rate():
+    # Tier 4 refills 100 calls a minute; 1.2 seconds of it is a bucket of two
+    slack = limiter(burst_seconds=1.2)
+
+    assert slack.acquire(WORKSPACE, "chat.appendStream") == 0
+    assert slack.acquire(WORKSPACE, "chat.appendStream") == 0
+    assert slack.acquire(WORKSPACE, "chat.appendStream") == pytest.approx(0.6)
+
+
+def test_stop_and_feedback_never_wait_behind_appends():
+    slack = limiter(burst_seconds=1.2)
+    slack.acquire(WORKSPACE, "chat.appendStream")
+    slack.acquire(WORKSPACE, "chat.appendStream")
+    slack.rate_limited(WORKSPACE, "chat.appendStream", 5.0)
+
+    assert slack.acquire(WORKSPACE, "chat.stopStream") == 0
+    assert slack.acquire(WORKSPACE, "chat.postEphemeral") == 0
+
+
+def test_retry_after_holds_back_only_that_method():
+    slack = limiter()
+
+    slack.rate_limited(WORKSPACE, "chat.startStream", 5.0)
+
+    # chat.stopStream has the same tier, but its own limit
+    assert slack.acquire(WORKSPACE, "chat.stopStream") == 0
+    assert slack.acquire("T2", "chat.startStream") == 0
+    assert slack.acquire(WORKSPACE, "chat.startStream") == pytest.approx(5.0)
+    assert slack.stats()[f"{WORKSPACE}/chat.startStream"]["rate_limited"] == 1
+
+
+def test_pressure_is_per_workspace():
+    slack = limiter()
+
+    slack.rate_limited(WORKSPACE, "chat.appendStream", 5.0)
+
+    assert slack.pressure(WORKSPACE) == 1.0
+    assert slack.pressure("T2") == 0.0
+    assert slack.pressure(WORKSPACE, "chat.stopStream") == 0.0
+
+
+def test_stream_pressure_follows_the_streams_token(monkeypatch):
+    slack = limiter()
+    slack.rate_limited(token_workspace("xoxb-busy"), "chat.appendStream", 5.0)
+
+    class Stream:
+        def __init__(self, token):
+            self._client = WebClient(token=token)
+            self._token = None
+
+    monkeypatch.setattr("agent.slack_rate_limit._limiter", slack)
+
+    assert stream_pressure(Stream("xoxb-busy"))() == 1.0
+    assert stream_pressure(Stream("xoxb-idle"))() == 0.0
+
+
+def test_calls_go_anyway_after_max_wait():
+    slack = limiter(max_wait=2.0)
+
+    slack.rate_limited(WORKSPACE, "chat.stopStream", 60.0)
+
+    assert slack.acquire(WORKSPACE, "chat.stopStream") == pytest.approx(2.0)
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from agent.store import ResponseStore, StoreSettings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def open_store(tmp_path, clock, **settings) -> ResponseStore:
+    path = str(tmp_path / "responses.db")
+    return ResponseStore(StoreSettings(path=path, **settings), clock)
+
+
+def total_size(store: ResponseStore) -> int:
+    db = store._connection()
+    (summed,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+    assert store.stats()["bytes"] == summed
+    return summed
+
+
+def test_total_follows_writes_replacements_and_evictions(tmp_path, clock):
+    store = open_store(tmp_path, clock, max_bytes=25)
+
+    store.put("a", "x" * 10)
+    store.put("b", "y" * 10)
+    clock.now += 1
+    store.put("a", "z" * 5)
+    assert total_size(store) == 15
+
+    clock.now += 1
+    store.put("c", "w" * 15)
+    # "b" was used least recently
+    assert store.get("b") is None
+    assert store.get("a") == "z" * 5
+    assert total_size(store) == 20
+    assert store.stats()["evictions"] == 1
+
+
+def test_expired_responses_are_deleted_on_write(tmp_path, clock):
+    store = open_store(tmp_path, clock, ttl=60)
+    store.put("old", "x" * 10)
+
+    clock.now += 61
+    store.put("new", "y" * 10)
+
+    assert store.stats()["entries"] == 1
+    assert total_size(store) == 10
+
+
+def test_total_starts_from_an_existing_store(tmp_path, clock):
+    path = tmp_path / "responses.db"
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+        "size INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+    )
+    db.execute("INSERT INTO responses VALUES ('a', 'xxx', 3, 1000, 1000)")
+    db.commit()
+    db.close()
+
+    store = open_store(tmp_path, clock)
+
+    assert total_size(store) == 3
+
+
+def test_expiry_uses_the_created_index(tmp_path, clock):
+    store = open_store(tmp_path, clock)
+
+    plan = store._connection().execute(
+        "EXPLAIN QUERY PLAN DELETE FROM responses WHERE created <= ?", (0,)
+    )
+
+    assert any("responses_created" in row[-1] for row in plan)
@@ -0,0 +1,124 @@
+import pytest
+
+from agent import health, providers
+from agent.failover import UNAVAILABLE_MESSAGE
+from agent.health import HALF_OPEN, BreakerSettings, CircuitBreaker, get_breaker
+from agent.history import HistorySettings, ThreadHistory
+from agent.providers import Provider
+from agent.router import PRIORITY, Router, RoutingPolicy
+from agent.streaming import StreamTimer
+from agent.summarizer import Summarizer, SummarySettings
+
+SETTINGS = SummarySettings(enabled=True, keep_recent=2, min_new=1)
+
+
+@pytest.fixture
+def history(monkeypatch):
+    history = ThreadHistory(HistorySettings())
+    history.start("C1", "1.0")
+    for number in range(6):
+        role = "user" if number % 2 == 0 else "assistant"
+        history.add("C1", "1.0", f"1.{number + 1}", role, f"message {number}")
+    monkeypatch.setattr("agent.summarizer.get_thread_history", lambda: history)
+    return history
+
+
+@pytest.fixture
+def router(monkeypatch):
+    router = Router(RoutingPolicy(mode=PRIORITY, order=()))
+    monkeypatch.setattr("agent.router._router", router)
+    monkeypatch.setattr("agent.streaming._timings_listeners", [router.observe])
+    monkeypatch.setattr(providers, "_providers", {})
+    return router
+
+
+def register(monkeypatch, name: str, stream):
+    monkeypatch.setenv(f"{name.upper()}_API_KEY", "test-key")
+    providers.register_provider(
+        Provider(
+            name=name,
+            default_model="model",
+            api_key_env=f"{name.upper()}_API_KEY",
+            stream=stream,
+        )
+    )
+
+
+def writes(text: str):
+    def stream(streamer, prompts, deadline):
+        timer = StreamTimer("writer")
+        timer.mark(text)
+        streamer.append(markdown_text=text)
+        timer.report()
+
+    return stream
+
+
+def test_canned_answer_keeps_the_turns(monkeypatch, history, router):
+    register(monkeypatch, "apologetic", writes(UNAVAILABLE_MESSAGE))
+    register(monkeypatch, "silent", writes("   "))
+
+    with pytest.raises(RuntimeError):
+        Summarizer(SETTINGS)._summarize("C1", "1.0")
+
+    assert history.summary_input("C1", "1.0", 2) == (
+        None,
+        [
+            ("1.1", "user", "message 0"),
+            ("1.2", "assistant", "message 1"),
+            ("1.3", "user", "message 2"),
+            ("1.4", "assistant", "message 3"),
+        ],
+    )
+
+
+def test_summaries_leave_breakers_and_latency_alone(monkeypatch, history, router):
+    now = [0.0]
+    recovering = CircuitBreaker("recovering", BreakerSettings(), lambda: now[0])
+    for _ in range(5):
+        recovering.record_failure()
+    now[0] = 60.0
+    assert recovering.state == HALF_OPEN
+    monkeypatch.setitem(health._breakers, "recovering", recovering)
+    register(monkeypatch, "recovering", writes("never asked"))
+    register(monkeypatch, "healthy", writes("The user debugs a loop."))
+
+    Summarizer(SETTINGS)._summarize("C1", "1.0")
+
+    assert history.prompts("C1", "1.0")[0]["content"].endswith(
+        "The user debugs a loop."
+    )
+    # The probe slot is still free for a live request
+    assert recovering.allow_request()
+    assert get_breaker("healthy").snapshot()["requests"] == 0
+    assert router.stats() == {}
+
+
+def test_trimmed_turns_wait_for_the_summary(monkeypatch, router):
+    history = ThreadHistory(HistorySettings(max_messages=4, summaries=True))
+    history.start("C1", "1.0")
+    for number in range(6):
+        role = "user" if number % 2 == 0 else "assistant"
+        history.add("C1", "1.0", f"1.{number + 1}", role, f"message {number}")
+    monkeypatch.setattr("agent.summarizer.get_thread_history", lambda: history)
+    asked = []
+
+    def summarizes(streamer, prompts, deadline):
+        asked.append(prompts[1]["content"])
+        writes("The user debugs a loop.")(streamer, prompts, deadline)
+
+    register(monkeypatch, "healthy", summarizes)
+
+    # The two oldest turns are no longer sent, but still get summarized
+    assert len(history.prompts("C1", "1.0")) == 4
+    Summarizer(SETTINGS)._summarize("C1", "1.0")
+
+    assert "User: message 0" in asked[0]
+
+    prompts = history.prompts("C1", "1.0")
+    assert prompts[0]["content"].endswith("The user debugs a loop.")
+    assert [prompt["content"] for prompt in prompts[1:]] == [
+        "message 4",
+        "message 5",
+    ]
+    assert history.summary_input("C1", "1.0", 2) is None